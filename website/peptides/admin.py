@@ -4,6 +4,7 @@ from django.http import HttpResponseRedirect
 from django.shortcuts import render
 from django.urls import path
 
+from .caching import invalidate
 from .models import Protein, Alignment, Isoform, Peptide
 
 admin.site.register(Protein)
@@ -24,6 +25,7 @@ class PeptideAdmin(admin.ModelAdmin):
 is_peptide_str = re.compile('[ACDEFGHIKLMNPQRSTVWY]+').fullmatch
 
 def peptides_from_csv(request, *args, **kwargs):
+    from .masses import set_masses
     csv_file = request.FILES.get('csv_file')
     # this is an UploadedFile object
     # see https://docs.djangoproject.com/en/4.1/ref/files/uploads/#django.core.files.uploadedfile.UploadedFile
@@ -65,7 +67,9 @@ def peptides_from_csv(request, *args, **kwargs):
         else:
             pep = Peptide(prot = fields[0], peptide = fields[1])
         peps.append(pep)
-    Peptide.objects.bulk_create(peps)
+    Peptide.objects.bulk_create(set_masses(peps))
+    # bulk_create doesn't send post_save signals
+    invalidate()
     return HttpResponseRedirect('/admin/peptides/peptide')
 
 
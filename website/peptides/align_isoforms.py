@@ -1,30 +1,136 @@
 # lib libraries
+import asyncio
 import logging
+import subprocess
 import time
 import traceback
-# 3rd-party libraries
-from Bio.Seq import Seq
-from Bio.SeqRecord import SeqRecord
-import requests
-from requests import Timeout
+
+from . import http_client, metrics
+from .timing import phase
 
 logging.basicConfig(level = logging.WARNING,
                     format = '%(levelname)s: %(asctime)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
 
 # see https://rest.uniprot.org/docs/#/
-BASE_QUERY = "https://rest.uniprot.org/uniprotkb/search?query=accession%3D"
-def get_protein(acc_num: str) -> dict:
+UNIPROT_API_URL = "https://rest.uniprot.org"
+BASE_QUERY = UNIPROT_API_URL + "/uniprotkb/search?query=accession%3D"
+EBI_CLUSTALO_URL = "https://www.ebi.ac.uk/Tools/services/rest/clustalo"
+# seconds between the first few checks on an EBI alignment job
+EBI_PING_INTERVAL = 4
+
+def set_api_urls(uniprot: str = None, ebi: str = None):
+    '''Point the UniProt and/or EBI Clustal Omega requests at other servers,
+    e.g. the local stub server in stub_server.py.
+    uniprot replaces https://rest.uniprot.org,
+    ebi replaces https://www.ebi.ac.uk/Tools/services/rest/clustalo'''
+    global UNIPROT_API_URL, BASE_QUERY, EBI_CLUSTALO_URL
+    if uniprot:
+        UNIPROT_API_URL = uniprot.rstrip('/')
+        BASE_QUERY = UNIPROT_API_URL + "/uniprotkb/search?query=accession%3D"
+    if ebi:
+        EBI_CLUSTALO_URL = ebi.rstrip('/')
+
+# called with {name: sequence} before any alignment is computed;
+# returns an alignment of those sequences that we already have, or None
+ALIGNMENT_STORE = None
+# called with {name: sequence} if ALIGNMENT_STORE has no alignment; returns
+# (an alignment we already have of some of them, {name: sequence} of the rest) or None
+PARTIAL_ALIGNMENT_STORE = None
+# with more new sequences than this, the whole family is aligned again
+MAX_SEQUENCES_ADDED = 2
+
+def set_alignment_store(lookup, partial_lookup=None):
+    '''Make request_multi_alignment and align_locally reuse the alignments
+    that lookup(seqs) returns, e.g. models.stored_alignment, and add new
+    sequences to the alignments that partial_lookup(seqs) returns,
+    e.g. models.partial_alignment, by profile_align'''
+    global ALIGNMENT_STORE, PARTIAL_ALIGNMENT_STORE
+    ALIGNMENT_STORE = lookup
+    PARTIAL_ALIGNMENT_STORE = partial_lookup
+
+def stored_alignment(seqs: dict) -> str:
+    '''ALIGNMENT_STORE's alignment of seqs, or None'''
+    if ALIGNMENT_STORE is None:
+        return None
+    try:
+        alignment = ALIGNMENT_STORE(seqs)
+    except Exception as ex:
+        # not finding an alignment only costs time
+        logging.warning(f"Error while looking for a stored alignment of {list(seqs)}:\r\n{ex}")
+        return None
+    if alignment:
+        metrics.ALIGNMENTS_REUSED.inc()
+        return alignment
+    return extended_alignment(seqs)
+
+def extended_alignment(seqs: dict) -> str:
+    '''PARTIAL_ALIGNMENT_STORE's alignment of most of seqs with the rest added
+    (if there are at most MAX_SEQUENCES_ADDED of them), or None'''
+    if PARTIAL_ALIGNMENT_STORE is None:
+        return None
+    try:
+        partial = PARTIAL_ALIGNMENT_STORE(seqs)
+        if not partial or len(partial[1]) > MAX_SEQUENCES_ADDED:
+            return None
+        from .profile_align import extend_alignment
+        alignment = extend_alignment(*partial)
+    except Exception as ex:
+        logging.warning(f"Error while extending a stored alignment of {list(seqs)}:\r\n{ex}")
+        return None
+    metrics.ALIGNMENTS_EXTENDED.inc()
+    return alignment
+
+# Only ask UniProt for what we use, instead of the whole entry
+# (63 KB for P56856). See https://rest.uniprot.org/configure/uniprotkb/result-fields
+MINIMAL_FIELDS = 'accession,sequence,cc_alternative_products'
+# all we need from the entries of isoforms
+SEQUENCE_FIELDS = 'accession,sequence'
+
+def get_protein(acc_num: str, fields: str = MINIMAL_FIELDS) -> dict:
     '''Get the information in UniProt associated with accession number acc_num.
+    By default only the accession number, sequence and alternative products
+    (isoforms) are returned; fields=None gets the full entry.
     API documentation: https://rest.uniprot.org/docs/#/uniprotkb/searchCursor
     '''
-    resp = requests.get(BASE_QUERY + acc_num)
     try:
+        with phase('uniprot'):
+            resp = http_client.get(protein_url(acc_num, fields), service='uniprot')
         resp.raise_for_status()
     except Exception as ex:
+        count_error(ex, 'uniprot')
         logging.error(f"Error while getting protein:\r\n{ex}")
         raise
     return resp.json()['results'][0]
 
+def protein_url(acc_num: str, fields: str = MINIMAL_FIELDS) -> str:
+    url = BASE_QUERY + acc_num
+    if fields:
+        url += '&fields=' + fields
+    return url
+
+def count_error(ex: Exception, service: str):
+    '''count a failed call to service ('uniprot' or 'ebi') in the metrics'''
+    if http_client.is_timeout(ex):
+        metrics.EXTERNAL_TIMEOUTS.inc(service=service)
+    metrics.EXTERNAL_ERRORS.inc(service=service)
+
+def search_proteins(acc_nums: list, fields: str = SEQUENCE_FIELDS) -> list:
+    '''The UniProt entries (with only `fields`) of up to 500 accession numbers,
+    including isoforms, in one request. Accession numbers that UniProt
+    doesn't know are left out.
+    '''
+    query = ' OR '.join(f'accession:{acc_num}' for acc_num in acc_nums)
+    params = {'query': query, 'fields': fields, 'includeIsoform': 'true', 'size': len(acc_nums)}
+    try:
+        with phase('uniprot'):
+            resp = http_client.get(UNIPROT_API_URL + '/uniprotkb/search', service='uniprot', params=params)
+        resp.raise_for_status()
+    except Exception as ex:
+        count_error(ex, 'uniprot')
+        logging.error(f"Error while searching for {len(acc_nums)} proteins:\r\n{ex}")
+        raise
+    return resp.json()['results']
+
 def get_sequence(prot: dict) -> str:
     '''prot: JSON from the UniProt API for a protein
     
@@ -41,7 +147,8 @@ def get_isoform_ids(prot: dict) -> list:
 
     Returns: a list of the UniProt accession nums for all isoforms
     '''
-    comments = prot['comments']
+    # UniProt leaves out comments entirely if there are none
+    comments = prot.get('comments', [])
     out = set()
     for comment in comments:
         if comment['commentType'] != 'ALTERNATIVE PRODUCTS':
@@ -59,17 +166,22 @@ def get_isoform_ids(prot: dict) -> list:
                 out.add(iso_id)
     return sorted(out)
 
-def get_isoforms(prot: dict) -> dict:
+def get_isoforms(prot: dict, known: dict = None) -> dict:
     '''prot: JSON from the UniProt API for a protein
+    known: UniProt API JSON already downloaded, by accession number;
+    these isoforms aren't downloaded again
 
     Returns: A mapping of UniProt accession nums to the UniProt API JSON
-    for all isoforms of the protein
+    (just the accession number and sequence) for all isoforms of the protein
     '''
     iso_ids = get_isoform_ids(prot)
     seqs = {}
     for id_ in iso_ids:
+        if known and id_ in known:
+            seqs[id_] = known[id_]
+            continue
         try:
-            seqs[id_] = get_protein(id_)
+            seqs[id_] = get_protein(id_, fields=SEQUENCE_FIELDS)
         except Exception as ex:
             logging.info(f"Error while getting protein with isoform id {id_}:\r\n{ex}")
             continue
@@ -82,10 +194,13 @@ def get_all_prots(acc_num: str) -> dict:
     isoforms of a protein to the UniProt API JSON for that isoform.
     '''
     prot = get_protein(acc_num)
-    prots = {acc_num: prot}
+    return distinct_isoforms(acc_num, prot, get_isoforms(prot, known={acc_num: prot}))
+
+def distinct_isoforms(acc_num: str, prot: dict, isos: dict) -> dict:
+    '''{acc_num: prot, **isos} without the isoforms
+    with the same sequence as the protein'''
     seq = get_sequence(prot)
-    isos = get_isoforms(prot)
-    # remove the isoforms with the same sequence as the base acc num
+    isos = dict(isos)
     for iso_acc_num, iso in list(isos.items()):
         try:
             iso_seq = get_sequence(iso)
@@ -93,7 +208,7 @@ def get_all_prots(acc_num: str) -> dict:
             continue
         if iso_acc_num != acc_num and iso_seq == seq:
             del isos[iso_acc_num]
-    return {**prots, **isos}
+    return {acc_num: prot, **isos}
 
 def get_all_seqs(prots: dict) -> dict:
     '''prots: a dict mapping accession numbers to UniProt API JSON
@@ -119,6 +234,8 @@ def to_fasta(seqs: dict, sort: bool = True) -> str:
     Returns: The accession numbers and sequences of those proteins in FASTA
     format.
     '''
+    from Bio.Seq import Seq
+    from Bio.SeqRecord import SeqRecord
     fasta = ''
     if sort:
         seqs = dict(sorted(seqs.items(), key = lambda x: x[0]))
@@ -135,43 +252,80 @@ def request_multi_alignment(seqs: dict) -> str:
     for multiple alignment of several sequences.
 
     seqs: a dict mapping UniProt accession numbers to protein sequences.
+    If the same sequences have been aligned before, returns that alignment instead;
+    if all but one or two of them have, adds those to that alignment.
     '''
-    fasta = to_fasta(seqs)
-    r = requests.post(
-        "https://www.ebi.ac.uk/Tools/services/rest/clustalo/run", 
-        data={
-            "email": "mjolsonsfca@gmail.com",
-            "iterations": 1,
-            "outfmt": "clustal_num",
-            "order": "aligned",
-            "sequence": fasta
-           }
-    )
+    alignment = stored_alignment(seqs)
+    if alignment:
+        return alignment
+    try:
+        with metrics.ALIGNMENT_JOBS_IN_PROGRESS.track_inprogress():
+            return _request_multi_alignment(seqs)
+    except Exception as ex:
+        count_error(ex, 'ebi')
+        raise
+
+def ebi_run_data(seqs: dict) -> dict:
+    '''the form to POST to the EBI to start aligning seqs'''
+    return {
+        "email": "mjolsonsfca@gmail.com",
+        "iterations": 1,
+        "outfmt": "clustal_num",
+        "order": "aligned",
+        "sequence": to_fasta(seqs)
+    }
+
+def _request_multi_alignment(seqs: dict) -> str:
+    with phase('ebi_run'):
+        r = http_client.post(f"{EBI_CLUSTALO_URL}/run", service='ebi', data=ebi_run_data(seqs))
     r.raise_for_status()
     job_id = r.text
     job_status = 'RUNNING'
-    ping_interval = 4
+    ping_interval = EBI_PING_INTERVAL
     pings = 0
     # ping the server every few seconds to see if the job is done
     while job_status == 'RUNNING':
-        time.sleep(ping_interval)
+        with phase('ebi_wait'):
+            time.sleep(ping_interval)
         pings += 1
         if pings % 5 == 0:
             ping_interval *= 2
             # we'll just assume that the server can't respond right now if it takes too long
             # to respond. With this schedule, the EBI computer has 300 seconds to respond.
-            if ping_interval == 64:
+            if pings == 20:
+                metrics.ALIGNMENT_JOB_POLLS.observe(pings)
+                from requests import Timeout
                 raise Timeout()
-        job_status_req = requests.get(
-            f"https://www.ebi.ac.uk/Tools/services/rest/clustalo/status/{job_id}")
+        with phase('ebi_status'):
+            job_status_req = http_client.get(
+                f"{EBI_CLUSTALO_URL}/status/{job_id}", service='ebi')
         job_status_req.raise_for_status()
         job_status = job_status_req.text
+    metrics.ALIGNMENT_JOB_POLLS.observe(pings)
     # now that the job is done, get the alignment
-    resp = requests.get(
-        f"https://www.ebi.ac.uk/Tools/services/rest/clustalo/result/{job_id}/aln-clustal_num")
+    with phase('ebi_result'):
+        resp = http_client.get(
+            f"{EBI_CLUSTALO_URL}/result/{job_id}/aln-clustal_num", service='ebi')
     resp.raise_for_status()
     return resp.text
 
+def align_locally(seqs: dict, clustalo: str = 'clustalo') -> str:
+    '''Same as request_multi_alignment, but runs a local installation of
+    Clustal Omega (http://www.clustal.org/omega/) instead of asking the EBI.
+    Raises FileNotFoundError if the clustalo executable can't be found.
+    '''
+    alignment = stored_alignment(seqs)
+    if alignment:
+        return alignment
+    fasta = to_fasta(seqs)
+    with phase('clustalo'):
+        proc = subprocess.run(
+            [clustalo, '--infile=-', '--outfmt=clustal', '--resno',
+                '--iterations=1', '--output-order=tree-order'],
+            input=fasta, capture_output=True, text=True, check=True
+        )
+    return proc.stdout
+
 def align_isoforms(acc_num: str) -> tuple:
     '''get all isoforms of the protein with accession number acc_num,
     and return a tuple:
@@ -192,4 +346,100 @@ def align_isoforms(acc_num: str) -> tuple:
         return seqs, request_multi_alignment(seqs)
     except Exception as ex:
         logging.error(f"Error while trying to retrieve alignment for proteins {list(seqs.keys())}:\r\n{ex}")
-        return seqs, None
\ No newline at end of file
+        return seqs, None
+# The same for async views: while waiting on UniProt or the EBI (mostly the
+# sleeps between checks on an EBI job), the event loop serves other requests.
+
+async def aget_protein(acc_num: str, fields: str = MINIMAL_FIELDS) -> dict:
+    '''get_protein, without blocking the event loop'''
+    try:
+        with phase('uniprot'):
+            resp = await http_client.aget(protein_url(acc_num, fields), service='uniprot')
+        resp.raise_for_status()
+    except Exception as ex:
+        count_error(ex, 'uniprot')
+        logging.error(f"Error while getting protein:\r\n{ex}")
+        raise
+    return resp.json()['results'][0]
+
+async def aget_isoforms(prot: dict, known: dict = None) -> dict:
+    '''get_isoforms, downloading all the isoforms at once'''
+    iso_ids = get_isoform_ids(prot)
+    missing = [id_ for id_ in iso_ids if not (known and id_ in known)]
+    found = dict(zip(missing, await asyncio.gather(
+        *(aget_protein(id_, fields=SEQUENCE_FIELDS) for id_ in missing), return_exceptions=True)))
+    seqs = {}
+    for id_ in iso_ids:
+        iso = known[id_] if id_ not in found else found[id_]
+        if isinstance(iso, Exception):
+            logging.info(f"Error while getting protein with isoform id {id_}:\r\n{iso}")
+            continue
+        seqs[id_] = iso
+    return seqs
+
+async def aget_all_prots(acc_num: str) -> dict:
+    '''get_all_prots, without blocking the event loop'''
+    prot = await aget_protein(acc_num)
+    return distinct_isoforms(acc_num, prot, await aget_isoforms(prot, known={acc_num: prot}))
+
+async def arequest_multi_alignment(seqs: dict) -> str:
+    '''request_multi_alignment, without blocking the event loop
+    (looking for a stored alignment runs in Django's thread for sync code)'''
+    from asgiref.sync import sync_to_async
+    alignment = await sync_to_async(stored_alignment)(seqs)
+    if alignment:
+        return alignment
+    try:
+        with metrics.ALIGNMENT_JOBS_IN_PROGRESS.track_inprogress():
+            return await _arequest_multi_alignment(seqs)
+    except Exception as ex:
+        count_error(ex, 'ebi')
+        raise
+
+async def _arequest_multi_alignment(seqs: dict) -> str:
+    with phase('ebi_run'):
+        r = await http_client.apost(f"{EBI_CLUSTALO_URL}/run", service='ebi', data=ebi_run_data(seqs))
+    r.raise_for_status()
+    job_id = r.text
+    job_status = 'RUNNING'
+    ping_interval = EBI_PING_INTERVAL
+    pings = 0
+    # the same schedule as _request_multi_alignment
+    while job_status == 'RUNNING':
+        with phase('ebi_wait'):
+            await asyncio.sleep(ping_interval)
+        pings += 1
+        if pings % 5 == 0:
+            ping_interval *= 2
+            if pings == 20:
+                metrics.ALIGNMENT_JOB_POLLS.observe(pings)
+                from requests import Timeout
+                raise Timeout()
+        with phase('ebi_status'):
+            job_status_req = await http_client.aget(
+                f"{EBI_CLUSTALO_URL}/status/{job_id}", service='ebi')
+        job_status_req.raise_for_status()
+        job_status = job_status_req.text
+    metrics.ALIGNMENT_JOB_POLLS.observe(pings)
+    with phase('ebi_result'):
+        resp = await http_client.aget(
+            f"{EBI_CLUSTALO_URL}/result/{job_id}/aln-clustal_num", service='ebi')
+    resp.raise_for_status()
+    return resp.text
+
+async def aalign_isoforms(acc_num: str) -> tuple:
+    '''align_isoforms, without blocking the event loop'''
+    try:
+        seqs = get_all_seqs(await aget_all_prots(acc_num))
+    except Exception as ex:
+        logging.error(f"Error while retreiving data from UniProt for accession number {acc_num}:\r\n{ex}")
+        return None, None
+    if len(seqs) < 2:
+        logging.info(f"We could only find one isoform of the protein with UniProt accession number {acc_num} on UniProt.")
+        return seqs, list(seqs.values())[0]
+    try:
+        logging.info(f"Got sequences\r\n{seqs}")
+        return seqs, await arequest_multi_alignment(seqs)
+    except Exception as ex:
+        logging.error(f"Error while trying to retrieve alignment for proteins {list(seqs.keys())}:\r\n{ex}")
+        return seqs, None
@@ -0,0 +1,129 @@
+'''Where each residue of each isoform is in a multiple sequence alignment.
+
+A residue's column is its location in the isoform plus the number of gaps
+before it in the aligned sequence. That gap count only changes after a run
+of gaps, so each Alignment stores, for each isoform, the residues where it
+changes (Alignment.column_map, two numbers per gap run). Loading expands
+them into NumPy arrays indexed by residue and by column, so finding a
+residue's column, a column's residue, or the residues of every other
+isoform aligned with a peptide is a few array lookups, however long the
+alignment.
+'''
+import numpy as np
+
+from .sequence_chunkers import parse_clustal_num
+
+
+def gap_runs(aligned: str) -> list:
+    '''[[residue, gaps before it], ...] for residue 0 and every residue
+    with more gaps before it than the residue before it, then
+    [number of residues, number of gaps] (so trailing gaps are included)'''
+    is_res = np.frombuffer(aligned.encode(), dtype=np.uint8) != ord('-')
+    n_res = int(is_res.sum())
+    gaps_before = np.flatnonzero(is_res) - np.arange(n_res)
+    starts = np.flatnonzero(np.diff(gaps_before, prepend=-1))
+    runs = [[int(res), int(gaps_before[res])] for res in starts]
+    runs.append([n_res, len(aligned) - n_res])
+    return runs
+
+
+def compact_column_map(seq_map: dict) -> dict:
+    '''what Alignment.column_map stores for an alignment (seq_map as from
+    parse_clustal_num): {"length": number of columns,
+    "gaps": {accession number: gap_runs of its aligned sequence}}'''
+    length = len(next(iter(seq_map.values()), ''))
+    return {'length': length, 'gaps': {acc_num: gap_runs(seq) for acc_num, seq in seq_map.items()}}
+
+
+def clustal_column_map(clustal: str) -> dict:
+    '''compact_column_map of a clustal_num alignment,
+    or {} if clustal isn't one'''
+    try:
+        _, seq_map, _ = parse_clustal_num(clustal)
+    except ValueError:
+        return {}
+    if not seq_map or len({len(seq) for seq in seq_map.values()}) > 1:
+        return {}
+    return compact_column_map(seq_map)
+
+
+class ColumnMap:
+    '''residue <-> column lookups for every sequence in an alignment'''
+    def __init__(self, compact: dict, seqs: dict = None):
+        '''compact: from compact_column_map.
+        seqs: {accession number: ungapped sequence}, for project_peptide'''
+        self.length = compact['length']
+        self.seqs = seqs or {}
+        # the column of each residue
+        self.columns = {}
+        # the number of residues before each column, and after the last one
+        self.before = {}
+        for acc_num, runs in compact['gaps'].items():
+            runs = np.array(runs, dtype=np.int64).reshape(-1, 2)
+            run_lengths = np.diff(runs[:, 0])
+            n_res = runs[-1, 0]
+            cols = np.arange(n_res) + np.repeat(runs[:-1, 1], run_lengths)
+            self.columns[acc_num] = cols
+            before = np.zeros(self.length + 1, dtype=np.int64)
+            before[cols + 1] = 1
+            self.before[acc_num] = np.cumsum(before)
+
+    @classmethod
+    def from_clustal(cls, clustal: str, compact: dict = None) -> 'ColumnMap':
+        '''the ColumnMap of a clustal_num alignment, with its sequences
+        (compact: its compact_column_map, if already known)'''
+        _, seq_map, _ = parse_clustal_num(clustal)
+        return cls(compact or compact_column_map(seq_map),
+            {acc_num: seq.replace('-', '') for acc_num, seq in seq_map.items()})
+
+    def column(self, acc_num: str, residue: int) -> int:
+        '''the column of a residue (0-based location) of acc_num'''
+        return int(self.columns[acc_num][residue])
+
+    def residue(self, acc_num: str, column: int) -> int:
+        '''the residue of acc_num in a column, or -1 if acc_num has a gap there'''
+        before = self.before[acc_num]
+        if before[column + 1] == before[column]:
+            return -1
+        return int(before[column])
+
+    def residues_through(self, acc_num: str, column: int) -> int:
+        '''the number of residues of acc_num in columns 0 through column
+        (where a block of a clustal_num alignment ending at column is numbered)'''
+        return int(self.before[acc_num][min(column + 1, self.length)])
+
+    def project(self, acc_num: str, start: int, end: int) -> dict:
+        '''{other accession number: (start, end) of its residues aligned with
+        residues start to end (exclusive) of acc_num, or None if only gaps are}'''
+        first = self.columns[acc_num][start]
+        last = self.columns[acc_num][end - 1]
+        out = {}
+        for other, before in self.before.items():
+            if other == acc_num:
+                continue
+            other_start, other_end = int(before[first]), int(before[last + 1])
+            out[other] = (other_start, other_end) if other_end > other_start else None
+        return out
+
+    def project_peptide(self, acc_num: str, location: int, peptide: str) -> dict:
+        '''{other accession number: {"start", "end", "peptide": its residues aligned with
+        the peptide at location in acc_num, "identical": whether they are the same
+        and aligned without gaps}, or None if only gaps are}'''
+        end = location + len(peptide)
+        first = self.columns[acc_num][location]
+        span = int(self.columns[acc_num][end - 1] - first) + 1
+        out = {}
+        for other, projected in self.project(acc_num, location, end).items():
+            if projected is None:
+                out[other] = None
+                continue
+            other_start, other_end = projected
+            other_pep = self.seqs.get(other, '')[other_start:other_end]
+            out[other] = {
+                'start': other_start,
+                'end': other_end,
+                'peptide': other_pep,
+                # the same residues, filling the same columns
+                'identical': other_pep == peptide and span == len(peptide),
+            }
+        return out
@@ -0,0 +1,128 @@
+'''How conserved each column of an alignment is, and how much of each
+isoform the mass spec peptides cover.
+
+The per-column arrays only depend on the alignment, so they are computed
+once, when the alignment is saved, and stored in Alignment.column_stats
+(base64-encoded NumPy arrays, a few bytes per column). Coverage depends on
+the peptides, which change independently of the alignments, so it is
+computed when a page asks for it, with a couple of array operations per
+isoform, and cached with the page.
+'''
+import base64
+
+import numpy as np
+
+from .alignment_map import ColumnMap
+from .digest import covered
+from .sequence_chunkers import conservation_line, parse_clustal_num
+
+# columns where fewer of the sequences than this share a residue are divergent
+DIVERGENT_IDENTITY = 0.5
+# the shortest run of divergent columns worth reporting
+MIN_DIVERGENT_COLUMNS = 5
+
+
+def encode(arr: np.ndarray) -> str:
+    return base64.b64encode(arr.tobytes()).decode('ascii')
+
+
+def decode(text: str, dtype) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(text), dtype=dtype)
+
+
+def compute_column_stats(seq_map: dict) -> dict:
+    '''what Alignment.column_stats stores for an alignment (seq_map as from
+    parse_clustal_num): {"identity": percent of the sequences with the most
+    common residue in each column (uint8), "gapped": number of sequences with
+    a gap in each column (uint16), "conservation": the Clustal conservation line}'''
+    seqs = list(seq_map.values())
+    residues = np.array([np.frombuffer(seq.encode(), dtype=np.uint8) for seq in seqs]).reshape(len(seqs), -1)
+    is_gap = residues == ord('-')
+    most_common = np.zeros(residues.shape[1], dtype=np.int64)
+    for code in np.unique(residues[~is_gap]):
+        most_common = np.maximum(most_common, (residues == code).sum(axis=0))
+    identity = np.round(100 * most_common / max(1, len(seqs))).astype(np.uint8)
+    return {
+        'identity': encode(identity),
+        'gapped': encode(is_gap.sum(axis=0).astype(np.uint16)),
+        'conservation': conservation_line(seqs),
+    }
+
+
+def clustal_column_stats(clustal: str) -> dict:
+    '''compute_column_stats of a clustal_num alignment, or {} if clustal isn't one'''
+    try:
+        _, seq_map, _ = parse_clustal_num(clustal)
+        if not seq_map or len({len(seq) for seq in seq_map.values()}) > 1:
+            return {}
+        return compute_column_stats(seq_map)
+    except ValueError:
+        return {}
+
+
+def runs(mask: np.ndarray) -> list:
+    '''[[start, end], ...] (end exclusive) of each run of True in mask'''
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], mask.astype(np.int8), [0]])))
+    return edges.reshape(-1, 2).tolist()
+
+
+class AlignmentStats:
+    '''an alignment's column statistics and its sequences' peptide coverage'''
+    def __init__(self, column_stats: dict, columns: ColumnMap):
+        self.identity = decode(column_stats.get('identity', ''), np.uint8) / 100
+        self.gapped = decode(column_stats.get('gapped', ''), np.uint16)
+        self.conservation = column_stats.get('conservation', '')
+        self.columns = columns
+
+    @classmethod
+    def of(cls, alignment) -> 'AlignmentStats':
+        '''the AlignmentStats of an Alignment'''
+        stats = alignment.column_stats or clustal_column_stats(alignment.alignment)
+        return cls(stats, alignment.get_column_map())
+
+    def coverage(self, peptides) -> dict:
+        '''{accession number: boolean array, True for each residue in any of
+        peptides (objects with prot, peptide and location attributes)}'''
+        intervals = {acc_num: ([], []) for acc_num in self.columns.columns}
+        for pep in peptides:
+            if pep.prot in intervals and pep.location >= 0:
+                intervals[pep.prot][0].append(pep.location)
+                intervals[pep.prot][1].append(pep.location + len(pep.peptide))
+        out = {}
+        for acc_num, (starts, ends) in intervals.items():
+            n_res = len(self.columns.columns[acc_num])
+            out[acc_num] = covered(n_res, np.minimum(starts, n_res).astype(np.int64),
+                np.minimum(ends, n_res).astype(np.int64))
+        return out
+
+    def divergent_regions(self, threshold: float = DIVERGENT_IDENTITY,
+            min_columns: int = MIN_DIVERGENT_COLUMNS) -> list:
+        '''[{"start", "end": columns (end exclusive), "residues": {accession number:
+        [start, end] of its residues in those columns}}] for each run of at least
+        min_columns columns where fewer than threshold of the sequences share a residue'''
+        out = []
+        for start, end in runs(self.identity < threshold):
+            if end - start < min_columns:
+                continue
+            out.append({'start': start, 'end': end, 'residues': {
+                acc_num: [int(before[start]), int(before[end])]
+                for acc_num, before in self.columns.before.items()
+            }})
+        return out
+
+    def summary(self, peptides) -> list:
+        '''[{"acc_num", "residues", "covered": residues in peptides, "coverage":
+        fraction of residues in peptides, "covered_runs": [[start, end], ...],
+        "identity": mean identity of the columns of its residues}] for each sequence'''
+        out = []
+        for acc_num, mask in self.coverage(peptides).items():
+            cols = self.columns.columns[acc_num]
+            out.append({
+                'acc_num': acc_num,
+                'residues': len(mask),
+                'covered': int(mask.sum()),
+                'coverage': float(mask.mean()) if len(mask) else 0.0,
+                'covered_runs': runs(mask),
+                'identity': float(self.identity[cols].mean()) if len(cols) else 0.0,
+            })
+        return out
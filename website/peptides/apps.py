@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class PeptidesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'peptides'
+
+    def ready(self):
+        from django.conf import settings
+        from . import align_isoforms, signals
+        from .models import partial_alignment, stored_alignment
+        signals.connect()
+        align_isoforms.set_alignment_store(stored_alignment, partial_alignment)
+        align_isoforms.set_api_urls(
+            uniprot=getattr(settings, 'UNIPROT_API_URL', None),
+            ebi=getattr(settings, 'EBI_CLUSTALO_URL', None),
+        )
@@ -0,0 +1,161 @@
+'''Timing and peak memory of the functions that build the protein and
+alignment pages, on synthetic data of any size.
+
+Run them with `python manage.py benchmark`. The results are compared to
+benchmarks_baseline.json, so a change that makes any of these functions much
+slower or hungrier shows up as a regression. Record a new baseline with
+`python manage.py benchmark --save-baseline` after an intended change
+(on the same machine, since the times depend on the hardware).
+'''
+import collections
+import json
+import pathlib
+import random
+import time
+import tracemalloc
+
+import pandas as pd
+
+from .align_isoforms import to_fasta
+from .sequence_chunkers import format_clustal_num, process_clustal_num, sequence_chunks
+from .unique_peptides import uniques_per_acc_num
+
+BASELINE_FNAME = pathlib.Path(__file__).parent/'benchmarks_baseline.json'
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+# a plain stand-in for the Peptide model; the benchmarks don't touch the database
+BenchPeptide = collections.namedtuple('BenchPeptide', 'prot peptide location')
+
+# (sequence length, number of isoforms, fraction of each sequence covered by peptides)
+# titin (Q8WZ42) has about 34,000 residues and 13 isoforms
+SIZES = {
+    'small': (400, 3, 0.2),
+    'medium': (2_000, 6, 0.3),
+    'large': (8_000, 8, 0.3),
+    'titin': (34_350, 13, 0.3),
+}
+
+
+def random_sequence(length: int, rng: random.Random) -> str:
+    return ''.join(rng.choices(AMINO_ACIDS, k=length))
+
+
+def synthetic_family(length: int, n_isoforms: int, rng: random.Random) -> dict:
+    '''A made-up protein family: a dict mapping accession numbers
+    (SYNTH, SYNTH-2, SYNTH-3...) to aligned sequences of the same length.
+    Each isoform after the first is the first one with a few segments
+    replaced by gaps, like exons that were skipped.'''
+    canonical = random_sequence(length, rng)
+    aligned = {'SYNTH': canonical}
+    for iso_num in range(2, n_isoforms + 1):
+        seq = list(canonical)
+        for _ in range(rng.randint(1, 3)):
+            start = rng.randrange(length)
+            seg_len = rng.randint(5, max(5, length // 20))
+            seq[start:start + seg_len] = '-' * len(seq[start:start + seg_len])
+        aligned['SYNTH-%i' % iso_num] = ''.join(seq)
+    return aligned
+
+
+def synthetic_peptides(seqs: dict, density: float, rng: random.Random) -> list:
+    '''Non-overlapping peptides of 7 to 25 residues covering about
+    `density` of each (ungapped) sequence in seqs, sorted by protein and location.'''
+    peps = []
+    for acc_num, seq in seqs.items():
+        seq = seq.replace('-', '')
+        loc = rng.randint(0, 20)
+        while loc < len(seq) - 25:
+            pep_len = rng.randint(7, 25)
+            if rng.random() < density:
+                peps.append(BenchPeptide(acc_num, seq[loc:loc + pep_len], loc))
+            loc += pep_len
+    return peps
+
+
+def synthetic_unique_peptides(n_acc_nums: int, peps_per_acc_num: int, rng: random.Random) -> pd.DataFrame:
+    '''a table like unique_peptides.csv, where some peptides contain others'''
+    rows = []
+    for ii in range(n_acc_nums):
+        acc_num = 'SYN%03i' % ii
+        seq = random_sequence(peps_per_acc_num * 10, rng)
+        for _ in range(peps_per_acc_num):
+            start = rng.randrange(len(seq) - 30)
+            rows.append((acc_num, seq[start:start + rng.randint(7, 30)]))
+    return pd.DataFrame(rows, columns=['accession_number', 'peptide'])
+
+
+def measure(func, repeat: int = 3) -> dict:
+    '''best wall-clock time of `repeat` calls to func,
+    and peak memory allocated by Python during one more call'''
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': min(times), 'peak_kb': peak / 1024}
+
+
+def cases(size: str, seed: int = 0) -> dict:
+    '''{benchmark name: function to measure} for one of SIZES'''
+    length, n_isoforms, density = SIZES[size]
+    rng = random.Random(seed)
+    aligned = synthetic_family(length, n_isoforms, rng)
+    seqs = {acc_num: seq.replace('-', '') for acc_num, seq in aligned.items()}
+    peps = synthetic_peptides(aligned, density, rng)
+    canonical_peps = [pep for pep in peps if pep.prot == 'SYNTH']
+    clustal = format_clustal_num(aligned)
+    uniques_df = synthetic_unique_peptides(n_isoforms * 10, length // 100, rng)
+    return {
+        f'sequence_chunks[{size}]': lambda: sequence_chunks(seqs['SYNTH'], canonical_peps, 60),
+        f'process_clustal_num[{size}]': lambda: process_clustal_num(clustal, peps, 60),
+        f'to_fasta[{size}]': lambda: to_fasta(seqs),
+        f'uniques_per_acc_num[{size}]': lambda: uniques_per_acc_num(uniques_df),
+    }
+
+
+def run(sizes: list, repeat: int = 3, seed: int = 0) -> dict:
+    '''{benchmark name: {'seconds': ..., 'peak_kb': ...}} for every case of every size'''
+    results = {}
+    for size in sizes:
+        for name, func in cases(size, seed).items():
+            results[name] = measure(func, repeat)
+    return results
+
+
+def read_baseline(fname=BASELINE_FNAME) -> dict:
+    try:
+        with open(fname) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def write_baseline(results: dict, fname=BASELINE_FNAME):
+    baseline = read_baseline(fname)
+    baseline.update(results)
+    with open(fname, 'w') as f:
+        json.dump(baseline, f, indent=4, sort_keys=True)
+
+
+def regressions(results: dict, baseline: dict, tolerance: float = 1.5, min_seconds: float = 0.001) -> list:
+    '''(benchmark name, metric, baseline value, new value) for every metric
+    that got more than `tolerance` times worse than the baseline.
+    Times below min_seconds are too noisy to compare.'''
+    out = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric, value in result.items():
+            old = base.get(metric)
+            if not old or (metric == 'seconds' and max(old, value) < min_seconds):
+                continue
+            if value > old * tolerance:
+                out.append((name, metric, old, value))
+    return out
@@ -0,0 +1,126 @@
+'''Per-view page caching that is invalidated whenever the data changes.
+
+Every cached page's key includes a "generation" number stored in the cache.
+Saving or deleting a Protein, Isoform, Alignment or Peptide bumps the generation
+(see signals.py), so every page cached before the write is never served again
+and simply expires. Writes are rare compared to reads on this site,
+so this is much simpler than working out which pages each write affects.
+
+Browsers can't know about the generation, so they are told to check back
+every time (answered cheaply with 304 Not Modified by ConditionalGetMiddleware)
+instead of keeping pages for as long as the server does. Pages with a CSRF
+token are never cached, since the token belongs to one visitor.
+
+This only works if every process sees the same generation. A local-memory
+cache belongs to one process, so a write made by another worker or by a
+management command could never invalidate its pages: with LocMemCache, pages
+aren't cached at all, and per_process keeps what it builds for at most
+UNSHARED_TIMEOUT seconds.
+'''
+import time
+import uuid
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.middleware.cache import CacheMiddleware
+from django.utils.cache import patch_cache_control
+from django.utils.decorators import decorator_from_middleware_with_args
+from django.utils.http import http_date
+
+from . import metrics
+
+GENERATION_KEY = 'peptides:generation'
+# a random value stored in the cache the first time per_process builds anything,
+# so a value built before the cache was cleared isn't reused
+TOKEN_KEY = 'peptides:process_token'
+# pages are invalidated by writes, so they can live for a long time
+PAGE_TIMEOUT = 24 * 3600
+# how long per_process keeps a value when other processes' writes can't be seen
+UNSHARED_TIMEOUT = 60
+
+
+def shared() -> bool:
+    '''whether the cache is shared with other processes, so that invalidate()
+    in one of them is seen by all'''
+    return not isinstance(caches['default'], LocMemCache)
+
+
+def generation() -> int:
+    gen = cache.get(GENERATION_KEY)
+    if gen is None:
+        cache.add(GENERATION_KEY, 1, timeout=None)
+        gen = cache.get(GENERATION_KEY, 1)
+    return gen
+
+
+def invalidate():
+    '''make every page cached so far stale'''
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError: # the key was missing or evicted
+        cache.set(GENERATION_KEY, generation() + 1, timeout=None)
+
+
+class GenerationalCacheMiddleware(CacheMiddleware):
+    '''Django's CacheMiddleware, but the key prefix includes the current
+    generation. If the generation changes while a page is being built,
+    the page may already be stale, so it isn't cached. Neither are pages
+    that used a CSRF token. Unless the view set its own Cache-Control,
+    browsers must revalidate the page on every visit.
+    '''
+    @property
+    def key_prefix(self):
+        return '%s.%s' % (self._base_key_prefix, generation())
+
+    @key_prefix.setter
+    def key_prefix(self, value):
+        self._base_key_prefix = value
+
+    def process_request(self, request):
+        if not shared():
+            request._cache_update_cache = False
+            return None
+        request._cache_generation = generation()
+        response = super().process_request(request)
+        if request.method in ('GET', 'HEAD'):
+            metrics.PAGE_CACHE.inc(view=self._base_key_prefix,
+                result='miss' if response is None else 'hit')
+        return response
+
+    def process_response(self, request, response):
+        if getattr(request, '_cache_generation', None) != generation():
+            request._cache_update_cache = False
+        # django.middleware.csrf.get_token was called, e.g. by {% csrf_token %}
+        if request.META.get('CSRF_COOKIE_NEEDS_UPDATE'):
+            request._cache_update_cache = False
+        if not response.has_header('Cache-Control'):
+            # (CacheMiddleware keeps the smaller max-age, and an Expires that is already set)
+            patch_cache_control(response, no_cache=True, max_age=0)
+            response.headers['Expires'] = http_date(time.time())
+        return super().process_response(request, response)
+
+
+def cached_view(key_prefix: str, timeout: int = PAGE_TIMEOUT):
+    '''like django.views.decorators.cache.cache_page,
+    but invalidated by writes to the database'''
+    return decorator_from_middleware_with_args(GenerationalCacheMiddleware)(
+        page_timeout=timeout, key_prefix=key_prefix
+    )
+
+
+# {name: ((generation, token), value)} for per_process
+_PER_PROCESS = {}
+
+
+def per_process(name: str, build):
+    '''build(), kept in this process until the database changes
+    (i.e., until the generation changes or the cache is cleared),
+    for data too big to go through the cache on every request'''
+    stamp = (generation(), cache.get_or_set(TOKEN_KEY, uuid.uuid4().hex, timeout=None))
+    if not shared():
+        stamp += (int(time.monotonic() // UNSHARED_TIMEOUT),)
+    cached = _PER_PROCESS.get(name)
+    if cached is None or cached[0] != stamp:
+        cached = (stamp, build())
+        _PER_PROCESS[name] = cached
+    return cached[1]
@@ -0,0 +1,191 @@
+'''Compare the MS intensities of every isoform in cancer vs. non-cancer tissue,
+for all the proteins in the "isoform abundance cancer vs not" directory at once.
+
+Each wide CSV has one row per patient and two columns per isoform,
+e.g. P07585.2_C (cancer) and P07585.2_N (non-cancer),
+so the test for each isoform is a paired t-test on the per-patient differences.
+'''
+from concurrent.futures import ProcessPoolExecutor
+import math
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+CUR_DIR = pathlib.Path(__file__).parent
+DATA_DIR = CUR_DIR/'static'/'peptides'/'isoform abundance cancer vs not'
+RESULTS_FNAME = CUR_DIR/'static'/'peptides'/'differential_abundance.csv'
+
+COLUMNS = ['acc_num', 'n_patients', 'mean_cancer', 'mean_non_cancer',
+    'mean_diff', 'log2_fold_change', 'effect_size', 't_stat', 'p_value', 'q_value']
+
+
+def read_wide_csvs(fnames: list) -> pd.DataFrame:
+    '''Read some wide CSVs and return one long table with the columns
+    isoform, cancer, non_cancer (one row per isoform per patient).'''
+    parts = []
+    for fname in fnames:
+        df = pd.read_csv(fname)
+        for col in df.columns:
+            if not col.endswith('_C'):
+                continue
+            isoform = col[:-2]
+            non_cancer_col = isoform + '_N'
+            if non_cancer_col not in df.columns:
+                continue
+            parts.append(pd.DataFrame({
+                'isoform': isoform,
+                'cancer': df[col].to_numpy(dtype=float),
+                'non_cancer': df[non_cancer_col].to_numpy(dtype=float),
+            }))
+    if not parts:
+        return pd.DataFrame({'isoform': [], 'cancer': [], 'non_cancer': []})
+    return pd.concat(parts, ignore_index=True)
+
+
+def read_all(fnames: list, workers: int = None, files_per_task: int = 25) -> pd.DataFrame:
+    '''read_wide_csvs over many files, split among a pool of processes'''
+    batches = [fnames[ii:ii + files_per_task]
+        for ii in range(0, len(fnames), files_per_task)]
+    if workers == 1 or len(batches) < 2:
+        return read_wide_csvs(fnames)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parts = list(pool.map(read_wide_csvs, batches))
+    return pd.concat(parts, ignore_index=True)
+
+
+def _betacf(a, b, x, max_iter=300, eps=3e-14):
+    '''continued fraction for the incomplete beta function (Lentz's method),
+    evaluated elementwise on arrays'''
+    tiny = 1e-300
+    qab = a + b
+    qap = a + 1
+    qam = a - 1
+    c = np.ones_like(x)
+    d = 1 - qab * x / qap
+    d = np.where(np.abs(d) < tiny, tiny, d)
+    d = 1 / d
+    h = d
+    for m in range(1, max_iter + 1):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1 + aa * d
+        d = np.where(np.abs(d) < tiny, tiny, d)
+        c = 1 + aa / c
+        c = np.where(np.abs(c) < tiny, tiny, c)
+        d = 1 / d
+        h = h * d * c
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1 + aa * d
+        d = np.where(np.abs(d) < tiny, tiny, d)
+        c = 1 + aa / c
+        c = np.where(np.abs(c) < tiny, tiny, c)
+        d = 1 / d
+        delta = d * c
+        h = h * delta
+        if np.all(np.abs(delta - 1) < eps):
+            break
+    return h
+
+
+def two_sided_p_value(t_stat: np.ndarray, dof: np.ndarray) -> np.ndarray:
+    '''P(|T| >= |t|) for Student's t distribution with dof degrees of freedom,
+    via the regularized incomplete beta function I_x(dof/2, 1/2)
+    with x = dof / (dof + t^2).
+    NaN wherever t_stat or dof is NaN.'''
+    t_stat = np.asarray(t_stat, dtype=float)
+    dof = np.asarray(dof, dtype=float)
+    out = np.full(t_stat.shape, np.nan)
+    ok = ~(np.isnan(t_stat) | np.isnan(dof)) & (dof > 0)
+    if not ok.any():
+        return out
+    t2 = t_stat[ok] ** 2
+    a = dof[ok] / 2
+    b = np.full_like(a, 0.5)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = np.where(np.isinf(t2), 0., dof[ok] / (dof[ok] + t2))
+        lgamma = np.vectorize(math.lgamma, otypes=[float])
+        log_bt = (lgamma(a + b) - lgamma(a) - lgamma(b)
+            + a * np.log(x) + b * np.log1p(-x))
+        bt = np.exp(log_bt)
+        use_direct = x < (a + 1) / (a + b + 2)
+        direct = bt * _betacf(a, b, x) / a
+        reflected = 1 - bt * _betacf(b, a, 1 - x) / b
+    p = np.where(x == 0, 0., np.where(use_direct, direct, reflected))
+    out[ok] = np.clip(p, 0, 1)
+    return out
+
+
+def benjamini_hochberg(p: np.ndarray) -> np.ndarray:
+    '''false discovery rate adjusted p-values; NaN p-values stay NaN'''
+    p = np.asarray(p, dtype=float)
+    q = np.full(p.shape, np.nan)
+    ok = ~np.isnan(p)
+    n = ok.sum()
+    if n == 0:
+        return q
+    pv = p[ok]
+    order = np.argsort(pv)
+    ranked = pv[order] * n / np.arange(1, n + 1)
+    # enforce monotonicity from the largest p-value down
+    ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+    adjusted = np.empty(n)
+    adjusted[order] = np.minimum(ranked, 1)
+    q[ok] = adjusted
+    return q
+
+
+def isoform_stats(long_df: pd.DataFrame) -> pd.DataFrame:
+    '''Paired cancer vs. non-cancer statistics for every isoform in long_df
+    (the output of read_all), computed for all isoforms at once.
+    Returns a table ranked by significance, most significant first.
+    '''
+    diffs = long_df.assign(diff=long_df.cancer - long_df.non_cancer)
+    g = diffs.groupby('isoform', sort=False)
+    stats = g.agg(
+        n_patients=('diff', 'size'),
+        mean_cancer=('cancer', 'mean'),
+        mean_non_cancer=('non_cancer', 'mean'),
+        mean_diff=('diff', 'mean'),
+        sd_diff=('diff', 'std'),
+    )
+    n = stats.n_patients.to_numpy(dtype=float)
+    mean_diff = stats.mean_diff.to_numpy()
+    sd_diff = stats.sd_diff.to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        effect_size = mean_diff / sd_diff
+        t_stat = effect_size * np.sqrt(n)
+        log2_fc = np.log2(stats.mean_cancer.to_numpy() / stats.mean_non_cancer.to_numpy())
+    # isoforms that were never detected have no variance and no difference
+    t_stat[(sd_diff == 0) & (mean_diff == 0)] = np.nan
+    effect_size[np.isnan(t_stat)] = np.nan
+    log2_fc[~np.isfinite(log2_fc)] = np.nan
+    p_value = two_sided_p_value(t_stat, n - 1)
+    stats['log2_fold_change'] = log2_fc
+    stats['effect_size'] = effect_size
+    stats['t_stat'] = t_stat
+    stats['p_value'] = p_value
+    stats['q_value'] = benjamini_hochberg(p_value)
+    stats = stats.reset_index()
+    # UniProt puts a dash before the isoform number, the CSVs put a dot
+    stats['acc_num'] = stats.isoform.str.replace('.', '-', regex=False)
+    stats['abs_t'] = np.abs(t_stat)
+    stats = stats.sort_values(['p_value', 'abs_t'], ascending=[True, False], na_position='last')
+    return stats.loc[:, COLUMNS].reset_index(drop=True)
+
+
+def rank_all(data_dir=DATA_DIR, workers: int = None) -> pd.DataFrame:
+    '''isoform_stats for every wide CSV in data_dir'''
+    fnames = sorted(str(f) for f in pathlib.Path(data_dir).glob('*wide.csv'))
+    return isoform_stats(read_all(fnames, workers))
+
+
+def read_results(fname=RESULTS_FNAME) -> list:
+    '''the rows of a ranked table written by the differential_abundance
+    management command, as a list of dicts. Empty list if it hasn't been run.'''
+    try:
+        df = pd.read_csv(fname)
+    except FileNotFoundError:
+        return []
+    df = df.astype(object).where(df.notna(), None)
+    return df.to_dict('records')
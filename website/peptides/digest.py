@@ -0,0 +1,122 @@
+'''In-silico digestion of protein sequences, for predicting the peptides
+that mass spec could find in a protein, and comparing that with the
+peptides it did find.
+
+Many sequences are digested in one pass: they are joined into one string,
+one regex search finds every cleavage site in all of them, and NumPy pairs
+up the sites into peptides (with missed cleavages), drops the ones that
+would span two sequences or have the wrong length, and computes coverage.
+'''
+import re
+
+import numpy as np
+
+# where each protease cuts: between the two residues matched by the lookarounds
+ENZYMES = {
+    # after K or R, except before P
+    'trypsin': re.compile(r'(?<=[KR])(?!P)'),
+    # after every K
+    'lys-c': re.compile(r'(?<=K)'),
+    # after E (in bicarbonate buffer; in phosphate buffer it also cuts after D)
+    'glu-c': re.compile(r'(?<=E)'),
+}
+# the shortest and longest peptides usually identified by mass spec
+MIN_LENGTH = 7
+MAX_LENGTH = 30
+# between sequences in the joined string; no enzyme cuts next to it
+SEPARATOR = '\n'
+
+
+def join(seqs: list) -> tuple:
+    '''(all of seqs joined by SEPARATOR, where each sequence starts in the joined string)'''
+    lengths = np.array([len(seq) for seq in seqs], dtype=np.int64)
+    offsets = np.zeros(len(seqs), dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths + 1)[:-1]
+    return SEPARATOR.join(seqs), offsets
+
+
+def digest_all(seqs: list, enzyme: str = 'trypsin', missed_cleavages: int = 1,
+        min_length: int = MIN_LENGTH, max_length: int = MAX_LENGTH) -> tuple:
+    '''Digest every sequence in seqs at once.
+    Returns 3 arrays with one element per peptide: (index in seqs, start, end),
+    start and end being locations in that sequence (end exclusive),
+    ordered by sequence, then start, then end.'''
+    text, offsets = join(seqs)
+    ends_of_seqs = offsets + np.array([len(seq) for seq in seqs], dtype=np.int64)
+    sites = np.fromiter((m.start() for m in ENZYMES[enzyme].finditer(text)), dtype=np.int64)
+    cuts = np.unique(np.concatenate([sites, offsets, ends_of_seqs]))
+    seq_of_cut = np.searchsorted(offsets, cuts, side='right') - 1
+    seq_idx, starts, ends = [], [], []
+    for missed in range(missed_cleavages + 1):
+        start, end = cuts[:-1 - missed], cuts[1 + missed:]
+        # a sequence's end (where the separator is) counts as part of that sequence
+        same_seq = seq_of_cut[:-1 - missed] == seq_of_cut[1 + missed:]
+        length = end - start
+        keep = same_seq & (length >= min_length) & (length <= max_length)
+        seq_idx.append(seq_of_cut[:-1 - missed][keep])
+        starts.append(start[keep])
+        ends.append(end[keep])
+    seq_idx = np.concatenate(seq_idx)
+    starts = np.concatenate(starts) - offsets[seq_idx]
+    ends = np.concatenate(ends) - offsets[seq_idx]
+    order = np.lexsort((ends, starts, seq_idx))
+    return seq_idx[order], starts[order], ends[order]
+
+
+def digest(seq: str, missed_cleavages: int = 1, min_length: int = MIN_LENGTH,
+        max_length: int = MAX_LENGTH, enzyme: str = 'trypsin') -> list:
+    '''[(location, peptide)] for every peptide from digesting seq
+    with up to missed_cleavages uncut sites inside the peptide,
+    keeping only peptides between min_length and max_length residues long'''
+    _, starts, ends = digest_all([seq], enzyme, missed_cleavages, min_length, max_length)
+    return [(int(start), seq[start:end]) for start, end in zip(starts, ends)]
+
+
+def covered(n: int, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    '''boolean mask of the positions in range(n) inside any of the intervals [start, end)'''
+    depth = np.zeros(n + 1, dtype=np.int64)
+    np.add.at(depth, starts, 1)
+    np.add.at(depth, ends, -1)
+    return np.cumsum(depth[:-1]) > 0
+
+
+def coverage_table(seqs: dict, peptides, enzyme: str = 'trypsin', missed_cleavages: int = 1,
+        min_length: int = MIN_LENGTH, max_length: int = MAX_LENGTH) -> 'pandas.DataFrame':
+    '''Theoretical vs. observed coverage of every protein in seqs
+    ({accession number: sequence}), in one pass over all of them.
+    peptides: (accession number, location, length) of the observed mass spec
+    peptides; those with unknown location (-1) or protein are ignored.
+    One row per protein: its length, number of digest peptides, fraction of
+    residues covered by them, number of observed peptides, fraction of residues
+    covered by those, and how many observed peptides are digest peptides.'''
+    import pandas as pd
+    acc_nums = list(seqs)
+    text, offsets = join(list(seqs.values()))
+    lengths = np.array([len(seq) for seq in seqs.values()], dtype=np.int64)
+    dig_seq, dig_start, dig_end = digest_all(list(seqs.values()), enzyme, missed_cleavages, min_length, max_length)
+    dig_start += offsets[dig_seq]
+    dig_end += offsets[dig_seq]
+    seq_index = {acc_num: ii for ii, acc_num in enumerate(acc_nums)}
+    obs = np.array([(seq_index[acc_num], loc, length) for acc_num, loc, length in peptides
+        if acc_num in seq_index and loc >= 0], dtype=np.int64).reshape(-1, 3)
+    obs_seq = obs[:, 0]
+    obs_start = obs[:, 1] + offsets[obs_seq]
+    obs_end = obs_start + obs[:, 2]
+    n = len(text)
+    seq_of_pos = np.repeat(np.arange(len(acc_nums)), lengths + 1)[:n]
+
+    def per_seq(mask):
+        return np.bincount(seq_of_pos[mask], minlength=len(acc_nums))
+
+    digest_keys = dig_start * (n + 1) + dig_end
+    is_digest = np.isin(obs_start * (n + 1) + obs_end, digest_keys)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return pd.DataFrame({
+            'acc_num': acc_nums,
+            'length': lengths,
+            'digest_peptides': np.bincount(dig_seq, minlength=len(acc_nums)),
+            'digest_coverage': per_seq(covered(n, dig_start, dig_end)) / lengths,
+            'observed_peptides': np.bincount(obs_seq, minlength=len(acc_nums)),
+            'observed_coverage': per_seq(covered(n, obs_start, obs_end)) / lengths,
+            'observed_in_digest': np.bincount(obs_seq[is_digest], minlength=len(acc_nums)),
+        })
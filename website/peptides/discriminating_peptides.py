@@ -0,0 +1,114 @@
+'''Which peptides identify one isoform?
+
+A peptide can only tell isoforms apart if it is found in exactly one
+isoform of its protein family. For each family, we index the k-mers of all
+of its sequences at once (like kmer_index.py does for the whole database),
+so checking a peptide against the family only means searching the
+sequences that contain all of its covering k-mers.
+
+Both the mass spec peptides in the Peptide table and the peptides of an
+in-silico tryptic digest of each isoform are checked. The ones found in
+exactly one isoform are saved as UniquePeptides, which the protein and
+alignment pages show. `python manage.py find_unique_peptides` does every
+family in the database, a batch of families at a time.
+'''
+from django.db import transaction
+
+from .caching import invalidate
+from .digest import MAX_LENGTH, MIN_LENGTH, digest
+from .ingest import batches
+from .kmer_index import covering_kmers, kmers
+from .models import KMER_LENGTH, Isoform, Peptide, Protein, UniquePeptide
+
+
+class FamilyIndex:
+    '''the k-mers of all the sequences of one protein family,
+    each mapped to the isoforms that contain it'''
+    def __init__(self, seqs: dict, k: int = KMER_LENGTH):
+        self.seqs = seqs
+        self.k = k
+        self.index = {}
+        for acc_num, seq in seqs.items():
+            for kmer in kmers(seq, k):
+                self.index.setdefault(kmer, set()).add(acc_num)
+
+    def isoforms_containing(self, peptide: str) -> set:
+        '''accession numbers of the isoforms whose sequence contains peptide'''
+        if len(peptide) < self.k:
+            candidates = self.seqs
+        else:
+            candidates = set.intersection(*[self.index.get(kmer, set())
+                for kmer in covering_kmers(peptide, self.k)])
+        return {acc_num for acc_num in candidates if peptide in self.seqs[acc_num]}
+
+
+def family_unique_peptides(seqs: dict, peptides, missed_cleavages: int = 1,
+        min_length: int = MIN_LENGTH, max_length: int = MAX_LENGTH) -> list:
+    '''Unsaved UniquePeptides for one family.
+    seqs: {accession number: sequence} for every isoform in the family.
+    peptides: (accession number, peptide) for the family's mass spec peptides.
+    Digest peptides that are also mass spec peptides of the same isoform
+    are only listed once, as mass spec peptides.'''
+    index = FamilyIndex(seqs)
+    out = []
+    seen = set()
+    for acc_num, pep in peptides:
+        if (acc_num, pep) in seen or acc_num not in seqs:
+            continue
+        seen.add((acc_num, pep))
+        if index.isoforms_containing(pep) == {acc_num}:
+            out.append(UniquePeptide(prot = acc_num, peptide = pep,
+                location = seqs[acc_num].find(pep), source = 'ms'))
+    for acc_num, seq in seqs.items():
+        for loc, pep in digest(seq, missed_cleavages, min_length, max_length):
+            if (acc_num, pep) in seen:
+                continue
+            seen.add((acc_num, pep))
+            if index.isoforms_containing(pep) == {acc_num}:
+                out.append(UniquePeptide(prot = acc_num, peptide = pep, location = loc, source = 'trypsin'))
+    return out
+
+
+def families(acc_nums: list = None) -> list:
+    '''[accession numbers of the isoforms of one family] for every family
+    with 2+ isoforms in the database (or only the families that include
+    any of acc_nums), in one query'''
+    pairs = Isoform.objects.values_list('prot_1__acc_num', 'prot_2__acc_num').order_by('prot_1__acc_num')
+    out = {}
+    for acc_num_1, acc_num_2 in pairs:
+        out.setdefault(acc_num_1, [acc_num_1]).append(acc_num_2)
+    out = list(out.values())
+    if acc_nums is not None:
+        acc_nums = set(acc_nums)
+        out = [fam for fam in out if acc_nums.intersection(fam)]
+    return out
+
+
+def precompute(fams: list = None, batch_size: int = 200, missed_cleavages: int = 1,
+        min_length: int = MIN_LENGTH, max_length: int = MAX_LENGTH) -> dict:
+    '''Replace the UniquePeptides of every family in fams (default: families()),
+    with 2 queries to read and a transaction to write each batch_size families.
+    Returns counts of the families, mass spec peptides and digest peptides.'''
+    if fams is None:
+        fams = families()
+    counts = {'families': 0, 'ms': 0, 'trypsin': 0}
+    for batch in batches(fams, batch_size):
+        acc_nums = [acc_num for fam in batch for acc_num in fam]
+        seqs = dict(Protein.objects.filter(acc_num__in = acc_nums).values_list('acc_num', 'sequence'))
+        peps = {}
+        for acc_num, pep in Peptide.objects.filter(prot__in = acc_nums).values_list('prot', 'peptide'):
+            peps.setdefault(acc_num, []).append((acc_num, pep))
+        rows = []
+        for fam in batch:
+            fam_seqs = {acc_num: seqs[acc_num] for acc_num in fam if acc_num in seqs}
+            fam_peps = [pep for acc_num in fam for pep in peps.get(acc_num, [])]
+            rows.extend(family_unique_peptides(fam_seqs, fam_peps, missed_cleavages, min_length, max_length))
+        with transaction.atomic():
+            UniquePeptide.objects.filter(prot__in = acc_nums).delete()
+            UniquePeptide.objects.bulk_create(rows, batch_size=2000)
+        counts['families'] += len(batch)
+        for row in rows:
+            counts[row.source] += 1
+    # bulk_create doesn't send post_save signals
+    invalidate()
+    return counts
@@ -0,0 +1,269 @@
+'''All HTTP requests to UniProt and the EBI go through here.
+
+- Connections are kept alive and pooled (one requests.Session per thread).
+- Responses are gzip-compressed in transit.
+- Every request has a connect timeout and a read timeout.
+- 429 and 5xx responses, and connection errors, are retried with jittered
+  exponential backoff. A Retry-After header is honored when there is one.
+  POSTs (e.g., submitting an EBI job) aren't idempotent, so they are only
+  retried after a 429 or when the connection couldn't be opened: after a
+  5xx or a lost response the job may already be running.
+- Each service has a token bucket rate limit that is shared by every process
+  on the machine (e.g., all gunicorn workers plus an ingest_proteins run).
+  The bucket's state is kept in a small file locked with fcntl.flock.
+
+arequest, aget and apost do the same for async views: waiting for the rate
+limiter or between retries doesn't block the event loop, and only the HTTP
+call itself runs in a thread (there is no async client with the same
+retries and pooling, so the calls still go through requests).
+'''
+import asyncio
+from email.utils import parsedate_to_datetime
+import json
+import logging
+import os
+import pathlib
+import random
+import tempfile
+import threading
+import time
+
+from . import metrics
+
+try:
+    import fcntl
+except ImportError: # Windows: the limit is only shared by the threads of one process
+    fcntl = None
+
+# (connect, read) timeouts in seconds
+TIMEOUT = (5, 60)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+MAX_RETRIES = 5
+BACKOFF = 0.5 # seconds before the first retry; doubles after each one
+MAX_BACKOFF = 60.
+RATE_LIMIT_DIR = pathlib.Path(os.environ.get('PEPTIDES_RATE_LIMIT_DIR', tempfile.gettempdir()))
+
+RETRIES = metrics.Counter('peptides_external_retries',
+    'Retried calls to UniProt or the EBI, by service and reason', ['service', 'reason'])
+
+
+class TokenBucket:
+    '''Lets at most `rate` calls per second (in bursts of up to `burst`)
+    through wait(), counting the calls of every process that uses the same
+    state file. Falls back to counting only this process's calls if the
+    file can't be locked.'''
+    def __init__(self, name: str, rate: float, burst: int = 1, directory=None):
+        self.rate = rate
+        self.burst = burst
+        self.path = pathlib.Path(directory or RATE_LIMIT_DIR)/f'peptides-ratelimit-{name}.json'
+        self.lock = threading.Lock()
+        self.state = {'tokens': burst, 'last': time.time()}
+
+    def _take(self, state: dict) -> float:
+        '''take a token from state if there is one and return 0,
+        otherwise return how long to wait for the next token'''
+        now = time.time()
+        tokens = min(self.burst, state['tokens'] + max(0., now - state['last']) * self.rate)
+        state['last'] = now
+        if tokens >= 1:
+            state['tokens'] = tokens - 1
+            return 0.
+        state['tokens'] = tokens
+        return (1 - tokens) / self.rate
+
+    def _take_shared(self) -> float:
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    state = json.loads(f.read())
+                except ValueError: # new or corrupted file
+                    state = {'tokens': self.burst, 'last': time.time()}
+                sleep_time = self._take(state)
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return sleep_time
+
+    def take(self) -> float:
+        '''take a token if there is one and return 0,
+        otherwise return how long to wait before trying again'''
+        with self.lock:
+            sleep_time = None
+            if fcntl is not None:
+                try:
+                    sleep_time = self._take_shared()
+                except OSError as ex:
+                    logging.warning(f"Can't use shared rate limit file {self.path}: {ex}")
+            if sleep_time is None:
+                sleep_time = self._take(self.state)
+        return sleep_time
+
+    def wait(self):
+        while (sleep_time := self.take()) > 0:
+            time.sleep(sleep_time)
+
+    async def await_token(self):
+        '''wait() without blocking the event loop'''
+        while (sleep_time := self.take()) > 0:
+            await asyncio.sleep(sleep_time)
+
+
+# UniProt throttles clients that send too many requests at once
+LIMITERS = {
+    'uniprot': TokenBucket('uniprot', rate=10, burst=5),
+    'ebi': TokenBucket('ebi', rate=5, burst=5),
+}
+
+_local = threading.local()
+
+
+def session() -> 'requests.Session':
+    '''this thread's Session, whose connections are reused between requests'''
+    sess = getattr(_local, 'session', None)
+    if sess is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        sess = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        sess.mount('https://', adapter)
+        sess.mount('http://', adapter)
+        sess.headers['Accept-Encoding'] = 'gzip, deflate'
+        _local.session = sess
+    return sess
+
+
+def retry_after(resp: 'requests.Response') -> float:
+    '''seconds to wait according to the response's Retry-After header
+    (a number of seconds or an HTTP date), or None if it has none'''
+    value = resp.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0., float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0., parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempt: int) -> float:
+    '''"full jitter" exponential backoff: uniform between 0 and BACKOFF * 2**attempt'''
+    return random.uniform(0, min(MAX_BACKOFF, BACKOFF * 2 ** attempt))
+
+
+def is_timeout(ex: Exception) -> bool:
+    '''whether ex is a requests.Timeout'''
+    import requests
+    return isinstance(ex, requests.Timeout)
+
+
+def not_sent(ex: Exception) -> bool:
+    '''whether ex (a requests exception) means the request never reached
+    the server: the connection couldn't be opened or timed out opening'''
+    import requests
+    from urllib3.exceptions import NewConnectionError
+    if isinstance(ex, requests.ConnectTimeout):
+        return True
+    reason = getattr(ex.args[0], 'reason', None) if ex.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def retryable(method: str, resp: 'requests.Response' = None, ex: Exception = None) -> bool:
+    '''whether a `method` request that got resp or raised ex (a connection
+    error or timeout) can be sent again'''
+    if method.upper() in IDEMPOTENT_METHODS:
+        return ex is not None or resp.status_code in RETRY_STATUSES
+    if ex is not None:
+        return not_sent(ex)
+    return resp.status_code == 429
+
+
+def request(method: str, url: str, service: str, retries: int = MAX_RETRIES, **kwargs) -> 'requests.Response':
+    '''Send a request to `service` ('uniprot' or 'ebi') through its rate
+    limiter, retrying as described above. Returns the last response,
+    so call raise_for_status() on it as usual.
+    Raises requests.Timeout or requests.ConnectionError if every attempt failed.'''
+    # imported by the first request instead of by every worker that starts
+    import requests
+    kwargs.setdefault('timeout', TIMEOUT)
+    limiter = LIMITERS.get(service)
+    attempt = 0
+    while True:
+        if limiter is not None:
+            limiter.wait()
+        try:
+            resp = session().request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as ex:
+            if attempt >= retries or not retryable(method, ex=ex):
+                raise
+            delay = retry_delay(service, attempt, ex=ex)
+        else:
+            if attempt >= retries or not retryable(method, resp=resp):
+                return resp
+            delay = retry_delay(service, attempt, resp=resp)
+        logging.info(f"Retrying {method} {url} in {delay:.1f} seconds (attempt {attempt + 1} of {retries})")
+        time.sleep(delay)
+        attempt += 1
+
+
+def retry_delay(service: str, attempt: int, resp: 'requests.Response' = None, ex: Exception = None) -> float:
+    '''count a retry of a call to `service` that failed with resp (a response
+    with one of RETRY_STATUSES) or ex (a connection error or timeout),
+    and return how many seconds to wait first'''
+    if ex is not None:
+        RETRIES.inc(service=service, reason='timeout' if is_timeout(ex) else 'connection')
+        return backoff(attempt)
+    RETRIES.inc(service=service, reason=str(resp.status_code))
+    delay = retry_after(resp)
+    if delay is None:
+        delay = backoff(attempt)
+    return min(delay, MAX_BACKOFF)
+
+
+async def arequest(method: str, url: str, service: str, retries: int = MAX_RETRIES, **kwargs) -> 'requests.Response':
+    '''request() for async code: the same rate limits and retries,
+    but only the HTTP call itself runs in a thread'''
+    import requests
+    kwargs.setdefault('timeout', TIMEOUT)
+    limiter = LIMITERS.get(service)
+    attempt = 0
+    while True:
+        if limiter is not None:
+            await limiter.await_token()
+        try:
+            resp = await asyncio.to_thread(lambda: session().request(method, url, **kwargs))
+        except (requests.ConnectionError, requests.Timeout) as ex:
+            if attempt >= retries or not retryable(method, ex=ex):
+                raise
+            delay = retry_delay(service, attempt, ex=ex)
+        else:
+            if attempt >= retries or not retryable(method, resp=resp):
+                return resp
+            delay = retry_delay(service, attempt, resp=resp)
+        logging.info(f"Retrying {method} {url} in {delay:.1f} seconds (attempt {attempt + 1} of {retries})")
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+def get(url: str, service: str, **kwargs) -> 'requests.Response':
+    return request('GET', url, service, **kwargs)
+
+
+def post(url: str, service: str, **kwargs) -> 'requests.Response':
+    return request('POST', url, service, **kwargs)
+
+
+async def aget(url: str, service: str, **kwargs) -> 'requests.Response':
+    return await arequest('GET', url, service, **kwargs)
+
+
+async def apost(url: str, service: str, **kwargs) -> 'requests.Response':
+    return await arequest('POST', url, service, **kwargs)
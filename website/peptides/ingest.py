@@ -0,0 +1,273 @@
+'''Getting many proteins and their isoforms into the database at once.
+
+The web views add one protein (and its isoforms) per request.
+These functions fetch many protein families concurrently (or read them from
+UniProt FASTA files) and write them with a handful of bulk queries per batch
+instead of several queries per protein.
+'''
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import logging
+
+from django.db import models, transaction
+
+from . import align_isoforms as ai
+from .alignment_map import clustal_column_map
+from .alignment_stats import clustal_column_stats
+from .caching import invalidate
+from .kmer_index import index_proteins
+from .models import Alignment, Isoform, Peptide, Protein, content_etag, is_acc_num, isoform_num
+from .sequence_chunkers import seq_set_key
+from .similarity import sign_proteins
+
+
+def base_acc_num(acc_num: str) -> str:
+    '''accession number without the isoform number, e.g. P56856-2 -> P56856'''
+    return acc_num.split('-')[0]
+
+
+def read_acc_nums(lines) -> tuple:
+    '''Parse accession numbers separated by whitespace or commas,
+    ignoring anything after a '#' on a line.
+    Returns (the distinct base accession numbers in the order they were
+    first seen, the tokens that weren't valid accession numbers)
+    '''
+    acc_nums = {}
+    invalid = []
+    for line in lines:
+        line = line.split('#')[0]
+        for token in line.replace(',', ' ').split():
+            if not is_acc_num(token):
+                invalid.append(token)
+                continue
+            acc_nums.setdefault(base_acc_num(token), None)
+    return list(acc_nums), invalid
+
+
+def new_acc_nums(acc_nums: list) -> list:
+    '''the accession numbers in acc_nums that aren't in the database yet'''
+    existing = set()
+    for ii in range(0, len(acc_nums), 500):
+        existing.update(Protein.objects
+            .filter(acc_num__in = acc_nums[ii:ii + 500])
+            .values_list('acc_num', flat=True)
+        )
+    return [x for x in acc_nums if x not in existing]
+
+
+def fetch_family(acc_num: str) -> dict:
+    '''a dict mapping the accession numbers of all distinct isoforms of
+    a protein to their sequences, or an empty dict if UniProt has no
+    usable data for acc_num'''
+    try:
+        return ai.get_all_seqs(ai.get_all_prots(acc_num))
+    except Exception as ex:
+        logging.error(f"Error while retreiving data from UniProt for accession number {acc_num}:\r\n{ex}")
+        return {}
+
+
+def fetch_families(acc_nums: list, workers: int = 8):
+    '''fetch_family for each accession number using a pool of threads.
+    Every UniProt request goes through the rate limiter in http_client,
+    which is shared with every other process, so more workers can't get us throttled.
+    Yields (accession number, isoform sequences) in the order of acc_nums.
+    '''
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        yield from zip(acc_nums, pool.map(fetch_family, acc_nums))
+
+
+def align_family(seqs: dict, method: str = 'ebi') -> str:
+    '''multiple sequence alignment of seqs, or None if the alignment failed.
+    method is 'ebi' (the EBI's Clustal Omega web service)
+    or 'local' (a local clustalo executable)'''
+    try:
+        if method == 'local':
+            return ai.align_locally(seqs)
+        return ai.request_multi_alignment(seqs)
+    except Exception as ex:
+        logging.error(f"Error while trying to retrieve alignment for proteins {list(seqs.keys())}:\r\n{ex}")
+        return None
+
+
+def align_families(families: list, method: str = 'ebi', jobs: int = 10) -> list:
+    '''families: a list of (accession number, isoform sequences).
+    Submits the alignments of all families with 2+ isoforms at the same time
+    (up to `jobs` at once; the EBI allows 30 concurrent jobs per user)
+    and returns a list of (accession number, isoform sequences, alignment or None).
+    '''
+    multi = [seqs for _, seqs in families if len(seqs) > 1]
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        alignments = iter(list(pool.map(lambda seqs: align_family(seqs, method), multi)))
+    return [(acc_num, seqs, next(alignments) if len(seqs) > 1 else None)
+        for acc_num, seqs in families]
+
+
+def locate_peptides(seqs: dict, unlocated: int = None) -> int:
+    '''Set the location of every peptide belonging to one of the proteins
+    in seqs (a dict mapping accession number to sequence),
+    the same way Peptide.save does, in one bulk update.
+    Peptides that aren't in their protein's sequence keep their location,
+    unless unlocated is given (e.g., -1 after the sequence changed).
+    Returns the number of peptides updated.'''
+    changed = []
+    for pep in Peptide.objects.filter(prot__in = list(seqs)):
+        loc = seqs[pep.prot].find(pep.peptide)
+        if loc < 0:
+            if unlocated is None:
+                continue
+            loc = unlocated
+        if loc != pep.location:
+            pep.location = loc
+            changed.append(pep)
+    Peptide.objects.bulk_update(changed, ['location'], batch_size=1000)
+    return len(changed)
+
+
+def save_families(families: list) -> dict:
+    '''Save many protein families in one transaction.
+    families: a list of (accession number, {isoform accession number: sequence},
+    alignment (or None)) tuples, where the accession number of the protein itself
+    is also a key of the dict.
+    Like views.get_all_data_related_to_prot, families with only one isoform
+    are skipped, and proteins already in the database are never overwritten.
+    Returns counts of the proteins, isoform links, alignments and peptide
+    locations written.
+    '''
+    counts = {'proteins': 0, 'isoforms': 0, 'alignments': 0, 'peptides': 0}
+    families = [fam for fam in families if len(fam[1]) > 1]
+    if not families:
+        return counts
+    with transaction.atomic():
+        new_primaries = set(new_acc_nums([acc_num for acc_num, _, _ in families]))
+        families = [fam for fam in families if fam[0] in new_primaries]
+        all_seqs = {}
+        for acc_num, seqs, _ in families:
+            for iso_acc_num, seq in seqs.items():
+                if iso_acc_num.endswith('-1'):
+                    iso_acc_num = iso_acc_num[:-2]
+                all_seqs.setdefault(iso_acc_num, seq)
+        to_create = new_acc_nums(list(all_seqs))
+        Protein.objects.bulk_create(
+            [Protein(acc_num = acc_num, sequence = all_seqs[acc_num], isoform_num = isoform_num(acc_num))
+                for acc_num in to_create],
+            batch_size=500
+        )
+        created = set(to_create)
+        prots = {}
+        for ii in range(0, len(to_create), 500):
+            prots.update(Protein.objects.in_bulk(to_create[ii:ii + 500], field_name='acc_num'))
+        isoforms = []
+        alignments = []
+        for acc_num, seqs, alignment in families:
+            if acc_num not in created:
+                continue
+            for iso_acc_num in seqs:
+                if iso_acc_num.endswith('-1'):
+                    iso_acc_num = iso_acc_num[:-2]
+                if iso_acc_num != acc_num and iso_acc_num in prots:
+                    isoforms.append(Isoform(prot_1 = prots[acc_num], prot_2 = prots[iso_acc_num]))
+            if isinstance(alignment, str):
+                alignments.append(Alignment(
+                    prots = ','.join(seqs.keys()),
+                    alignment = alignment,
+                    etag = content_etag(alignment),
+                    seq_set = seq_set_key(seqs.values()),
+                    column_map = clustal_column_map(alignment),
+                    column_stats = clustal_column_stats(alignment),
+                ))
+        Isoform.objects.bulk_create(isoforms, batch_size=500)
+        Alignment.objects.bulk_create(alignments, batch_size=100, ignore_conflicts=True)
+        counts['peptides'] = locate_peptides({acc_num: all_seqs[acc_num] for acc_num in created})
+        index_proteins(prots.values(), replace=False)
+        sign_proteins(prots.values(), replace=False)
+    counts['proteins'] = len(created)
+    counts['isoforms'] = len(isoforms)
+    counts['alignments'] = len(alignments)
+    # bulk_create doesn't send post_save signals
+    invalidate()
+    return counts
+
+
+def open_maybe_gzipped(fname):
+    '''open a text file for reading, decompressing it if its name ends with .gz'''
+    if str(fname).endswith('.gz'):
+        return gzip.open(fname, 'rt')
+    return open(fname)
+
+
+def read_fasta(fname):
+    '''Yield (accession number, sequence) for each record of a UniProt FASTA file
+    (e.g., uniprot_sprot.fasta or uniprot_sprot_varsplic.fasta, optionally gzipped),
+    reading one record at a time.
+    UniProt FASTA headers look like ">sp|P56856-2|CLD18_HUMAN Isoform 2 of Claudin-18".
+    Records whose accession number can't be parsed are skipped.
+    '''
+    from Bio import SeqIO
+    with open_maybe_gzipped(fname) as f:
+        for rec in SeqIO.parse(f, 'fasta'):
+            fields = rec.id.split('|')
+            acc_num = fields[1] if len(fields) >= 2 else fields[0]
+            if not is_acc_num(acc_num):
+                continue
+            if acc_num.endswith('-1'):
+                acc_num = acc_num[:-2]
+            yield acc_num, str(rec.seq)
+
+
+def batches(iterable, size: int):
+    '''yield lists of up to size consecutive items from iterable'''
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_fasta(fnames: list, batch_size: int = 1000) -> dict:
+    '''Add every protein in some UniProt FASTA files to the database,
+    then link every new non-canonical isoform (e.g., P56856-2)
+    to its canonical isoform (P56856), which may be in a different file.
+    Memory use doesn't depend on the size of the files:
+    records are read and written batch_size at a time, and new isoforms are
+    found afterwards by querying the proteins added during this import.
+    Proteins already in the database are left alone.
+    Returns counts of the proteins, isoform links and peptide locations written.
+    '''
+    counts = {'proteins': 0, 'isoforms': 0, 'peptides': 0}
+    first_new_id = (Protein.objects.aggregate(models.Max('prot_id'))['prot_id__max'] or 0) + 1
+    for fname in fnames:
+        for batch in batches(read_fasta(fname), batch_size):
+            seqs = dict(batch)
+            with transaction.atomic():
+                to_create = new_acc_nums(list(seqs))
+                Protein.objects.bulk_create(
+                    [Protein(acc_num = acc_num, sequence = seqs[acc_num], isoform_num = isoform_num(acc_num))
+                        for acc_num in to_create]
+                )
+                counts['proteins'] += len(to_create)
+                counts['peptides'] += locate_peptides({acc_num: seqs[acc_num] for acc_num in to_create})
+                created = list(Protein.objects.filter(acc_num__in = to_create).only('prot_id', 'sequence'))
+                index_proteins(created, replace=False)
+                sign_proteins(created, replace=False)
+    new_isoforms = (Protein.objects
+        .filter(prot_id__gte = first_new_id, isoform_num__gt = 1)
+        .order_by('prot_id')
+        .only('prot_id', 'acc_num')
+        .iterator(chunk_size=batch_size)
+    )
+    for batch in batches(new_isoforms, batch_size):
+        primaries = Protein.objects.in_bulk(
+            list({base_acc_num(prot.acc_num) for prot in batch}),
+            field_name='acc_num'
+        )
+        isoforms = [Isoform(prot_1 = primaries[base_acc_num(prot.acc_num)], prot_2 = prot)
+            for prot in batch if base_acc_num(prot.acc_num) in primaries]
+        with transaction.atomic():
+            Isoform.objects.bulk_create(isoforms)
+        counts['isoforms'] += len(isoforms)
+    # bulk_create doesn't send post_save signals
+    invalidate()
+    return counts
@@ -1,5 +1,5 @@
 import pathlib
-from bokeh.embed import file_html
+from bokeh.embed import file_html, json_item
 from bokeh.io import output_file
 from bokeh.layouts import column
 from bokeh.models import (
@@ -42,12 +42,15 @@ def suptitle_and_primary_iso(groups: list):
                        f'Interaction plot for {base_acc_num} isoforms</h2>'))],
         base_acc_num)
 
-def histograms(df: pd.DataFrame, bins=20, show_figs=False):
+def histograms(df: pd.DataFrame, bins=20, show_figs=False, as_json=False):
     '''
     For each isoform, make two histograms,
     one red for cancer and one blue for non-cancer.
     Also make vertical lines at the mean MS intensities
     for cancer and non-cancer.
+    If as_json, return the figures as a Bokeh JSON item
+    (for rendering in the browser with Bokeh.embed.embed_item)
+    rather than a standalone HTML document.
     '''
     # take the long data, and get one column for cancer and one for non-cancer
     wide = (pd.merge(df[df.is_cancer], df[~df.is_cancer], on=['patient', 'acc_num'])
@@ -110,14 +113,17 @@ def histograms(df: pd.DataFrame, bins=20, show_figs=False):
             title=title)
         show(fig_rows)
         return
+    if as_json:
+        return json_item(fig_rows)
     return file_html(fig_rows, resources=bkr.CDN, title=title)
     
 
 
-def points_with_error_bars(df: pd.DataFrame, show_figs=False):
+def points_with_error_bars(df: pd.DataFrame, show_figs=False, as_json=False):
     '''For each accession number, create a plot
     where cancer and non-cancer each have error bar
-    of +/- 1 standard deviation and a big point at mean intensity.'''
+    of +/- 1 standard deviation and a big point at mean intensity.
+    If as_json, return a Bokeh JSON item instead of standalone HTML.'''
     df.is_cancer = df.is_cancer.map({True: 'cancer', False: 'non-cancer'})
     groups = list(df.groupby('acc_num').groups.items())
     figs, base_acc_num = suptitle_and_primary_iso(groups)
@@ -184,9 +190,17 @@ def points_with_error_bars(df: pd.DataFrame, show_figs=False):
             title=title)
         show(fig_rows)
         return
+    if as_json:
+        return json_item(fig_rows)
     return file_html(fig_rows, resources=bkr.CDN, title=title)
 
 
+def bokeh_script_tags() -> str:
+    '''the script tags that load BokehJS from the CDN, for pages
+    that build their plots client-side from a JSON item'''
+    return bkr.CDN.render_js()
+
+
 if __name__ == '__main__':
     import sys
     FDIR = CUR_DIR/'static'/'peptides'/'isoform abundance cancer vs not'
@@ -0,0 +1,116 @@
+'''Which proteins contain a peptide?
+
+The Kmer table maps every substring of KMER_LENGTH residues to the proteins
+whose sequence contains it. A peptide can only be in a protein that
+contains all of its k-mers, so we look up a few k-mers that cover the
+peptide, intersect their proteins, and only search the sequences of the
+proteins that are left. Looking up thousands of peptides takes a handful
+of queries, whatever the size of the database.
+
+Protein.save keeps a protein's k-mers up to date, and so do the bulk writes
+in ingest.py, sync.py and synthetic_db.py.
+`python manage.py build_kmer_index` rebuilds the whole table.
+'''
+from django.db import transaction
+
+from .models import KMER_LENGTH, Kmer, Protein
+
+# rows per query, below SQLite's limit on query parameters
+CHUNK_SIZE = 500
+
+
+def kmers(seq: str, k: int = KMER_LENGTH) -> set:
+    '''every distinct substring of seq of length k'''
+    return {seq[ii:ii + k] for ii in range(len(seq) - k + 1)}
+
+
+def covering_kmers(peptide: str, k: int = KMER_LENGTH) -> set:
+    '''non-overlapping k-mers that cover all of peptide
+    (the last one overlaps the one before it if len(peptide) isn't a multiple of k)'''
+    starts = set(range(0, len(peptide) - k + 1, k))
+    starts.add(len(peptide) - k)
+    return {peptide[ii:ii + k] for ii in starts}
+
+
+def positions(seq: str, peptide: str) -> list:
+    '''every location of peptide in seq, including overlapping ones'''
+    out = []
+    loc = seq.find(peptide)
+    while loc >= 0:
+        out.append(loc)
+        loc = seq.find(peptide, loc + 1)
+    return out
+
+
+def index_proteins(prots, replace: bool = True) -> int:
+    '''Replace the k-mers of some Protein objects (with their prot_id and sequence).
+    replace=False skips deleting the old k-mers, for proteins that were just created.
+    Returns the number of rows written.'''
+    prots = [prot for prot in prots if prot.prot_id is not None]
+    rows = 0
+    with transaction.atomic():
+        for ii in range(0, len(prots), CHUNK_SIZE):
+            chunk = prots[ii:ii + CHUNK_SIZE]
+            if replace:
+                Kmer.objects.filter(prot_id__in = [prot.prot_id for prot in chunk]).delete()
+            new = [Kmer(kmer = kmer, prot_id = prot.prot_id)
+                for prot in chunk for kmer in kmers(prot.sequence)]
+            Kmer.objects.bulk_create(new, batch_size=5000)
+            rows += len(new)
+    return rows
+
+
+def rebuild(batch_size: int = 1000) -> dict:
+    '''Index every protein in the database, batch_size proteins per transaction.
+    Returns counts of the proteins and k-mer rows.'''
+    counts = {'proteins': 0, 'kmers': 0}
+    Kmer.objects.all().delete()
+    prots = Protein.objects.order_by('prot_id').only('prot_id', 'sequence').iterator(chunk_size=batch_size)
+    batch = []
+    for prot in prots:
+        batch.append(prot)
+        if len(batch) == batch_size:
+            counts['kmers'] += index_proteins(batch, replace=False)
+            counts['proteins'] += len(batch)
+            batch = []
+    counts['kmers'] += index_proteins(batch, replace=False)
+    counts['proteins'] += len(batch)
+    return counts
+
+
+def candidates(peptides: list) -> dict:
+    '''{peptide: set of the prot_ids of the proteins that may contain it}
+    for the peptides at least KMER_LENGTH long, in one query per CHUNK_SIZE k-mers'''
+    needed = {pep: covering_kmers(pep) for pep in peptides if len(pep) >= KMER_LENGTH}
+    all_kmers = list(set().union(*needed.values()))
+    prot_ids = {}
+    for ii in range(0, len(all_kmers), CHUNK_SIZE):
+        rows = Kmer.objects.filter(kmer__in = all_kmers[ii:ii + CHUNK_SIZE]).values_list('kmer', 'prot_id')
+        for kmer, prot_id in rows:
+            prot_ids.setdefault(kmer, set()).add(prot_id)
+    return {pep: set.intersection(*[prot_ids.get(kmer, set()) for kmer in pep_kmers])
+        for pep, pep_kmers in needed.items()}
+
+
+def find_peptides(peptides) -> dict:
+    '''{peptide: [(accession number, [locations of the peptide in that protein]), ...]}
+    for every protein in the database that contains each peptide,
+    sorted by accession number. Peptides found in no protein map to [].
+    Peptides shorter than KMER_LENGTH are found by scanning every sequence.'''
+    peptides = list(dict.fromkeys(peptides))
+    cands = candidates(peptides)
+    all_ids = list(set().union(*cands.values()))
+    seqs = {}
+    for ii in range(0, len(all_ids), CHUNK_SIZE):
+        seqs.update((prot_id, (acc_num, seq)) for prot_id, acc_num, seq in Protein.objects
+            .filter(prot_id__in = all_ids[ii:ii + CHUNK_SIZE])
+            .values_list('prot_id', 'acc_num', 'sequence'))
+    hits = {}
+    for pep in peptides:
+        if pep in cands:
+            prots = [seqs[prot_id] for prot_id in cands[pep] if prot_id in seqs]
+        else:
+            prots = Protein.objects.filter(sequence__contains = pep).values_list('acc_num', 'sequence')
+        found = [(acc_num, positions(seq, pep)) for acc_num, seq in prots]
+        hits[pep] = sorted((acc_num, locs) for acc_num, locs in found if locs)
+    return hits
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from peptides import benchmarks
+
+
+class Command(BaseCommand):
+    help = ('Time and measure the peak memory of the functions that build the protein '
+        'and alignment pages on synthetic data, and compare the results to a baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', choices=list(benchmarks.SIZES),
+            default=['small', 'medium', 'large', 'titin'])
+        parser.add_argument('--repeat', type=int, default=3,
+            help='report the best time of this many runs')
+        parser.add_argument('--baseline', default=str(benchmarks.BASELINE_FNAME),
+            help='JSON file of earlier results to compare against')
+        parser.add_argument('--save-baseline', action='store_true',
+            help='write these results to the baseline file instead of comparing')
+        parser.add_argument('--tolerance', type=float, default=1.5,
+            help='fail if a time or peak memory is more than this many times the baseline')
+
+    def handle(self, *args, **options):
+        results = benchmarks.run(options['sizes'], max(1, options['repeat']))
+        baseline = benchmarks.read_baseline(options['baseline'])
+        self.stdout.write('%-32s %12s %12s %12s' % ('benchmark', 'ms', 'peak KiB', 'vs. baseline'))
+        for name, result in results.items():
+            base = baseline.get(name, {}).get('seconds')
+            ratio = '%.2fx' % (result['seconds'] / base) if base else '-'
+            self.stdout.write('%-32s %12.2f %12.0f %12s' % (
+                name, result['seconds'] * 1000, result['peak_kb'], ratio))
+        if options['save_baseline']:
+            benchmarks.write_baseline(results, options['baseline'])
+            self.stdout.write('Saved baseline to ' + options['baseline'])
+            return
+        slower = benchmarks.regressions(results, baseline, options['tolerance'])
+        if slower:
+            raise CommandError('Regressions:\n' + '\n'.join(
+                '%s %s: %.4g -> %.4g' % row for row in slower))
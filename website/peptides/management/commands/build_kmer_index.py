@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from peptides import kmer_index
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the k-mer index used by /peptide_search to find the proteins '
+        'that contain a peptide. Only needed once: saving or importing a protein updates its k-mers.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+            help='number of proteins to index in each transaction')
+
+    def handle(self, *args, **options):
+        t0 = time.perf_counter()
+        counts = kmer_index.rebuild(max(1, options['batch_size']))
+        self.stdout.write(
+            'Indexed %(proteins)i proteins (%(kmers)i k-mers)' % counts
+            + ' in %.1f seconds' % (time.perf_counter() - t0)
+        )
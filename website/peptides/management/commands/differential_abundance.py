@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from peptides import differential_abundance
+
+
+class Command(BaseCommand):
+    help = ('Rank every isoform in the "isoform abundance cancer vs not" CSVs '
+        'by how differently abundant it is in cancer vs. non-cancer tissue, '
+        'and write the ranked table shown on the /differential_abundance page.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--data-dir', default=str(differential_abundance.DATA_DIR),
+            help='directory containing the <accession number>wide.csv files')
+        parser.add_argument('--out', default=str(differential_abundance.RESULTS_FNAME),
+            help='where to write the ranked CSV')
+        parser.add_argument('--workers', type=int, default=None,
+            help='number of processes for reading the CSVs (default: one per CPU)')
+
+    def handle(self, *args, **options):
+        t0 = time.perf_counter()
+        ranked = differential_abundance.rank_all(options['data_dir'], options['workers'])
+        ranked.to_csv(options['out'], index=False, float_format='%.6g')
+        self.stdout.write(
+            'Ranked %i isoforms in %.2f seconds; wrote %s'
+            % (len(ranked), time.perf_counter() - t0, options['out'])
+        )
@@ -0,0 +1,38 @@
+import time
+
+from django.db.models.functions import Length
+from django.core.management.base import BaseCommand
+
+from peptides import digest
+from peptides.models import Peptide, Protein
+
+
+class Command(BaseCommand):
+    help = ('Digest every protein in the database in one pass and write a CSV comparing '
+        'the coverage of each protein by the digest peptides with its coverage by the mass spec peptides.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--enzyme', choices=list(digest.ENZYMES), default='trypsin')
+        parser.add_argument('--missed-cleavages', type=int, default=1,
+            help='most uncut sites inside a digest peptide')
+        parser.add_argument('--min-length', type=int, default=digest.MIN_LENGTH,
+            help='shortest digest peptide to count')
+        parser.add_argument('--max-length', type=int, default=digest.MAX_LENGTH,
+            help='longest digest peptide to count')
+        parser.add_argument('--out', default='coverage.csv',
+            help='where to write the CSV')
+
+    def handle(self, *args, **options):
+        t0 = time.perf_counter()
+        seqs = dict(Protein.objects.order_by('acc_num').values_list('acc_num', 'sequence'))
+        peptides = (Peptide.objects
+            .annotate(length = Length('peptide'))
+            .values_list('prot', 'location', 'length')
+        )
+        table = digest.coverage_table(seqs, peptides, options['enzyme'], max(0, options['missed_cleavages']),
+            options['min_length'], options['max_length'])
+        table.to_csv(options['out'], index=False, float_format='%.4f')
+        self.stdout.write(
+            'Digested %i proteins in %.2f seconds; wrote %s'
+            % (len(table), time.perf_counter() - t0, options['out'])
+        )
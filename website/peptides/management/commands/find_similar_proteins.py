@@ -0,0 +1,44 @@
+import csv
+import time
+
+from django.core.management.base import BaseCommand
+
+from peptides import similarity
+
+
+class Command(BaseCommand):
+    help = ('Compute the MinHash signature of every protein that lacks one, in a pool of processes, '
+        'and optionally write every pair of proteins whose k-mers are similar enough to a CSV.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=None,
+            help='worker processes for computing signatures (default: one per CPU)')
+        parser.add_argument('--rebuild', action='store_true',
+            help='recompute every signature, not just the missing ones')
+        parser.add_argument('--out', default=None,
+            help='where to write the similar pairs (default: do not look for them)')
+        parser.add_argument('--min-similarity', type=float, default=0.5,
+            help='estimated Jaccard similarity of the k-mers of the pairs to write')
+
+    def handle(self, *args, **options):
+        from peptides.models import MinHash
+
+        t0 = time.perf_counter()
+        if options['rebuild']:
+            MinHash.objects.all().delete()
+        n_new = similarity.update_signatures(options['processes'])
+        self.stdout.write('Computed %i signatures in %.2f seconds' % (n_new, time.perf_counter() - t0))
+        if not options['out']:
+            return
+        t0 = time.perf_counter()
+        acc_nums, sigs = similarity.load_signatures()
+        pairs = similarity.all_pairs(sigs, options['min_similarity'])
+        with open(options['out'], 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['acc_num_1', 'acc_num_2', 'similarity'])
+            for ii, jj, sim in pairs:
+                writer.writerow([acc_nums[ii], acc_nums[jj], '%.3f' % sim])
+        self.stdout.write(
+            'Found %i pairs of %i proteins in %.2f seconds; wrote %s'
+            % (len(pairs), len(acc_nums), time.perf_counter() - t0, options['out'])
+        )
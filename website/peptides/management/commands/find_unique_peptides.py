@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from peptides import digest, discriminating_peptides
+
+
+class Command(BaseCommand):
+    help = ('Find the mass spec peptides and tryptic digest peptides that are in exactly one isoform '
+        'of their protein family, for every family in the database, and save them '
+        'for the protein and alignment pages.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('acc_nums', nargs='*',
+            help='only do the families that include these accession numbers (default: every family)')
+        parser.add_argument('--missed-cleavages', type=int, default=1,
+            help='most uncut trypsin sites inside a digest peptide')
+        parser.add_argument('--min-length', type=int, default=digest.MIN_LENGTH,
+            help='shortest digest peptide to consider')
+        parser.add_argument('--max-length', type=int, default=digest.MAX_LENGTH,
+            help='longest digest peptide to consider')
+        parser.add_argument('--batch-size', type=int, default=200,
+            help='number of families to read and write at once')
+
+    def handle(self, *args, **options):
+        t0 = time.perf_counter()
+        fams = discriminating_peptides.families(options['acc_nums'] or None)
+        counts = discriminating_peptides.precompute(
+            fams, batch_size=max(1, options['batch_size']),
+            missed_cleavages=max(0, options['missed_cleavages']),
+            min_length=options['min_length'], max_length=options['max_length'],
+        )
+        self.stdout.write(
+            'Found %(ms)i mass spec peptides and %(trypsin)i digest peptides unique to one isoform '
+            'in %(families)i families' % counts
+            + ' in %.1f seconds' % (time.perf_counter() - t0)
+        )
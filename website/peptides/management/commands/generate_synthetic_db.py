@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from peptides import synthetic_db
+
+
+class Command(BaseCommand):
+    help = ('Fill the database with synthetic protein families, peptides and alignments '
+        'to see how the site scales. Use a throwaway DATABASE_URL, not the real database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--proteins', type=int, default=10_000,
+            help='about how many proteins (counting every isoform) to add')
+        parser.add_argument('--peptides', type=int, default=1_000_000,
+            help='about how many peptides to add')
+        parser.add_argument('--max-isoforms', type=int, default=5,
+            help='most isoforms in one family')
+        parser.add_argument('--alignment-fraction', type=float, default=0.8,
+            help='fraction of families with 2+ isoforms that get an alignment')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--first-index', type=int, default=0,
+            help='start numbering accession numbers here, to add more families to an earlier run')
+        parser.add_argument('--batch-size', type=int, default=200,
+            help='number of families to write in each transaction')
+        parser.add_argument('--skip-kmer-index', action='store_true',
+            help='leave the new proteins out of the k-mer index (about half the time); run build_kmer_index later')
+
+    def handle(self, *args, **options):
+        t0 = time.perf_counter()
+        counts = synthetic_db.generate(
+            n_proteins=options['proteins'], n_peptides=options['peptides'],
+            max_isoforms=max(1, options['max_isoforms']),
+            alignment_fraction=options['alignment_fraction'], seed=options['seed'],
+            batch_size=max(1, options['batch_size']), first_index=options['first_index'],
+            index_kmers=not options['skip_kmer_index'],
+        )
+        self.stdout.write(
+            'Added %(proteins)i proteins, %(isoforms)i isoform relationships, '
+            '%(peptides)i peptides and %(alignments)i alignments' % counts
+            + ' in %.1f seconds' % (time.perf_counter() - t0)
+        )
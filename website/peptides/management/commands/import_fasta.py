@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from peptides import ingest
+
+
+class Command(BaseCommand):
+    help = ('Add all the proteins in UniProt FASTA files (e.g., uniprot_sprot.fasta.gz '
+        'and uniprot_sprot_varsplic.fasta.gz) to the database without connecting to UniProt, '
+        'and link each isoform to its canonical isoform.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('fasta_files', nargs='+',
+            help='UniProt FASTA files; files ending in .gz are decompressed while reading')
+        parser.add_argument('--batch-size', type=int, default=1000,
+            help='number of proteins to write to the database in each transaction')
+
+    def handle(self, *args, **options):
+        t0 = time.perf_counter()
+        try:
+            counts = ingest.import_fasta(options['fasta_files'], max(1, options['batch_size']))
+        except OSError as ex:
+            raise CommandError(str(ex))
+        self.stdout.write(
+            'Added %(proteins)i proteins and %(isoforms)i isoform relationships; '
+            'located %(peptides)i peptides' % counts
+            + ' in %.1f seconds' % (time.perf_counter() - t0)
+        )
@@ -0,0 +1,72 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from peptides import http_client, ingest
+
+
+class Command(BaseCommand):
+    help = ('Get many proteins, all their isoforms, and the alignments of those isoforms '
+        'from UniProt and the EBI, and add them to the database. '
+        'Accession numbers already in the database are skipped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('acc_num_file',
+            help='file of UniProt accession numbers separated by whitespace or commas ("-" for stdin)')
+        parser.add_argument('--workers', type=int, default=8,
+            help='number of proteins to fetch from UniProt at the same time')
+        parser.add_argument('--rate', type=float, default=10,
+            help='maximum number of UniProt requests per second, counting every process on this machine')
+        parser.add_argument('--align', choices=['ebi', 'local', 'none'], default='ebi',
+            help=('align isoforms with the EBI web service, a local clustalo executable, '
+                'or not at all (alignments can be requested later from the protein page)'))
+        parser.add_argument('--ebi-jobs', type=int, default=10,
+            help='number of alignments to run at the same time')
+        parser.add_argument('--batch-size', type=int, default=100,
+            help='number of protein families to write to the database in each transaction')
+
+    def handle(self, *args, **options):
+        fname = options['acc_num_file']
+        try:
+            if fname == '-':
+                acc_nums, invalid = ingest.read_acc_nums(sys.stdin)
+            else:
+                with open(fname) as f:
+                    acc_nums, invalid = ingest.read_acc_nums(f)
+        except OSError as ex:
+            raise CommandError(str(ex))
+        for token in invalid:
+            self.stderr.write('Skipping %r: not a valid UniProt accession number' % token)
+        to_fetch = ingest.new_acc_nums(acc_nums)
+        self.stdout.write('%i accession numbers, %i not in the database yet'
+            % (len(acc_nums), len(to_fetch)))
+        http_client.LIMITERS['uniprot'].rate = options['rate']
+        totals = {'proteins': 0, 'isoforms': 0, 'alignments': 0, 'peptides': 0}
+        t0 = time.perf_counter()
+        batch_size = max(1, options['batch_size'])
+        seen = set()
+        batch = []
+        fetched = ingest.fetch_families(to_fetch, options['workers'])
+        for ii, (acc_num, seqs) in enumerate(fetched, 1):
+            # another accession number in the file may have been an isoform of this one
+            if seqs and not seen.intersection(seqs):
+                seen.update(seqs)
+                batch.append((acc_num, seqs))
+            if len(batch) == batch_size or ii == len(to_fetch):
+                self.save_batch(batch, options, totals)
+                batch = []
+                self.stdout.write('%i/%i accession numbers done (%.1f seconds)'
+                    % (ii, len(to_fetch), time.perf_counter() - t0))
+        self.stdout.write(
+            'Added %(proteins)i proteins, %(isoforms)i isoform relationships '
+            'and %(alignments)i alignments; located %(peptides)i peptides' % totals
+        )
+
+    def save_batch(self, batch: list, options: dict, totals: dict):
+        if options['align'] == 'none':
+            families = [(acc_num, seqs, None) for acc_num, seqs in batch]
+        else:
+            families = ingest.align_families(batch, options['align'], options['ebi_jobs'])
+        for k, v in ingest.save_families(families).items():
+            totals[k] += v
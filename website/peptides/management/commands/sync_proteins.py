@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from peptides import http_client, sync
+
+
+class Command(BaseCommand):
+    help = ('Update the proteins in the database to the current UniProt release. '
+        'Sequences are compared by checksum, a batch of proteins per request; only proteins '
+        'whose sequence changed are updated, and only the alignments including them are deleted.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('acc_nums', nargs='*',
+            help='accession numbers to check (default: every protein in the database)')
+        parser.add_argument('--batch-size', type=int, default=sync.BATCH_SIZE,
+            help='number of proteins to check with each UniProt request (at most 500)')
+        parser.add_argument('--rate', type=float, default=10,
+            help='maximum number of UniProt requests per second, counting every process on this machine')
+        parser.add_argument('--realign', choices=['ebi', 'local', 'none'], default='none',
+            help=('redo the deleted alignments with the EBI web service or a local clustalo executable '
+                '(by default they can be requested again from the protein page)'))
+        parser.add_argument('--dry-run', action='store_true',
+            help="list the proteins that changed without changing the database")
+
+    def handle(self, *args, **options):
+        http_client.LIMITERS['uniprot'].rate = options['rate']
+        t0 = time.perf_counter()
+        counts = sync.sync_proteins(
+            options['acc_nums'] or None,
+            batch_size=min(500, max(1, options['batch_size'])),
+            realign=None if options['realign'] == 'none' else options['realign'],
+            dry_run=options['dry_run'],
+        )
+        for acc_num in counts['changed_acc_nums']:
+            self.stdout.write('Changed: %s' % acc_num)
+        for acc_num in counts['missing_acc_nums']:
+            self.stderr.write('Not in UniProt: %s' % acc_num)
+        self.stdout.write(
+            ('Checked %(checked)i proteins in %(seconds).1f seconds: %(changed)i changed, %(missing)i missing. '
+            'Updated %(proteins)i proteins, %(peptides)i peptide locations and the unique peptides of %(families)i families; '
+            'deleted %(alignments)i alignments and redid %(realigned)i.')
+            % dict(counts, changed=len(counts['changed_acc_nums']), seconds=time.perf_counter() - t0)
+        )
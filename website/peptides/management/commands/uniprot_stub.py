@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+
+from peptides.stub_server import STUB_DATA_DIR, StubServer
+
+
+class Command(BaseCommand):
+    help = ('Serve recorded UniProt and EBI Clustal Omega responses locally, '
+        'optionally with added latency and errors, for testing and load testing.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--data-dir', default=str(STUB_DATA_DIR),
+            help='directory with uniprot/*.json and ebi/*.clustal_num recordings')
+        parser.add_argument('--latency', type=float, default=0.,
+            help='seconds to wait before answering each request')
+        parser.add_argument('--jitter', type=float, default=0.,
+            help='up to this many more seconds of random extra latency')
+        parser.add_argument('--failure-rate', type=float, default=0.,
+            help='fraction of requests answered with 503 Service Unavailable')
+        parser.add_argument('--throttle-rate', type=float, default=0.,
+            help='fraction of requests answered with 429 Too Many Requests')
+        parser.add_argument('--retry-after', type=int, default=1,
+            help='Retry-After header (seconds) sent with 429 responses')
+        parser.add_argument('--job-seconds', type=float, default=0.,
+            help='how long each alignment job stays RUNNING')
+        parser.add_argument('--synthetic', action='store_true',
+            help='make up entries for accession numbers with no recording')
+        parser.add_argument('--seed', type=int, default=None,
+            help='random seed for jitter and injected errors')
+
+    def handle(self, *args, **options):
+        stub = StubServer(
+            host=options['host'], port=options['port'], data_dir=options['data_dir'],
+            latency=options['latency'], jitter=options['jitter'],
+            failure_rate=options['failure_rate'], throttle_rate=options['throttle_rate'],
+            retry_after=options['retry_after'], job_seconds=options['job_seconds'],
+            synthetic=options['synthetic'], seed=options['seed'],
+        )
+        self.stdout.write(
+            'Serving %i UniProt entries and %i alignments at %s\n'
+            'Point the site at it with\n'
+            '  PEPTIDES_UNIPROT_API_URL=%s\n'
+            '  PEPTIDES_EBI_CLUSTALO_URL=%s'
+            % (len(stub.entries), len(stub.alignments), stub.url, stub.uniprot_url, stub.ebi_url)
+        )
+        try:
+            stub.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stub.stop()
+            self.stdout.write('Requests served: %s' % dict(stub.counts))
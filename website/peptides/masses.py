@@ -0,0 +1,141 @@
+'''Looking up peptides by precursor mass.
+
+Mass spec measures the mass-to-charge ratio of a peptide, not its sequence,
+so this finds every peptide whose monoisotopic mass is within a few ppm of a
+measured one. The candidates are the mass spec peptides in the database
+(whose masses are stored in Peptide.mass) and the peptides of an in-silico
+tryptic digest of every protein (see digest.py). Their masses are kept in
+one sorted array, so a batch of thousands of query masses is two binary
+searches (numpy.searchsorted) instead of a scan of every peptide.
+
+Masses are computed for many peptides at once: their residues are looked
+up in a table of residue masses and summed with a cumulative sum.
+'''
+import numpy as np
+
+from . import digest
+
+# monoisotopic residue masses (Da)
+RESIDUE_MASSES = {
+    'G': 57.021464, 'A': 71.037114, 'S': 87.032028, 'P': 97.052764,
+    'V': 99.068414, 'T': 101.047679, 'C': 103.009185, 'L': 113.084064,
+    'I': 113.084064, 'N': 114.042927, 'D': 115.026943, 'Q': 128.058578,
+    'K': 128.094963, 'E': 129.042593, 'M': 131.040485, 'H': 137.058912,
+    'F': 147.068414, 'R': 156.101111, 'Y': 163.063329, 'W': 186.079313,
+    'U': 150.953636, 'O': 237.147727,
+}
+WATER = 18.010565
+PROTON = 1.007276
+DEFAULT_PPM = 10
+
+_TABLE = np.zeros(256)
+_KNOWN = np.zeros(256, dtype=bool)
+for _aa, _mass in RESIDUE_MASSES.items():
+    _TABLE[ord(_aa)] = _mass
+    _KNOWN[ord(_aa)] = True
+
+
+def range_masses(text: str, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    '''monoisotopic masses of the peptides text[start:end], for each start and end.
+    Peptides with residues of unknown mass (e.g., X or B) get NaN.'''
+    codes = np.frombuffer(text.encode('ascii', 'replace'), dtype=np.uint8)
+    mass = np.concatenate([[0], np.cumsum(_TABLE[codes])])
+    unknown = np.concatenate([[0], np.cumsum(~_KNOWN[codes])])
+    out = mass[ends] - mass[starts] + WATER
+    out[unknown[ends] > unknown[starts]] = np.nan
+    return out
+
+
+def peptide_masses(peptides: list) -> np.ndarray:
+    '''monoisotopic masses of peptides (NaN for those with residues of unknown mass)'''
+    text, offsets = digest.join(peptides)
+    ends = offsets + np.array([len(pep) for pep in peptides], dtype=np.int64)
+    return range_masses(text, offsets, ends)
+
+
+def set_masses(peps: list) -> list:
+    '''set the mass field of unsaved Peptide objects (for bulk_create, which skips Peptide.save)'''
+    for pep, mass in zip(peps, peptide_masses([pep.peptide for pep in peps])):
+        pep.mass = None if np.isnan(mass) else float(mass)
+    return peps
+
+
+def peptide_mass(peptide: str):
+    '''the monoisotopic mass of one peptide, or None if it has residues of unknown mass'''
+    try:
+        return sum(RESIDUE_MASSES[aa] for aa in peptide) + WATER
+    except KeyError:
+        return None
+
+
+def neutral_mass(mz: float, charge: int) -> float:
+    '''the mass of a peptide seen at mz with charge protons added'''
+    return (mz - PROTON) * charge
+
+
+class MassIndex:
+    '''peptides (accession number, location, sequence, source) sorted by mass'''
+    def __init__(self, masses, acc_nums, locations, peptides, sources):
+        order = np.argsort(masses, kind='stable')
+        keep = order[~np.isnan(np.asarray(masses, dtype=float)[order])]
+        self.masses = np.asarray(masses, dtype=float)[keep]
+        self.acc_nums = np.asarray(acc_nums, dtype=object)[keep]
+        self.locations = np.asarray(locations, dtype=np.int64)[keep]
+        self.peptides = np.asarray(peptides, dtype=object)[keep]
+        self.sources = np.asarray(sources, dtype=object)[keep]
+
+    def __len__(self):
+        return len(self.masses)
+
+    def ranges(self, query_masses, ppm: float = DEFAULT_PPM) -> tuple:
+        '''(first, last + 1) indices of the peptides within ppm of each query mass'''
+        query_masses = np.asarray(query_masses, dtype=float)
+        tolerance = query_masses * ppm / 1e6
+        return (np.searchsorted(self.masses, query_masses - tolerance, side='left'),
+            np.searchsorted(self.masses, query_masses + tolerance, side='right'))
+
+    def search(self, query_masses, ppm: float = DEFAULT_PPM) -> list:
+        '''[[{acc_num, location, peptide, source, mass, ppm}, ...] for each query mass],
+        each sorted by mass; ppm is the peptide's error relative to the query mass'''
+        firsts, lasts = self.ranges(query_masses, ppm)
+        out = []
+        for query, first, last in zip(query_masses, firsts, lasts):
+            out.append([{
+                'acc_num': self.acc_nums[ii],
+                'location': int(self.locations[ii]),
+                'peptide': self.peptides[ii],
+                'source': self.sources[ii],
+                'mass': float(self.masses[ii]),
+                'ppm': float((self.masses[ii] - query) / query * 1e6),
+            } for ii in range(first, last)])
+        return out
+
+
+def build_index(enzyme: str = 'trypsin', missed_cleavages: int = 1) -> MassIndex:
+    '''MassIndex of every mass spec peptide in the database and every peptide
+    of a digest of every protein, in 2 queries'''
+    from .models import Peptide, Protein
+
+    stored = list(Peptide.objects
+        .filter(mass__isnull = False)
+        .values_list('mass', 'prot', 'location', 'peptide')
+    )
+    seqs = dict(Protein.objects.values_list('acc_num', 'sequence'))
+    acc_nums = list(seqs)
+    seq_idx, starts, ends = digest.digest_all(list(seqs.values()), enzyme, missed_cleavages)
+    text, offsets = digest.join(list(seqs.values()))
+    dig_masses = range_masses(text, starts + offsets[seq_idx], ends + offsets[seq_idx])
+    dig_peptides = [text[start:end] for start, end in zip(starts + offsets[seq_idx], ends + offsets[seq_idx])]
+    return MassIndex(
+        np.concatenate([np.array([row[0] for row in stored], dtype=float), dig_masses]),
+        [row[1] for row in stored] + [acc_nums[ii] for ii in seq_idx],
+        np.concatenate([np.array([row[2] for row in stored], dtype=np.int64), starts]),
+        [row[3] for row in stored] + dig_peptides,
+        ['ms'] * len(stored) + [enzyme] * len(seq_idx),
+    )
+
+
+def get_index() -> MassIndex:
+    '''this process's MassIndex, rebuilt after the database changes (see caching.per_process)'''
+    from .caching import per_process
+    return per_process('mass_index', build_index)
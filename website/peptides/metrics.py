@@ -0,0 +1,155 @@
+'''Counters, gauges and histograms for the /metrics endpoint,
+in the Prometheus text exposition format
+(https://prometheus.io/docs/instrumenting/exposition_formats/).
+
+Each worker process keeps its own metrics, like prometheus_client does
+without its multiprocess mode, so scrape every worker (or run one worker)
+to see everything. Like timing.py, this doesn't depend on Django.
+'''
+from abc import ABC, abstractmethod
+import contextlib
+import math
+import threading
+
+REGISTRY = []
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, _escape(v)) for k, v in labels.items())
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return '%i' % value
+    return repr(float(value))
+
+
+class Metric(ABC):
+    type = None
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        REGISTRY.append(self)
+
+    def key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    @abstractmethod
+    def samples(self):
+        '''yield (name suffix, labels, value) for every time series'''
+
+    def render(self) -> str:
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s %s' % (self.name, self.type)]
+        for suffix, labels, value in self.samples():
+            lines.append('%s%s%s %s' % (self.name, suffix, _format_labels(labels), _format_value(value)))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(self.key(labels), 0)
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            yield '_total', dict(zip(self.labelnames, key)), value
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextlib.contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def samples(self):
+        for _, labels, value in super().samples():
+            yield '', labels, value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.))
+            for ii, upper in enumerate(self.buckets):
+                if value <= upper:
+                    counts[ii] += 1
+            self.values[key] = (counts, total + value)
+
+    def count(self, **labels) -> int:
+        counts, _ = self.values.get(self.key(labels), ([0], 0.))
+        return counts[-1]
+
+    def samples(self):
+        with self.lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self.values.items())
+        for key, (counts, total) in items:
+            labels = dict(zip(self.labelnames, key))
+            for upper, count in zip(self.buckets, counts):
+                yield '_bucket', {**labels, 'le': _format_value(upper)}, count
+            yield '_sum', labels, total
+            yield '_count', labels, counts[-1]
+
+
+def render() -> str:
+    '''every metric in the Prometheus text format'''
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+PHASE_SECONDS = Histogram('peptides_phase_seconds',
+    'Duration of each timed phase (see timing.py), e.g. uniprot, ebi_status, chunking, render',
+    ['phase'])
+EXTERNAL_ERRORS = Counter('peptides_external_errors',
+    'Failed calls to UniProt or the EBI, including timeouts', ['service'])
+EXTERNAL_TIMEOUTS = Counter('peptides_external_timeouts',
+    'Calls to UniProt or the EBI that timed out', ['service'])
+ALIGNMENT_JOB_POLLS = Histogram('peptides_alignment_job_polls',
+    'Number of status checks before each EBI alignment job finished or timed out',
+    buckets=(1, 2, 3, 5, 10, 15, 20))
+ALIGNMENTS_REUSED = Counter('peptides_alignments_reused',
+    'Alignments taken from the database instead of being computed again')
+ALIGNMENTS_EXTENDED = Counter('peptides_alignments_extended',
+    'Alignments made by adding new isoforms to an alignment from the database')
+ALIGNMENT_JOBS_IN_PROGRESS = Gauge('peptides_alignment_jobs_in_progress',
+    'EBI alignment jobs submitted and not yet finished')
+PAGE_CACHE = Counter('peptides_page_cache_requests',
+    'Requests for cached pages, by page and whether the page was in the cache', ['view', 'result'])
+REQUEST_SECONDS = Histogram('peptides_request_seconds',
+    'Time to handle each request, by URL name', ['view'])
+REQUESTS_IN_PROGRESS = Gauge('peptides_requests_in_progress',
+    'Requests being handled right now by this process')
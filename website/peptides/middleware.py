@@ -0,0 +1,109 @@
+import contextlib
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from . import metrics, timing
+
+logger = logging.getLogger('peptides.timing')
+
+
+class ServerTimingMiddleware:
+    '''Time every request, broken down into database queries and the phases
+    recorded with timing.phase, and report the breakdown in a Server-Timing
+    header (shown in the network tab of browsers' developer tools).
+    Requests slower than settings.SLOW_REQUEST_SECONDS are logged.
+    Goes first in MIDDLEWARE so that it times everything else.
+    Works with both sync and async views, so that under ASGI async views
+    aren't run in a thread for its sake. (Queries run by async views through
+    sync_to_async use the sync thread's connections, which aren't timed.)
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = timing.start()
+        try:
+            with self.timed_queries():
+                response = self.get_response(request)
+        finally:
+            timing.stop(timings)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = timing.start()
+        try:
+            with self.timed_queries():
+                response = await self.get_response(request)
+        finally:
+            timing.stop(timings)
+        return self.finish(request, response, timings)
+
+    @contextlib.contextmanager
+    def timed_queries(self):
+        '''count the request as in progress, and time the queries it runs'''
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(metrics.REQUESTS_IN_PROGRESS.track_inprogress())
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(self.time_query))
+            yield
+
+    def finish(self, request, response, timings):
+        '''add the Server-Timing header, record the request's duration
+        and log it if it was slow'''
+        response['Server-Timing'] = timings.header()
+        slow = getattr(settings, 'SLOW_REQUEST_SECONDS', 1.0)
+        elapsed = timings.elapsed()
+        match = getattr(request, 'resolver_match', None)
+        metrics.REQUEST_SECONDS.observe(elapsed, view=match.view_name if match else 'unmatched')
+        if slow is not None and elapsed >= slow:
+            logger.warning('Slow request: %s %s took %.0f ms (%s)',
+                request.method, request.get_full_path(), elapsed * 1000, timings.breakdown())
+        return response
+
+    @staticmethod
+    def time_query(execute, sql, params, many, context):
+        timings = timing.current()
+        t0 = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if timings is not None:
+                timings.queries += 1
+                timings.add('db', time.perf_counter() - t0)
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    '''WhiteNoise's middleware (which serves the static files), made to work
+    with async views too: it is sync-only, so under ASGI every request behind
+    it would otherwise take a thread.'''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        static_file = (self.find_file(request.path_info) if self.autorefresh
+            else self.files.get(request.path_info))
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
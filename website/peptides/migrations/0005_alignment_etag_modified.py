@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-19 16:26
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def fill_etags(apps, schema_editor):
+    Alignment = apps.get_model("peptides", "Alignment")
+    for alignment in Alignment.objects.all():
+        digest = hashlib.sha256(alignment.alignment.encode()).hexdigest()[:32]
+        alignment.etag = '"%s"' % digest
+        alignment.save(update_fields=["etag"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("peptides", "0004_alter_alignment_prots_alter_peptide_prot_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="alignment",
+            name="etag",
+            field=models.CharField(default="", max_length=34),
+        ),
+        migrations.AddField(
+            model_name="alignment",
+            name="modified",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(fill_etags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:02
+
+from django.db import migrations, models
+
+from peptides.sequence_chunkers import alignment_seq_set_key
+
+
+def fill_seq_sets(apps, schema_editor):
+    Alignment = apps.get_model("peptides", "Alignment")
+    for alignment in Alignment.objects.all():
+        try:
+            alignment.seq_set = alignment_seq_set_key(alignment.alignment)
+        except ValueError:
+            continue
+        alignment.save(update_fields=["seq_set"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("peptides", "0005_alignment_etag_modified"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="alignment",
+            name="seq_set",
+            field=models.CharField(db_index=True, default="", max_length=64),
+        ),
+        migrations.RunPython(fill_seq_sets, migrations.RunPython.noop),
+    ]
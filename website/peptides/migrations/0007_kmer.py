@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-19 16:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('peptides', '0006_alignment_seq_set'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Kmer',
+            fields=[
+                ('pkey', models.AutoField(primary_key=True, serialize=False)),
+                ('kmer', models.CharField(max_length=5)),
+                ('prot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='kmers', to='peptides.protein')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kmer'], name='kmer_idx')],
+            },
+        ),
+    ]
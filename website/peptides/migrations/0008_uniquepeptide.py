@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('peptides', '0007_kmer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UniquePeptide',
+            fields=[
+                ('pkey', models.AutoField(primary_key=True, serialize=False)),
+                ('prot', models.CharField(max_length=15)),
+                ('peptide', models.CharField(max_length=10000)),
+                ('location', models.IntegerField()),
+                ('source', models.CharField(choices=[('ms', 'mass spec'), ('trypsin', 'tryptic digest')], max_length=10)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['prot'], name='unique_pep_prot_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:02
+
+from django.db import migrations, models
+
+from peptides.masses import peptide_masses
+
+
+def fill_masses(apps, schema_editor):
+    Peptide = apps.get_model("peptides", "Peptide")
+    peps = list(Peptide.objects.only("pkey", "peptide"))
+    for pep, mass in zip(peps, peptide_masses([pep.peptide for pep in peps])):
+        pep.mass = None if mass != mass else float(mass)
+    Peptide.objects.bulk_update(peps, ["mass"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("peptides", "0008_uniquepeptide"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="peptide",
+            name="mass",
+            field=models.FloatField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(fill_masses, migrations.RunPython.noop),
+    ]
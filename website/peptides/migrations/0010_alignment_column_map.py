@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-19 19:15
+
+from django.db import migrations, models
+
+from peptides.alignment_map import clustal_column_map
+
+
+def fill_column_maps(apps, schema_editor):
+    Alignment = apps.get_model("peptides", "Alignment")
+    for alignment in Alignment.objects.all():
+        alignment.column_map = clustal_column_map(alignment.alignment)
+        alignment.save(update_fields=["column_map"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("peptides", "0009_peptide_mass"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="alignment",
+            name="column_map",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.RunPython(fill_column_maps, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-19 20:05
+
+from django.db import migrations, models
+
+from peptides.alignment_stats import clustal_column_stats
+
+
+def fill_column_stats(apps, schema_editor):
+    Alignment = apps.get_model("peptides", "Alignment")
+    for alignment in Alignment.objects.all():
+        alignment.column_stats = clustal_column_stats(alignment.alignment)
+        alignment.save(update_fields=["column_stats"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("peptides", "0010_alignment_column_map"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="alignment",
+            name="column_stats",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.RunPython(fill_column_stats, migrations.RunPython.noop),
+    ]
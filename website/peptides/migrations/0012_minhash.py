@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('peptides', '0011_alignment_column_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MinHash',
+            fields=[
+                ('prot', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='minhash', serialize=False, to='peptides.protein')),
+                ('signature', models.BinaryField()),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
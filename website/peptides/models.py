@@ -1,6 +1,10 @@
+import hashlib
 import re
 from django.contrib import admin
 from django.db import models
+from django.db.models import Q
+
+from .sequence_chunkers import alignment_seq_set_key, parse_clustal_num, relabel_alignment, seq_set_key
 
 class BaseModel(models.Model):
     class Meta:
@@ -41,7 +45,8 @@ class Protein(BaseModel):
 
     def save(self, *args, **kwargs):
         '''when protein saved, update the location of each associated 
-        peptide to reflect its location in the protein.
+        peptide to reflect its location in the protein,
+        and the protein's k-mers in the Kmer table.
         Also save the isoform number of the protein 
         (e.g., BLUTEN-1 has isoform # 1, BLUTEN-3 has isoform # 3)
         '''
@@ -49,28 +54,38 @@ class Protein(BaseModel):
         super().save(*args, **kwargs)
         for peptide in Peptide.objects.filter(prot = self.acc_num):
             peptide.save(force_update=True)
+        from .kmer_index import index_proteins
+        from .similarity import sign_proteins
+        index_proteins([self])
+        sign_proteins([self])
 
     def get_isoforms(self):
         '''Return all protein objects that are isoforms of self
         '''
         # if this is the primary isoform, this will get all isoforms
-        isos_2 = Isoform.objects.filter(prot_1 = self)
-        if not isos_2:
+        pairs = (Isoform.objects
+            .filter(prot_1 = self)
+            .values_list('prot_1__acc_num', 'prot_2__acc_num')
+        )
+        if not pairs:
             # this is a secondary isoform, or has no isoforms
-            isos_1 = Isoform.objects.filter(prot_2 = self)
-            if not isos_1:
+            primary_iso = (Isoform.objects
+                .filter(prot_2 = self)
+                .values_list('prot_1', flat=True)
+                .first()
+            )
+            if primary_iso is None:
                 return [] # no isoforms
-            # get the primary isoform, then get all isoforms of the primary
-            primary_iso = isos_1.values('prot_1')[0]['prot_1']
-            other_isos = Isoform.objects.filter(prot_1 = primary_iso)
-            all_isos = isos_2.union(other_isos)
-        else:
-            all_isos = isos_2
+            # get all isoforms of the primary
+            pairs = (Isoform.objects
+                .filter(prot_1 = primary_iso)
+                .values_list('prot_1__acc_num', 'prot_2__acc_num')
+            )
         acc_nums = set()
-        for iso in all_isos:
-            acc_nums.add(iso.prot_1.acc_num)
-            acc_nums.add(iso.prot_2.acc_num)
-        acc_nums.remove(self.acc_num)
+        for acc_num_1, acc_num_2 in pairs:
+            acc_nums.add(acc_num_1)
+            acc_nums.add(acc_num_2)
+        acc_nums.discard(self.acc_num)
         return (Protein.objects.filter(acc_num__in = acc_nums)
             .order_by('isoform_num'))
 
@@ -102,9 +117,122 @@ class Isoform(BaseModel):
     __repr__ = __str__
 
 
+def content_etag(content: str) -> str:
+    '''a strong HTTP ETag (including the quotes) for some text'''
+    return '"%s"' % hashlib.sha256(content.encode()).hexdigest()[:32]
+
+
 class Alignment(BaseModel):
     prots = models.CharField(max_length=300, primary_key=True)
     alignment = models.CharField(max_length=720_000)
+    # computed whenever the alignment is saved, so that conditional GETs
+    # of the alignment never need to read or hash the alignment itself
+    etag = models.CharField(max_length=34, default='')
+    modified = models.DateTimeField(auto_now=True)
+    # seq_set_key of the aligned sequences, so that the same sequences
+    # are never aligned twice, whatever their names or order
+    seq_set = models.CharField(max_length=64, default='', db_index=True)
+    # where each residue of each sequence is in the alignment; see alignment_map.py
+    column_map = models.JSONField(default=dict, blank=True)
+    # per-column identity, gaps and conservation; see alignment_stats.py
+    column_stats = models.JSONField(default=dict, blank=True)
+
+    def __str__(self) -> str:
+        return 'Alignment(%s)' % self.prots
+
+    def save(self, *args, **kwargs):
+        self.etag = content_etag(self.alignment)
+        try:
+            self.seq_set = alignment_seq_set_key(self.alignment)
+        except ValueError: # not a clustal_num alignment
+            self.seq_set = ''
+        # like etag, recomputed on every save in case the alignment was edited
+        from .alignment_map import clustal_column_map
+        from .alignment_stats import clustal_column_stats
+        self.column_map = clustal_column_map(self.alignment)
+        self.column_stats = clustal_column_stats(self.alignment)
+        super().save(*args, **kwargs)
+
+    def get_column_map(self):
+        '''an alignment_map.ColumnMap of this alignment, with its sequences'''
+        from .alignment_map import ColumnMap
+        return ColumnMap.from_clustal(self.alignment, self.column_map or None)
+
+
+def stored_alignment(seqs: dict) -> str:
+    '''an alignment already in the database of exactly the sequences
+    in seqs, with the names in seqs, or None'''
+    stored = (Alignment.objects
+        .filter(seq_set = seq_set_key(seqs.values()))
+        .values_list('alignment', flat=True)
+        .first()
+    )
+    if stored is None:
+        return None
+    return relabel_alignment(stored, seqs)
+
+
+def partial_alignment(seqs: dict) -> tuple:
+    '''(an alignment already in the database of some of the sequences in seqs,
+    with the names in seqs, {name: sequence} of the rest of seqs) for the stored
+    alignment of the most of them, or None if there isn't one of at least two'''
+    names = {seq: name for name, seq in seqs.items()}
+    if len(names) != len(seqs):
+        return None
+    query = Q()
+    for name in seqs:
+        query |= Q(prots__contains = name)
+    best = None
+    for stored in Alignment.objects.filter(query).values_list('alignment', flat=True):
+        _, seq_map, _ = parse_clustal_num(stored)
+        aligned = {seq.replace('-', '') for seq in seq_map.values()}
+        if len(aligned) != len(seq_map) or not aligned < set(names):
+            continue
+        if len(aligned) >= 2 and (best is None or len(aligned) > len(best[1])):
+            best = (stored, aligned)
+    if best is None:
+        return None
+    stored, aligned = best
+    clustal = relabel_alignment(stored, {names[seq]: seq for seq in aligned})
+    if clustal is None:
+        return None
+    return clustal, {name: seq for name, seq in seqs.items() if seq not in aligned}
+
+
+# length of the substrings in the Kmer table. Peptides at least this long
+# are found with the index; shorter ones need a scan of every sequence
+KMER_LENGTH = 5
+
+class Kmer(BaseModel):
+    '''One row for each distinct substring of KMER_LENGTH residues of each
+    protein's sequence: an inverted index for finding the proteins that
+    contain a peptide (see kmer_index.py)'''
+    pkey = models.AutoField(primary_key=True)
+    kmer = models.CharField(max_length=KMER_LENGTH)
+    prot = models.ForeignKey(Protein, on_delete=models.CASCADE, related_name='kmers')
+
+    def __str__(self) -> str:
+        return 'Kmer(%s, %s)' % (self.kmer, self.prot_id)
+
+    __repr__ = __str__
+
+    class Meta:
+        indexes = [
+            models.Index(fields = ['kmer'], name = 'kmer_idx')
+        ]
+
+
+class MinHash(BaseModel):
+    '''the MinHash signature of a protein's k-mers, for estimating how
+    similar it is to any other protein (see similarity.py)'''
+    prot = models.OneToOneField(Protein, on_delete=models.CASCADE, primary_key=True, related_name='minhash')
+    # similarity.NUM_HASHES uint32s
+    signature = models.BinaryField()
+
+    def __str__(self) -> str:
+        return 'MinHash(%s)' % self.prot_id
+
+    __repr__ = __str__
 
 
 class Peptide(BaseModel):
@@ -112,6 +240,8 @@ class Peptide(BaseModel):
     prot = models.CharField(max_length=15)
     peptide = models.CharField(max_length=10_000)
     location = models.IntegerField(default=-1)
+    # monoisotopic mass (Da), or null if a residue's mass is unknown; see masses.py
+    mass = models.FloatField(null=True, blank=True, db_index=True)
 
     def __str__(self):
         if len(self.peptide) > 20:
@@ -125,7 +255,10 @@ class Peptide(BaseModel):
         '''Find the protein with this peptide's accession number, and if that
         protein is in the database, set the location field to the location
         of this peptide in that protein's sequence.
+        Also sets the mass field.
         '''
+        from .masses import peptide_mass
+        self.mass = peptide_mass(self.peptide)
         corresponding_protein = Protein.objects.filter(acc_num = self.prot)
         if len(corresponding_protein) == 0:
             super().save(*args, **kwargs)
@@ -145,4 +278,26 @@ class Peptide(BaseModel):
     class Meta:
         indexes = [
             models.Index(fields = ['prot'], name = 'prot_idx')
-        ]
\ No newline at end of file
+        ]
+
+
+class UniquePeptide(BaseModel):
+    '''A peptide found in exactly one isoform of a protein family:
+    a mass spec peptide from the Peptide table, or a peptide from an
+    in-silico digest of the isoform (see discriminating_peptides.py)'''
+    SOURCES = [('ms', 'mass spec'), ('trypsin', 'tryptic digest')]
+    pkey = models.AutoField(primary_key=True)
+    prot = models.CharField(max_length=15)
+    peptide = models.CharField(max_length=10_000)
+    location = models.IntegerField()
+    source = models.CharField(max_length=10, choices=SOURCES)
+
+    def __str__(self) -> str:
+        return 'UniquePeptide(%s, %i, %s, %s)' % (self.prot, self.location, self.peptide, self.source)
+
+    __repr__ = __str__
+
+    class Meta:
+        indexes = [
+            models.Index(fields = ['prot'], name = 'unique_pep_prot_idx')
+        ]
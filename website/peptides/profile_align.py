@@ -0,0 +1,170 @@
+'''Adding sequences to an alignment without realigning the others.
+
+When UniProt adds an isoform to a family we already aligned, the new
+sequence is aligned to the profile of the stored alignment (how often each
+residue appears in each column) instead of sending the whole family to the
+EBI again. The existing sequences keep their alignment to each other; the
+new sequence gets gaps where it lacks a column, and the others get gaps in
+any columns added for residues only the new sequence has.
+
+extend_alignment uses Clustal Omega's own profile mode
+(clustalo --profile1 <stored alignment> --infile <new sequences>) when
+clustalo is installed. The EBI's REST service for Clustal Omega only takes
+sequences to align from scratch, so otherwise the sequences are added by
+add_sequences, a simpler fallback: a BLOSUM62 sequence-to-profile alignment
+without Clustal Omega's HMMs. Its output says so in the CLUSTAL header,
+instead of passing for Clustal Omega's.
+
+The dynamic programming is global for the new sequence, but skipping
+columns before its first residue or after its last one is free, since
+isoforms often differ by where they start or end. Each row of the table is
+computed with NumPy: the only dependency within a row (skipping columns)
+is a running maximum.
+'''
+import logging
+import pathlib
+import subprocess
+import tempfile
+
+import numpy as np
+from Bio.Align import substitution_matrices
+
+from .sequence_chunkers import format_clustal_num, parse_clustal_num
+from .timing import phase
+
+CLUSTALO = 'clustalo'
+# the header of alignments extended by add_sequences
+HEADER = 'CLUSTAL format alignment extended by peptides.profile_align (not Clustal Omega)'
+
+BLOSUM62 = substitution_matrices.load('BLOSUM62')
+ALPHABET = BLOSUM62.alphabet
+SCORES = np.array(BLOSUM62, dtype=np.float64)
+# penalty for a residue of the new sequence in a column of its own,
+# or for a column the new sequence skips (scaled by how full the column is)
+GAP = -6.0
+# residues that aren't in the matrix count as X
+_CODES = np.full(256, ALPHABET.index('X'), dtype=np.int64)
+for _ii, _aa in enumerate(ALPHABET):
+    _CODES[ord(_aa)] = _ii
+_GAP_CODE = len(ALPHABET)
+_CODES[ord('-')] = _GAP_CODE
+
+DIAG, INSERT, SKIP = 0, 1, 2
+# the table of moves has a byte per (residue, column) pair: 20 MB at most
+MAX_CELLS = 20_000_000
+
+
+def encode(seq: str) -> np.ndarray:
+    return _CODES[np.frombuffer(seq.upper().encode('ascii', 'replace'), dtype=np.uint8)]
+
+
+def profile(aligned: list) -> np.ndarray:
+    '''(number of columns, len(ALPHABET)) array: the fraction of the
+    aligned sequences with each residue in each column'''
+    codes = np.array([encode(seq) for seq in aligned]).reshape(len(aligned), -1)
+    counts = np.zeros((codes.shape[1], len(ALPHABET) + 1))
+    np.add.at(counts, (np.broadcast_to(np.arange(codes.shape[1]), codes.shape), codes), 1)
+    return counts[:, :-1] / max(1, len(aligned))
+
+
+def align_to_profile(seq: str, prof: np.ndarray, gap: float = GAP) -> np.ndarray:
+    '''For each column of the new alignment, the profile column it is
+    (or -1 for a column added for a residue of seq), and the residue of seq
+    in it (or -1 for a gap): a (2, number of columns) array'''
+    n_cols = len(prof)
+    codes = encode(seq)
+    # scores of each residue of seq in each column are computed a row at a time,
+    # so the only (residue, column) array is the byte-sized pointers
+    prof_t = np.ascontiguousarray(prof.T)
+    # skipping a column costs in proportion to how many sequences have a residue there
+    skip_cost = gap * prof.sum(axis=1)
+    cum_skip = np.concatenate([[0], np.cumsum(skip_cost)])
+    # skipping columns before the first residue is free
+    prev = np.zeros(n_cols + 1)
+    pointers = np.zeros((len(codes) + 1, n_cols + 1), dtype=np.int8)
+    pointers[0, 1:] = SKIP
+    for ii in range(1, len(codes) + 1):
+        best = np.empty(n_cols + 1)
+        best[0] = gap * ii
+        diag = prev[:-1] + SCORES[codes[ii - 1], :len(ALPHABET)] @ prof_t
+        insert = prev[1:] + gap
+        best[1:] = np.maximum(diag, insert)
+        from_skip = np.maximum.accumulate(best - cum_skip) + cum_skip
+        pointers[ii, 1:] = np.where(diag >= insert, DIAG, INSERT)
+        pointers[ii, 0] = INSERT
+        # (adding and subtracting cum_skip can round up)
+        pointers[ii][from_skip > best + 1e-9] = SKIP
+        prev = from_skip
+    # skipping columns after the last residue is free
+    ii, jj = len(codes), int(np.argmax(prev))
+    path = [(col, -1) for col in range(n_cols - 1, jj - 1, -1)]
+    while ii > 0 or jj > 0:
+        move = pointers[ii, jj]
+        if move == DIAG:
+            ii, jj = ii - 1, jj - 1
+            path.append((jj, ii))
+        elif move == INSERT:
+            ii -= 1
+            path.append((-1, ii))
+        else:
+            jj -= 1
+            path.append((jj, -1))
+    return np.array(path[::-1], dtype=np.int64).reshape(-1, 2).T
+
+
+def add_sequence(seq_map: dict, name: str, seq: str, gap: float = GAP) -> dict:
+    '''seq_map (accession numbers to aligned sequences) with seq added as name'''
+    columns, residues = align_to_profile(seq, profile(list(seq_map.values())), gap)
+    out = {}
+    for acc_num, aligned in seq_map.items():
+        # the added columns take the gap appended at the end
+        padded = np.frombuffer((aligned + '-').encode(), dtype=np.uint8)
+        out[acc_num] = padded[columns].tobytes().decode()
+    padded = np.frombuffer((seq + '-').encode(), dtype=np.uint8)
+    out[name] = padded[residues].tobytes().decode()
+    return out
+
+
+def add_sequences(clustal: str, seqs: dict, gap: float = GAP) -> str:
+    '''clustal (a clustal_num alignment) with the sequences in seqs
+    (accession numbers to sequences) added one at a time, longest first.
+    Raises ValueError if the alignment can't be extended within MAX_CELLS.'''
+    _, seq_map, _ = parse_clustal_num(clustal)
+    if not seq_map or len({len(seq) for seq in seq_map.values()}) > 1:
+        raise ValueError('Not a clustal_num alignment')
+    n_cols = len(next(iter(seq_map.values())))
+    if sum(len(seq) for seq in seqs.values()) * (n_cols + sum(len(seq) for seq in seqs.values())) > MAX_CELLS:
+        raise ValueError(f'Too large to extend: {n_cols} columns')
+    for name, seq in sorted(seqs.items(), key=lambda item: -len(item[1])):
+        seq_map = add_sequence(seq_map, name, seq, gap)
+    return format_clustal_num(seq_map, HEADER)
+
+
+def clustalo_add_sequences(clustal: str, seqs: dict, clustalo: str = CLUSTALO) -> str:
+    '''clustal with the sequences in seqs added by Clustal Omega's
+    sequence-to-profile alignment, which keeps the stored alignment's columns.
+    Raises FileNotFoundError if the clustalo executable can't be found.'''
+    _, seq_map, _ = parse_clustal_num(clustal)
+    with tempfile.TemporaryDirectory() as tmp:
+        profile = pathlib.Path(tmp) / 'profile.fasta'
+        profile.write_text(''.join(f'>{name}\n{seq}\n' for name, seq in seq_map.items()))
+        proc = subprocess.run(
+            [clustalo, f'--profile1={profile}', '--infile=-', '--outfmt=clustal', '--resno'],
+            input=''.join(f'>{name}\n{seq}\n' for name, seq in seqs.items()),
+            capture_output=True, text=True, check=True
+        )
+    return proc.stdout
+
+
+def extend_alignment(clustal: str, seqs: dict) -> str:
+    '''clustal with the sequences in seqs added, by clustalo_add_sequences
+    if Clustal Omega is installed, otherwise by add_sequences'''
+    try:
+        with phase('clustalo'):
+            return clustalo_add_sequences(clustal, seqs, CLUSTALO)
+    except FileNotFoundError: # no local Clustal Omega
+        pass
+    except subprocess.CalledProcessError as ex:
+        logging.warning(f"clustalo couldn't extend an alignment:\r\n{ex.stderr}")
+    with phase('profile_align'):
+        return add_sequences(clustal, seqs)
@@ -1,6 +1,10 @@
+import hashlib
 import re
 import json
 
+from .timing import timed
+
+@timed('chunking')
 def sequence_chunks(seq: str, peps, width: int):
     '''Show sequence with spans highlighting each mass spec peptide
     '''
@@ -86,57 +90,148 @@ def sequence_chunks(seq: str, peps, width: int):
     return chunks
 
 
-def process_clustal_num(clustal: str, peptides, width: int):
+def parse_clustal_num(clustal: str) -> tuple:
+    '''Returns (header, dict mapping accession numbers to aligned sequences
+    (with gaps), conservation line of stars, colons, etc.)
+    for a multiple sequence alignment in clustal_num format.'''
     chunks = re.split('\n{2,3}', clustal)
     header = chunks[0]
     seq_map = {}
     stars = ''
+    name_width = 14
     for chunk in chunks[1:]:
         lines = chunk.split('\n')
         for line in lines:
             if not line:
                 continue
             if line[0] == ' ':
-                stars += line[14:]
+                stars += line[name_width:]
                 continue
             acc_num, seq = line.split()[:2]
+            # the conservation line is indented to where the sequences start
+            name_width = line.index(seq, len(acc_num))
             seq_map.setdefault(acc_num, '')
             seq_map[acc_num] += seq
+    return header, seq_map, stars
+
+
+# residues in the same group are similar enough for Clustal to mark the
+# column with ':' (strong groups) or '.' (weak groups)
+STRONG_GROUPS = ['STA', 'NEQK', 'NHQK', 'NDEQ', 'QHRK', 'MILV', 'MILF', 'HY', 'FYW']
+WEAK_GROUPS = ['CSA', 'ATV', 'SAG', 'STNK', 'STPA', 'SGND', 'SNDEQK', 'NDEQHK', 'NEQHRK', 'FVLIM', 'HFY']
+
+def conservation_line(seqs: list) -> str:
+    '''The Clustal conservation line for aligned sequences of equal length:
+    '*' where all residues are identical, ':' or '.' where they are all in the same
+    strong or weak group, and ' ' otherwise (including any column with a gap).'''
+    out = []
+    for col in zip(*seqs):
+        residues = set(col)
+        if '-' in residues:
+            out.append(' ')
+        elif len(residues) == 1:
+            out.append('*')
+        elif any(residues.issubset(g) for g in STRONG_GROUPS):
+            out.append(':')
+        elif any(residues.issubset(g) for g in WEAK_GROUPS):
+            out.append('.')
+        else:
+            out.append(' ')
+    return ''.join(out)
+
+
+def format_clustal_num(seq_map: dict, header: str = 'CLUSTAL O(1.2.4) multiple sequence alignment',
+                       width: int = 60) -> str:
+    '''The inverse of parse_clustal_num: format a dict mapping accession numbers
+    to aligned sequences (all the same length) as clustal_num,
+    with a conservation line under each block.'''
+    name_width = max(14, max(len(acc_num) for acc_num in seq_map) + 1)
+    stars = conservation_line(list(seq_map.values()))
+    aln_len = len(stars)
+    counts = dict.fromkeys(seq_map, 0)
+    blocks = []
+    for start in range(0, aln_len, width):
+        lines = []
+        for acc_num, seq in seq_map.items():
+            piece = seq[start:start + width]
+            counts[acc_num] += len(piece) - piece.count('-')
+            lines.append('%s%s\t%i' % (acc_num.ljust(name_width), piece, counts[acc_num]))
+        lines.append(' ' * name_width + stars[start:start + width])
+        blocks.append('\n'.join(lines))
+    return header + '\n\n\n' + '\n\n'.join(blocks) + '\n'
+
+
+def seq_set_key(seqs) -> str:
+    '''the same for any collection of sequences with the same members,
+    whatever their order or names'''
+    return hashlib.sha256('\n'.join(sorted(seqs)).encode()).hexdigest()
+
+
+def alignment_seq_set_key(clustal: str) -> str:
+    '''seq_set_key of the (ungapped) sequences in a clustal_num alignment'''
+    _, seq_map, _ = parse_clustal_num(clustal)
+    return seq_set_key(seq.replace('-', '') for seq in seq_map.values())
+
+
+def relabel_alignment(clustal: str, seqs: dict) -> str:
+    '''An alignment of exactly the sequences in seqs (a dict mapping names to
+    sequences), possibly made for other names or in another order,
+    with the names in seqs instead. Returns None if the sequences aren't the same.'''
+    header, seq_map, _ = parse_clustal_num(clustal)
+    names = {seq: name for name, seq in seqs.items()}
+    if len(names) != len(seqs) or len(seq_map) != len(seqs):
+        return None
+    try:
+        aligned = {names[seq.replace('-', '')]: seq for seq in seq_map.values()}
+    except KeyError:
+        return None
+    if len(aligned) != len(seqs):
+        return None
+    if list(aligned) == list(seq_map):
+        return clustal
+    return format_clustal_num(aligned, header)
+
+
+@timed('chunking')
+def process_clustal_num(clustal: str, peptides, width: int, column_map: dict = None):
+    '''peptides: any iterable of objects with prot, peptide and location
+    attributes (e.g., a QuerySet of Peptides, which is only evaluated once)
+    column_map: the alignment's Alignment.column_map, if stored'''
+    header, seq_map, stars = parse_clustal_num(clustal)
+    from .alignment_map import ColumnMap, compact_column_map
+    columns = ColumnMap(column_map or compact_column_map(seq_map))
     seq_map['zzzz'] = stars
     from .models import isoform_num
     sorted_acc_nums = sorted(seq_map.keys(), key = lambda x: 10000 if x == 'zzzz' else isoform_num(x))
+    peps_by_prot = {}
+    for pep in peptides:
+        peps_by_prot.setdefault(pep.prot, []).append(pep)
     prots = []
     nchunks = 0
     for acc_num in sorted_acc_nums:
         seq = seq_map[acc_num]
-        peps = (peptides
-            .filter(prot = acc_num)
-            .order_by('location')
-        )
+        peps = sorted(peps_by_prot.get(acc_num, []), key = lambda pep: pep.location)
         chunks_this_seq = sequence_chunks(seq, peps, width)
         nchunks = max(len(chunks_this_seq), nchunks)
         prots.append({'acc_num': acc_num, 'chunks': chunks_this_seq})
     group_by_chunk = []
-    old_chunk_ends = {}
     for ii in range(nchunks):
         curchunk = []
+        last_column = min((ii + 1) * width, columns.length) - 1
         for prot in prots:
             try:
                 chunk = prot['chunks'][ii]
             except IndexError:
                 chunk = [{'seq': ''}]
             acc_num = '' if prot['acc_num'] == 'zzzz' else prot['acc_num']
-            old_chunk_ends.setdefault(acc_num, 0)
-            old_chunk_end = old_chunk_ends[acc_num]
-            chunk_end = old_chunk_end + sum(len(p['seq']) - p['seq'].count('-') for p in chunk)
             is_prot_chunk = len(acc_num) > 0
             curchunk.append({
                 'acc_num': acc_num,
                 'chunk': chunk,
-                'chunk_end': chunk_end,
+                # the number of residues through the end of this chunk
+                'chunk_end': columns.residues_through(acc_num, last_column) if is_prot_chunk else last_column + 1,
                 'is_prot_chunk': is_prot_chunk,
             })
-            old_chunk_ends[acc_num] = chunk_end
         group_by_chunk.append(curchunk)
     # print(json.dumps(group_by_chunk, indent = 4))
     return {'header': header, 'chunks': group_by_chunk}
\ No newline at end of file
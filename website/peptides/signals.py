@@ -0,0 +1,17 @@
+'''Signal handlers, connected in PeptidesConfig.ready'''
+from django.db.models.signals import post_delete, post_save
+
+from . import caching
+from .models import Alignment, Isoform, Peptide, Protein
+
+
+def invalidate_cached_pages(sender, **kwargs):
+    caching.invalidate()
+
+
+def connect():
+    for model in [Protein, Isoform, Alignment, Peptide]:
+        post_save.connect(invalidate_cached_pages, sender=model,
+            dispatch_uid='invalidate_on_save_%s' % model.__name__)
+        post_delete.connect(invalidate_cached_pages, sender=model,
+            dispatch_uid='invalidate_on_delete_%s' % model.__name__)
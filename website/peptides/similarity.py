@@ -0,0 +1,198 @@
+'''How similar are two proteins?
+
+Isoforms of one protein are compared through their stored alignment: the
+percent identity of every pair is the fraction of the columns where both
+have a residue in which the residues are the same. That is a handful of
+matrix products over the one-hot encoded alignment, for all pairs at once.
+
+Proteins of different families have no alignment, so they are compared by
+an estimate of the Jaccard similarity of their sets of k-mers: the MinHash
+signature of each protein (the smallest of its k-mers' values under each of
+NUM_HASHES hash functions) is computed when the protein is saved (or in bulk,
+in a process pool, by the find_similar_proteins command) and stored in the
+MinHash table. The fraction of hash functions
+for which two signatures agree estimates their similarity, so one protein
+is compared with every other one in a single vectorized comparison, and all
+pairs of similar proteins are found by locality-sensitive hashing (pairs
+that agree on every row of any one band of the signatures) instead of
+comparing every pair.
+'''
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+
+import numpy as np
+
+from .sequence_chunkers import parse_clustal_num
+
+# k-mers shorter than this are shared by too many unrelated proteins
+MINHASH_K = 5
+NUM_HASHES = 64
+# 16 bands of 4 rows: pairs with similarity 0.5 are candidates 64% of the time, 0.7: 99%
+BANDS = 16
+# a Mersenne prime larger than 26 ** MINHASH_K
+PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(20_241_019)
+HASH_A = _rng.integers(1, PRIME, NUM_HASHES, dtype=np.int64)
+HASH_B = _rng.integers(0, PRIME, NUM_HASHES, dtype=np.int64)
+# below this many sequences, starting worker processes takes longer than hashing
+PARALLEL_THRESHOLD = 2000
+# buckets with more proteins than this are mostly low-complexity sequences
+MAX_BUCKET = 500
+
+
+def identity_matrix(seq_map: dict) -> np.ndarray:
+    '''percent identity of every pair of aligned sequences in seq_map
+    (as from parse_clustal_num), in its order: identical columns out of
+    the columns where both sequences have a residue'''
+    residues = np.array([np.frombuffer(seq.encode(), dtype=np.uint8) for seq in seq_map.values()])
+    is_res = (residues != ord('-')).astype(np.float32)
+    same = np.zeros((len(residues), len(residues)), dtype=np.float32)
+    for code in np.unique(residues[residues != ord('-')]):
+        one_hot = (residues == code).astype(np.float32)
+        same += one_hot @ one_hot.T
+    both = is_res @ is_res.T
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(both > 0, 100 * same / both, 0.0)
+
+
+def clustal_identity(clustal: str) -> tuple:
+    '''(accession numbers, identity_matrix) of a clustal_num alignment'''
+    _, seq_map, _ = parse_clustal_num(clustal)
+    return list(seq_map), identity_matrix(seq_map)
+
+
+def kmer_codes(seq: str, k: int = MINHASH_K) -> np.ndarray:
+    '''every k-mer of seq as a number below 26 ** k'''
+    codes = np.frombuffer(seq.upper().encode('ascii', 'replace'), dtype=np.uint8).astype(np.int64) - ord('A')
+    codes = np.clip(codes, 0, 25)
+    if len(codes) < k:
+        return np.zeros(0, dtype=np.int64)
+    windows = np.lib.stride_tricks.sliding_window_view(codes, k)
+    return windows @ (26 ** np.arange(k - 1, -1, -1, dtype=np.int64))
+
+
+def signature(seq: str) -> np.ndarray:
+    '''the MinHash signature of seq's k-mers (all PRIME if seq is shorter than MINHASH_K)'''
+    codes = np.unique(kmer_codes(seq))
+    if len(codes) == 0:
+        return np.full(NUM_HASHES, PRIME, dtype=np.uint32)
+    return ((HASH_A[:, None] * codes[None, :] + HASH_B[:, None]) % PRIME).min(axis=1).astype(np.uint32)
+
+
+def _signatures(seqs: list) -> np.ndarray:
+    return np.array([signature(seq) for seq in seqs], dtype=np.uint32).reshape(-1, NUM_HASHES)
+
+
+def signatures(seqs: list, processes: int = None, chunk_size: int = 500) -> np.ndarray:
+    '''(len(seqs), NUM_HASHES) array of the signatures of seqs, computed by a pool of
+    processes (default: one per CPU) if there are at least PARALLEL_THRESHOLD sequences'''
+    if processes == 1 or len(seqs) < PARALLEL_THRESHOLD:
+        return _signatures(seqs)
+    chunks = [seqs[ii:ii + chunk_size] for ii in range(0, len(seqs), chunk_size)]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return np.concatenate(list(pool.map(_signatures, chunks)))
+
+
+def similarity(sig: np.ndarray, sigs: np.ndarray) -> np.ndarray:
+    '''estimated Jaccard similarity of the k-mers of one signature with each row of sigs'''
+    return (sigs == sig).mean(axis=1)
+
+
+def candidate_pairs(sigs: np.ndarray, bands: int = BANDS) -> np.ndarray:
+    '''(n, 2) array of the pairs of rows of sigs (i < j) that agree on every hash
+    of at least one band of NUM_HASHES // bands hashes'''
+    rows = NUM_HASHES // bands
+    pairs = set()
+    for band in range(bands):
+        keys = np.ascontiguousarray(sigs[:, band * rows:(band + 1) * rows]).view(f'V{4 * rows}').ravel()
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        bounds = np.flatnonzero(sorted_keys[1:] != sorted_keys[:-1]) + 1
+        for bucket in np.split(order, bounds):
+            if 1 < len(bucket) <= MAX_BUCKET:
+                pairs.update(itertools.combinations(sorted(bucket.tolist()), 2))
+    return np.array(sorted(pairs), dtype=np.int64).reshape(-1, 2)
+
+
+def all_pairs(sigs: np.ndarray, min_similarity: float = 0.5, bands: int = BANDS) -> list:
+    '''[(i, j, estimated similarity)] for the pairs of rows of sigs
+    at least min_similarity similar (most of them, for high similarities),
+    without comparing every pair'''
+    pairs = candidate_pairs(sigs, bands)
+    if len(pairs) == 0:
+        return []
+    sims = (sigs[pairs[:, 0]] == sigs[pairs[:, 1]]).mean(axis=1)
+    keep = sims >= min_similarity
+    return [(int(ii), int(jj), float(sim)) for (ii, jj), sim in zip(pairs[keep], sims[keep])]
+
+
+def sign_proteins(prots, replace: bool = True, processes: int = 1) -> int:
+    '''Store the signatures of some Protein objects (with their prot_id and sequence),
+    like kmer_index.index_proteins. replace=False skips deleting the old signatures,
+    for proteins that were just created. Returns the number of signatures written.'''
+    from django.db import transaction
+    from .models import MinHash
+
+    prots = [prot for prot in prots if prot.prot_id is not None]
+    sigs = signatures([prot.sequence for prot in prots], processes)
+    with transaction.atomic():
+        for ii in range(0, len(prots), 1000):
+            chunk = prots[ii:ii + 1000]
+            if replace:
+                MinHash.objects.filter(prot_id__in = [prot.prot_id for prot in chunk]).delete()
+            MinHash.objects.bulk_create([MinHash(prot_id = prot.prot_id, signature = sig.tobytes())
+                for prot, sig in zip(chunk, sigs[ii:ii + 1000])])
+    return len(prots)
+
+
+def update_signatures(processes: int = None, batch_size: int = 5000) -> int:
+    '''Compute and store the signatures of the proteins that don't have one,
+    batch_size proteins per transaction. Returns how many were computed.'''
+    from django.db import transaction
+    from .models import MinHash, Protein
+
+    missing = list(Protein.objects.filter(minhash__isnull = True).values_list('prot_id', 'sequence'))
+    for ii in range(0, len(missing), batch_size):
+        batch = missing[ii:ii + batch_size]
+        sigs = signatures([seq for _, seq in batch], processes)
+        with transaction.atomic():
+            MinHash.objects.bulk_create(
+                [MinHash(prot_id = prot_id, signature = sig.tobytes()) for (prot_id, _), sig in zip(batch, sigs)],
+                batch_size=1000, ignore_conflicts=True,
+            )
+    return len(missing)
+
+
+def load_signatures() -> tuple:
+    '''(accession numbers, (n, NUM_HASHES) array of their signatures) for every protein
+    with a stored signature, in one query'''
+    from .models import MinHash
+
+    rows = list(MinHash.objects.values_list('prot__acc_num', 'signature'))
+    sigs = np.frombuffer(b''.join(bytes(sig) for _, sig in rows), dtype=np.uint32).reshape(-1, NUM_HASHES)
+    return [acc_num for acc_num, _ in rows], sigs
+
+
+def similar_proteins(acc_num: str, n: int = 20, min_similarity: float = 0.1) -> list:
+    '''[(accession number, estimated similarity)] of the n proteins most similar
+    to acc_num (at least min_similarity), most similar first.
+    Only proteins with a stored signature are compared (and [] is returned
+    if acc_num has none); the signatures are kept in memory until the database changes.'''
+    from .caching import per_process
+
+    def build():
+        acc_nums, sigs = load_signatures()
+        return acc_nums, sigs, {acc_num: ii for ii, acc_num in enumerate(acc_nums)}
+
+    acc_nums, sigs, row_of = per_process('minhash_signatures', build)
+    if acc_num not in row_of:
+        return []
+    sims = similarity(sigs[row_of[acc_num]], sigs)
+    order = np.argsort(-sims, kind='stable')
+    out = []
+    for ii in order:
+        if sims[ii] < min_similarity or len(out) == n:
+            break
+        if acc_nums[ii] != acc_num:
+            out.append((acc_nums[ii], float(sims[ii])))
+    return out
@@ -0,0 +1,305 @@
+'''A local stand-in for the parts of the UniProt REST API and the EBI's
+Clustal Omega service that align_isoforms.py uses, so that tests don't depend
+on the network and ingestion can be load tested without hammering UniProt.
+
+Routes (relative to the server's URL):
+    GET  /uniprot/uniprotkb/search?query=accession%3D<acc_num>[&fields=<fields>]
+         (or query=accession:<acc_num> OR accession:<acc_num>... for several)
+    POST /ebi/clustalo/run
+    GET  /ebi/clustalo/status/<job_id>
+    GET  /ebi/clustalo/result/<job_id>/aln-clustal_num
+
+UniProt responses are replayed from the JSON files in stub_data/uniprot
+(one entry per file, named <accession number>.json).
+Alignments are replayed from the clustal_num files in stub_data/ebi when
+the submitted sequences are exactly the sequences of a recorded alignment;
+otherwise the sequences are simply padded with gaps to the same length.
+
+Latency, server errors (503) and throttling (429 with a Retry-After header)
+can be injected to see how the code that calls these services copes.
+Run it with `python manage.py uniprot_stub`, or use StubServer in tests:
+
+    with StubServer(latency=0.05) as stub:
+        align_isoforms.set_api_urls(stub.uniprot_url, stub.ebi_url)
+        ...
+'''
+import collections
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import itertools
+import json
+import logging
+import pathlib
+import random
+import re
+import threading
+import time
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from Bio.SeqUtils.CheckSum import crc64
+
+from .sequence_chunkers import alignment_seq_set_key, format_clustal_num, relabel_alignment, seq_set_key
+
+STUB_DATA_DIR = pathlib.Path(__file__).parent/'stub_data'
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+
+def read_fasta_text(fasta: str) -> dict:
+    '''{name: sequence} for every record of some FASTA text'''
+    seqs = {}
+    name = None
+    for line in fasta.splitlines():
+        line = line.strip()
+        if line.startswith('>'):
+            name = line[1:].split()[0]
+            seqs[name] = ''
+        elif name is not None:
+            seqs[name] += line
+    return seqs
+
+
+# UniProt result field names -> the keys of an entry they include
+FIELD_KEYS = {
+    'accession': 'primaryAccession',
+    'id': 'uniProtkbId',
+    'sequence': 'sequence',
+    'organism_name': 'organism',
+}
+
+def project(entry: dict, fields: str) -> dict:
+    '''entry with only the fields requested with the fields= parameter,
+    the way UniProt does it. cc_<comment type> fields select comments,
+    e.g. cc_alternative_products.'''
+    out = {'entryType': entry.get('entryType', ''), 'primaryAccession': entry['primaryAccession']}
+    comment_types = set()
+    for field in fields.split(','):
+        field = field.strip()
+        if field in FIELD_KEYS and FIELD_KEYS[field] in entry:
+            out[FIELD_KEYS[field]] = entry[FIELD_KEYS[field]]
+        elif field.startswith('cc_'):
+            comment_types.add(field[3:].replace('_', ' ').upper())
+    comments = [c for c in entry.get('comments', []) if c.get('commentType') in comment_types]
+    if comments:
+        out['comments'] = comments
+    return out
+
+
+def synthetic_entry(acc_num: str) -> dict:
+    '''A made-up but consistent UniProt entry for any accession number.
+    The same accession number always gets the same sequence;
+    canonical isoforms have 2 to 4 isoforms that differ by a deleted segment.'''
+    base = acc_num.split('-')[0]
+    rng = random.Random(base)
+    seq = ''.join(rng.choice(AMINO_ACIDS) for _ in range(rng.randint(100, 600)))
+    n_isoforms = rng.randint(2, 4)
+    if base != acc_num:
+        iso_num = int(acc_num.split('-')[1])
+        start = rng.randrange(0, len(seq) // 2) + iso_num
+        seq = seq[:start] + seq[start + 10 * iso_num:]
+    entry = {
+        'primaryAccession': acc_num,
+        'uniProtkbId': base + '_SYNTH',
+        'comments': [],
+        'sequence': {'value': seq, 'length': len(seq), 'crc64': crc64(seq)[4:]},
+    }
+    if base == acc_num:
+        entry['comments'].append({
+            'commentType': 'ALTERNATIVE PRODUCTS',
+            'isoforms': [{'isoformIds': ['%s-%i' % (base, ii)]} for ii in range(1, n_isoforms + 1)],
+        })
+    return entry
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logging.debug('stub server: ' + format, *args)
+
+    def send(self, status: int, body, content_type='text/plain', headers=None):
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def injected_fault(self) -> bool:
+        '''sleep for the configured latency, then maybe send an error
+        instead of handling the request. Returns True if an error was sent.'''
+        stub = self.server.stub
+        delay = stub.latency + stub.rng_uniform(0, stub.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        roll = stub.rng_uniform(0, 1)
+        if roll < stub.throttle_rate:
+            stub.count('429')
+            self.send(429, 'Too many requests', headers={'Retry-After': str(stub.retry_after)})
+            return True
+        if roll < stub.throttle_rate + stub.failure_rate:
+            stub.count('503')
+            self.send(503, 'Service unavailable')
+            return True
+        return False
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [unquote(x) for x in url.path.strip('/').split('/')]
+        if self.injected_fault():
+            return
+        stub = self.server.stub
+        if parts[:3] == ['uniprot', 'uniprotkb', 'search']:
+            stub.count('uniprot')
+            params = parse_qs(url.query)
+            query = params.get('query', [''])[0]
+            results = []
+            # e.g. accession=P56856 or accession:P56856 OR accession:P56856-2
+            for acc_num in re.findall(r'accession[:=]([A-Za-z0-9-]+)', query):
+                entry = stub.uniprot_entry(acc_num)
+                if entry and params.get('fields'):
+                    entry = project(entry, params['fields'][0])
+                if entry:
+                    results.append(entry)
+            return self.send(200, json.dumps({'results': results}), 'application/json')
+        if parts[:2] == ['ebi', 'clustalo'] and len(parts) >= 4:
+            stub.count('ebi')
+            job = stub.jobs.get(parts[3])
+            if job is None:
+                return self.send(404, 'Job not found')
+            if parts[2] == 'status':
+                done = time.monotonic() - job['submitted'] >= stub.job_seconds
+                return self.send(200, 'FINISHED' if done else 'RUNNING')
+            if parts[2] == 'result':
+                return self.send(200, stub.alignment(job['seqs']))
+        self.send(404, 'Not found')
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode())
+        if self.injected_fault():
+            return
+        stub = self.server.stub
+        if url.path.rstrip('/') == '/ebi/clustalo/run':
+            stub.count('ebi')
+            seqs = read_fasta_text(form.get('sequence', [''])[0])
+            if not seqs:
+                return self.send(400, 'No sequences submitted')
+            return self.send(200, stub.submit(seqs))
+        self.send(404, 'Not found')
+
+
+class StubServer:
+    '''Serves recorded UniProt and EBI responses on a background thread.
+
+    data_dir: directory with uniprot/ and ebi/ subdirectories of recordings
+    latency, jitter: every request waits latency + uniform(0, jitter) seconds
+    failure_rate: fraction of requests answered with 503 Service Unavailable
+    throttle_rate: fraction of requests answered with 429 Too Many Requests
+        (and a Retry-After header of retry_after seconds)
+    job_seconds: how long an alignment job stays RUNNING
+    synthetic: make up entries for accession numbers that weren't recorded
+        (see synthetic_entry) instead of returning no results
+    port: 0 picks any free port
+    '''
+    def __init__(self, host='127.0.0.1', port=0, data_dir=STUB_DATA_DIR,
+            latency=0., jitter=0., failure_rate=0., throttle_rate=0., retry_after=1,
+            job_seconds=0., synthetic=False, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.job_seconds = job_seconds
+        self.synthetic = synthetic
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = collections.Counter()
+        self.jobs = {}
+        self.job_ids = itertools.count(1)
+        self.entries = {}
+        self.alignments = {}
+        self.load(data_dir)
+        self.httpd = ThreadingHTTPServer((host, port), StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.stub = self
+        self.thread = None
+
+    def load(self, data_dir):
+        '''read the recordings in data_dir'''
+        data_dir = pathlib.Path(data_dir)
+        for fname in sorted(data_dir.glob('uniprot/*.json')):
+            with open(fname) as f:
+                self.entries[fname.stem] = json.load(f)
+        for fname in sorted(data_dir.glob('ebi/*.clustal_num')):
+            with open(fname) as f:
+                clustal = f.read()
+            self.alignments[alignment_seq_set_key(clustal)] = clustal
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return 'http://%s:%i' % (host, port)
+
+    @property
+    def uniprot_url(self) -> str:
+        '''replaces https://rest.uniprot.org'''
+        return self.url + '/uniprot'
+
+    @property
+    def ebi_url(self) -> str:
+        '''replaces https://www.ebi.ac.uk/Tools/services/rest/clustalo'''
+        return self.url + '/ebi/clustalo'
+
+    def rng_uniform(self, a, b):
+        with self.lock:
+            return self.rng.uniform(a, b)
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def uniprot_entry(self, acc_num: str) -> dict:
+        entry = self.entries.get(acc_num)
+        if entry is None and self.synthetic:
+            entry = synthetic_entry(acc_num)
+        return entry
+
+    def submit(self, seqs: dict) -> str:
+        job_id = 'clustalo-stub-%i' % next(self.job_ids)
+        self.jobs[job_id] = {'seqs': seqs, 'submitted': time.monotonic()}
+        return job_id
+
+    def alignment(self, seqs: dict) -> str:
+        '''the recorded alignment of seqs (with the submitted names)
+        if there is one, otherwise the sequences padded with trailing gaps'''
+        recorded = self.alignments.get(seq_set_key(seqs.values()))
+        if recorded:
+            relabeled = relabel_alignment(recorded, seqs)
+            if relabeled:
+                return relabeled
+        width = max(len(seq) for seq in seqs.values())
+        return format_clustal_num({name: seq.ljust(width, '-') for name, seq in seqs.items()})
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        if self.thread is not None:
+            self.httpd.shutdown()
+            self.thread.join()
+            self.thread = None
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
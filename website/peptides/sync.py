@@ -0,0 +1,135 @@
+'''Keeping the proteins in the database up to date with new UniProt releases.
+
+UniProt publishes a CRC64 checksum of every sequence. We ask for the
+sequences (and their checksums) of up to a few hundred accession numbers per
+request, compare each checksum with that of the stored sequence, and only
+touch the proteins whose sequence changed: their sequence is updated, their
+peptides are located again, and only the alignments that include them are
+deleted (or redone). Checking 10,000 proteins takes about 100 requests.
+'''
+import logging
+
+from Bio.SeqUtils.CheckSum import crc64
+from django.db import transaction
+
+from . import align_isoforms as ai
+from .caching import invalidate
+from .discriminating_peptides import families, precompute
+from .ingest import align_family, batches, locate_peptides
+from .kmer_index import index_proteins
+from .models import Alignment, Protein, UniquePeptide
+from .similarity import sign_proteins
+
+# UniProt returns at most 500 results per page, and long URLs get rejected
+BATCH_SIZE = 100
+
+
+def checksum(seq: str) -> str:
+    '''the CRC64 checksum of seq, in the same format as UniProt's JSON
+    (16 hex digits, without Bio.SeqUtils.CheckSum's "CRC-" prefix)'''
+    return crc64(seq)[4:]
+
+
+def current_sequences(acc_nums: list, batch_size: int = BATCH_SIZE) -> dict:
+    '''{accession number: (checksum, sequence)} of the current UniProt release,
+    batch_size accession numbers per request. Accession numbers that are
+    no longer in UniProt (e.g., merged or deleted entries) are left out.'''
+    current = {}
+    for batch in batches(acc_nums, batch_size):
+        for entry in ai.search_proteins(batch):
+            seq = entry['sequence']
+            current[entry['primaryAccession']] = (seq.get('crc64') or checksum(seq['value']), seq['value'])
+    return current
+
+
+def changed_sequences(stored: dict, current: dict) -> dict:
+    '''{accession number: new sequence} for the proteins in stored
+    ({accession number: sequence}) whose checksum differs from current's'''
+    return {acc_num: current[acc_num][1] for acc_num, seq in stored.items()
+        if acc_num in current and checksum(seq) != current[acc_num][0]}
+
+
+def aligned_acc_nums(prots: str) -> set:
+    '''the accession numbers in an Alignment's key, without -1 suffixes'''
+    return {acc_num[:-2] if acc_num.endswith('-1') else acc_num for acc_num in prots.split(',')}
+
+
+def affected_alignments(acc_nums) -> list:
+    '''keys of the alignments that include any of acc_nums'''
+    acc_nums = set(acc_nums)
+    return [prots for prots in Alignment.objects.values_list('prots', flat=True)
+        if acc_nums & aligned_acc_nums(prots)]
+
+
+def apply_changes(changed: dict, realign: str = None) -> dict:
+    '''Update the sequences (and k-mers and MinHash signatures) in changed
+    ({accession number: new sequence}), locate their peptides again (peptides no
+    longer found get location -1), find the unique peptides of their families
+    again and delete the alignments that include them, in one transaction.
+    If realign is 'ebi' or 'local', the deleted alignments are then redone
+    with ingest.align_family.
+    Returns counts of the proteins, peptides, families and alignments changed,
+    and of the alignments redone.'''
+    counts = {'proteins': 0, 'peptides': 0, 'families': 0, 'alignments': 0, 'realigned': 0}
+    if not changed:
+        return counts
+    with transaction.atomic():
+        prots = list(Protein.objects.filter(acc_num__in = list(changed)))
+        for prot in prots:
+            prot.sequence = changed[prot.acc_num]
+        Protein.objects.bulk_update(prots, ['sequence'], batch_size=500)
+        index_proteins(prots)
+        sign_proteins(prots)
+        counts['proteins'] = len(prots)
+        counts['peptides'] = locate_peptides(changed, unlocated=-1)
+        # a changed sequence can make peptides of its family's other isoforms
+        # unique or not, so the whole family is redone
+        UniquePeptide.objects.filter(prot__in = list(changed)).delete()
+        counts['families'] = precompute(families(list(changed)))['families']
+        stale = affected_alignments(changed)
+        Alignment.objects.filter(prots__in = stale).delete()
+        counts['alignments'] = len(stale)
+    # bulk_update doesn't send post_save signals
+    invalidate()
+    if realign:
+        for prots in stale:
+            acc_nums = prots.split(',')
+            seqs = dict(Protein.objects
+                .filter(acc_num__in = aligned_acc_nums(prots))
+                .values_list('acc_num', 'sequence')
+            )
+            seqs = {acc_num: seqs.get(acc_num[:-2] if acc_num.endswith('-1') else acc_num)
+                for acc_num in acc_nums}
+            if None in seqs.values():
+                logging.warning(f"Not realigning {prots}: some of its proteins are no longer in the database")
+                continue
+            alignment = align_family(seqs, realign)
+            if alignment:
+                Alignment.objects.create(prots = prots, alignment = alignment)
+                counts['realigned'] += 1
+    return counts
+
+
+def sync_proteins(acc_nums: list = None, batch_size: int = BATCH_SIZE,
+        realign: str = None, dry_run: bool = False) -> dict:
+    '''Compare the stored sequences of acc_nums (default: every protein
+    in the database) with the current UniProt release, and apply_changes
+    to the ones that changed (unless dry_run).
+    Returns the counts from apply_changes, plus the numbers of proteins
+    checked and missing from UniProt, and the accession numbers that
+    changed and that are missing.'''
+    stored = Protein.objects.order_by('prot_id')
+    if acc_nums is not None:
+        stored = stored.filter(acc_num__in = acc_nums)
+    stored = dict(stored.values_list('acc_num', 'sequence'))
+    current = current_sequences(list(stored), batch_size)
+    changed = changed_sequences(stored, current)
+    missing = [acc_num for acc_num in stored if acc_num not in current]
+    if missing:
+        logging.warning(f"{len(missing)} proteins are no longer in UniProt, e.g. {missing[:5]}")
+    counts = {'proteins': 0, 'peptides': 0, 'families': 0, 'alignments': 0, 'realigned': 0}
+    if not dry_run:
+        counts = apply_changes(changed, realign)
+    counts.update(checked = len(stored), missing = len(missing),
+        changed_acc_nums = list(changed), missing_acc_nums = missing)
+    return counts
@@ -0,0 +1,129 @@
+'''Fill the database with made-up protein families, peptides and alignments,
+to see how the views behave with as much data as the real site
+(or much more) without downloading anything.
+
+Every synthetic accession number is valid (e.g., Q0A0A0) and every peptide
+really is found at its location in its protein, so all the pages work.
+'''
+import random
+
+from django.db import transaction
+
+from .alignment_map import compact_column_map
+from .alignment_stats import compute_column_stats
+from .benchmarks import synthetic_family
+from .caching import invalidate
+from .ingest import batches, new_acc_nums
+from .kmer_index import index_proteins
+from .masses import set_masses
+from .models import Alignment, Isoform, Peptide, Protein, content_etag
+from .sequence_chunkers import format_clustal_num, seq_set_key
+from .similarity import sign_proteins
+
+BASE_36 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+# titin is the longest known protein
+MAX_LENGTH = 35_000
+
+
+def synthetic_acc_num(ii: int) -> str:
+    '''a distinct accession number in the style of P56856 for each ii < 4,665,600'''
+    rest = ii // 100
+    middle = ''.join(BASE_36[(rest // 36 ** k) % 36] for k in (2, 1, 0))
+    return 'Q%i%s%i' % (ii % 10, middle, (ii // 10) % 10)
+
+
+def family_plan(n_proteins: int, max_isoforms: int, rng: random.Random) -> list:
+    '''[(sequence length, number of isoforms)] for enough families to have
+    n_proteins proteins in all. Lengths are log-normally distributed around
+    400 residues, like real proteins, so a few are very long.'''
+    plan = []
+    total = 0
+    while total < n_proteins:
+        length = min(MAX_LENGTH, max(50, int(rng.lognormvariate(6, 0.7))))
+        n_isoforms = min(rng.randint(1, max_isoforms), n_proteins - total)
+        plan.append((length, n_isoforms))
+        total += n_isoforms
+    return plan
+
+
+def family_rows(acc_num: str, length: int, n_isoforms: int, peps_per_residue: float,
+        alignment_fraction: float, rng: random.Random) -> tuple:
+    '''(Proteins, isoform accession numbers, Peptides, Alignment or None)
+    for one synthetic family'''
+    aligned = synthetic_family(length, n_isoforms, rng)
+    aligned = {acc_num if name == 'SYNTH' else acc_num + name[5:]: seq
+        for name, seq in aligned.items()}
+    prots = []
+    peps = []
+    for iso_acc_num, seq in aligned.items():
+        seq = seq.replace('-', '')
+        prots.append(Protein(acc_num = iso_acc_num, sequence = seq,
+            isoform_num = 1 if iso_acc_num == acc_num else int(iso_acc_num.split('-')[1])))
+        n_peps = int(peps_per_residue * len(seq) + rng.random())
+        for _ in range(n_peps):
+            pep_len = rng.randint(7, 25)
+            loc = rng.randrange(max(1, len(seq) - pep_len))
+            peps.append(Peptide(prot = iso_acc_num, peptide = seq[loc:loc + pep_len], location = loc))
+    alignment = None
+    if n_isoforms > 1 and rng.random() < alignment_fraction:
+        text = format_clustal_num(aligned)
+        alignment = Alignment(prots = ','.join(aligned), alignment = text, etag = content_etag(text),
+            seq_set = seq_set_key(seq.replace('-', '') for seq in aligned.values()),
+            column_map = compact_column_map(aligned), column_stats = compute_column_stats(aligned))
+    return prots, list(aligned)[1:], peps, alignment
+
+
+def generate(n_proteins: int = 10_000, n_peptides: int = 1_000_000, max_isoforms: int = 5,
+        alignment_fraction: float = 0.8, seed: int = 0, batch_size: int = 200,
+        first_index: int = 0, index_kmers: bool = True) -> dict:
+    '''Add about n_proteins synthetic proteins (primary isoforms and their
+    other isoforms) and about n_peptides peptides to the database,
+    batch_size families per transaction.
+    Accession numbers are synthetic_acc_num(first_index), synthetic_acc_num(first_index + 1)...;
+    families whose primary accession number is already in the database are skipped.
+    index_kmers=False leaves the new proteins out of the k-mer index (see kmer_index.py).
+    Returns counts of the proteins, isoform links, peptides and alignments written.
+    '''
+    rng = random.Random(seed)
+    plan = family_plan(n_proteins, max_isoforms, rng)
+    total_length = sum(length * n_isoforms for length, n_isoforms in plan)
+    peps_per_residue = n_peptides / max(1, total_length)
+    counts = {'proteins': 0, 'isoforms': 0, 'peptides': 0, 'alignments': 0}
+    numbered = [(synthetic_acc_num(first_index + ii), length, n_isoforms)
+        for ii, (length, n_isoforms) in enumerate(plan)]
+    for batch in batches(numbered, batch_size):
+        new = set(new_acc_nums([acc_num for acc_num, _, _ in batch]))
+        families = [family_rows(acc_num, length, n_isoforms, peps_per_residue, alignment_fraction, rng)
+            for acc_num, length, n_isoforms in batch if acc_num in new]
+        with transaction.atomic():
+            prots = [prot for fam in families for prot in fam[0]]
+            Protein.objects.bulk_create(prots, batch_size=500)
+            created = list(Protein.objects
+                .filter(acc_num__in = [prot.acc_num for prot in prots])
+                .only('prot_id', 'sequence')
+            )
+            if index_kmers:
+                index_proteins(created, replace=False)
+            sign_proteins(created, replace=False)
+            ids = dict(Protein.objects
+                .filter(acc_num__in = [fam[0][0].acc_num for fam in families])
+                .values_list('acc_num', 'prot_id')
+            )
+            iso_ids = dict(Protein.objects
+                .filter(acc_num__in = [acc for fam in families for acc in fam[1]])
+                .values_list('acc_num', 'prot_id')
+            )
+            isoforms = [Isoform(prot_1_id = ids[fam[0][0].acc_num], prot_2_id = iso_ids[acc])
+                for fam in families for acc in fam[1]]
+            Isoform.objects.bulk_create(isoforms, batch_size=500)
+            peps = [pep for fam in families for pep in fam[2]]
+            Peptide.objects.bulk_create(set_masses(peps), batch_size=2000)
+            alignments = [fam[3] for fam in families if fam[3] is not None]
+            Alignment.objects.bulk_create(alignments, batch_size=50)
+        counts['proteins'] += len(prots)
+        counts['isoforms'] += len(isoforms)
+        counts['peptides'] += len(peps)
+        counts['alignments'] += len(alignments)
+    # bulk_create doesn't send post_save signals
+    invalidate()
+    return counts
@@ -1,15 +1,44 @@
+import gzip
 import json
 import os
 from pathlib import Path
 import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from unittest import mock
+from asgiref.sync import async_to_sync, sync_to_async
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.handlers.base import BaseHandler
+from django.db import connection
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+import numpy as np
+import pandas as pd
 
-from .models import Protein, Peptide, Alignment, Isoform
-from .sequence_chunkers import sequence_chunks, process_clustal_num
-from .views import get_all_data_related_to_prot
+import requests
+
+from . import (align_isoforms, benchmarks, caching, digest, discriminating_peptides, http_client, kmer_index, masses,
+    metrics, profile_align, similarity, timing)
+from .alignment_map import ColumnMap, compact_column_map
+from .alignment_stats import AlignmentStats
+from .discriminating_peptides import FamilyIndex, family_unique_peptides
+from .ingest import import_fasta, read_acc_nums, save_families
+from .models import Protein, Peptide, Alignment, Isoform, Kmer, MinHash, UniquePeptide, content_etag, stored_alignment
+from .sequence_chunkers import (conservation_line, format_clustal_num, parse_clustal_num, relabel_alignment,
+    seq_set_key, sequence_chunks, process_clustal_num)
+from .stub_server import StubServer
+from . import sync, synthetic_db
+from .views import get_all_data_related_to_prot, index_data
 
 CODE_DIR = Path(__file__).parent
+# set PEPTIDES_LIVE_SERVICES=1 to run the tests against the real UniProt and EBI
+LIVE_SERVICES = os.environ.get('PEPTIDES_LIVE_SERVICES') == '1'
 
 
 class WebsiteTests(TestCase):
@@ -17,6 +46,26 @@ class WebsiteTests(TestCase):
     got_P56856 = False
     got_P56856_isos = False
 
+    @classmethod
+    def setUpClass(cls):
+        # setUpTestData (called by super().setUpClass) already talks to UniProt
+        cls.stub = None
+        if not LIVE_SERVICES:
+            cls.stub = StubServer().start()
+            cls.real_urls = (align_isoforms.UNIPROT_API_URL, align_isoforms.EBI_CLUSTALO_URL,
+                align_isoforms.EBI_PING_INTERVAL)
+            align_isoforms.set_api_urls(cls.stub.uniprot_url, cls.stub.ebi_url)
+            align_isoforms.EBI_PING_INTERVAL = 0.01
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        if cls.stub is not None:
+            uniprot, ebi, align_isoforms.EBI_PING_INTERVAL = cls.real_urls
+            align_isoforms.set_api_urls(uniprot, ebi)
+            cls.stub.stop()
+
     def setUpTestData():
         '''Create a simple database with three isoforms,
         their peptides, and their multiple sequence
@@ -91,6 +140,11 @@ CLUSTAL O(1.2.4) multiple sequence alignment
         # create a superuser
         User.objects.create_superuser(username='super', password='password')
 
+    def setUp(self):
+        # each test's writes are rolled back without sending any signals,
+        # so pages cached during one test could be stale in the next
+        cache.clear()
+
     ### MODEL TESTS ###
 
     def test_isoforms_symmetric(self):
@@ -281,6 +335,135 @@ CLUSTAL O(1.2.4) multiple sequence alignment
             correct_chunk
         )
 
+    def test_column_map(self):
+        align = Alignment.objects.get(prots = 'BLUTEN-3,BLUTEN,BLUTEN-2')
+        self.assertEqual(align.column_map['length'], 15)
+        self.assertEqual(align.column_map['gaps']['BLUTEN-2'], [[0, 0], [8, 4], [11, 4]])
+        self.assertEqual(align.column_map['gaps']['BLUTEN-3'], [[0, 10], [5, 10]])
+        rng = random.Random(5)
+        seq_map = {f'ZORP-{ii}': ''.join(rng.choice('ACD--') for _ in range(50)) for ii in range(2, 6)}
+        columns = ColumnMap(compact_column_map(seq_map))
+        for acc_num, aligned in seq_map.items():
+            cols = [ii for ii, char in enumerate(aligned) if char != '-']
+            self.assertEqual([columns.column(acc_num, res) for res in range(len(cols))], cols)
+            self.assertEqual([columns.residue(acc_num, col) for col in range(50)],
+                [cols.index(col) if col in cols else -1 for col in range(50)])
+            start, end = 3, len(cols) - 3
+            for other, projected in columns.project(acc_num, start, end).items():
+                inside = [res for res, col in enumerate(ii for ii, char in enumerate(seq_map[other]) if char != '-')
+                    if cols[start] <= col <= cols[end - 1]]
+                self.assertEqual(projected, (inside[0], inside[-1] + 1) if inside else None)
+
+    def test_alignment_edit_updates_derived_fields(self):
+        align = Alignment.objects.get(prots = 'BLUTEN-3,BLUTEN,BLUTEN-2')
+        header, seq_map, _ = parse_clustal_num(align.alignment)
+        seq_map['BLUTEN-2'] = 'MVTGKPRLTI----K'
+        align.alignment = format_clustal_num(seq_map, header)
+        align.save()
+        align.refresh_from_db()
+        self.assertEqual(align.column_map['gaps']['BLUTEN-2'], [[0, 0], [10, 4], [11, 4]])
+        self.assertEqual(AlignmentStats.of(align).gapped.tolist(), [1] * 14 + [0])
+        old_seqs = {acc_num: seq.replace('-', '') for acc_num, seq in seq_map.items()}
+        seq_map['BLUTEN-2'] = 'MVTGKPRLTI----R'
+        align.alignment = format_clustal_num(seq_map, header)
+        align.save()
+        self.assertEqual(align.seq_set, seq_set_key(seq.replace('-', '') for seq in seq_map.values()))
+        self.assertIsNone(stored_alignment(old_seqs))
+
+    def test_alignment_projection(self):
+        url = '/alignments/BLUTEN-3,BLUTEN,BLUTEN-2/projection?acc_num=BLUTEN&peptide='
+        found = self.client.get(url + 'GTI').json()
+        self.assertEqual((found['start'], found['end']), (11, 14))
+        self.assertEqual(found['projections'], {
+            'BLUTEN-3': {'start': 1, 'end': 4, 'peptide': 'GTI', 'identical': True},
+            'BLUTEN-2': {'start': 8, 'end': 10, 'peptide': 'TI', 'identical': False},
+        })
+        found = self.client.get(url.replace('&peptide=', '&start=6&end=12')).json()
+        self.assertEqual(found['peptide'], 'RLFVCG')
+        self.assertEqual(found['projections']['BLUTEN-2']['peptide'], 'RL')
+        self.assertEqual(found['projections']['BLUTEN-3']['peptide'], 'CG')
+        found = self.client.get(url.replace('acc_num=BLUTEN&', 'acc_num=BLUTEN-3&') + 'CG').json()
+        self.assertEqual(found['projections']['BLUTEN']['peptide'], 'CG')
+        self.assertIsNone(self.client.get(url.replace('&peptide=', '&start=0&end=3')).json()['projections']['BLUTEN-3'])
+        for bad in [url + 'WWW', url.replace('acc_num=BLUTEN', 'acc_num=ZORP') + 'GTI',
+                url.replace('&peptide=', '&start=5&end=99')]:
+            self.assertEqual(self.client.get(bad).status_code, 400, bad)
+
+    def test_alignment_stats(self):
+        align = Alignment.objects.get(prots = 'BLUTEN-3,BLUTEN,BLUTEN-2')
+        stats = AlignmentStats.of(align)
+        self.assertEqual(list(np.round(stats.identity * 3)),
+            [2, 1, 1, 2, 2, 2, 2, 2, 1, 1, 2, 2, 3, 3, 2])
+        self.assertEqual(list(stats.gapped), [1] * 8 + [2, 2, 1, 1, 0, 0, 0])
+        self.assertEqual(stats.conservation, conservation_line(parse_clustal_num(align.alignment)[1].values()))
+        self.assertEqual(stats.divergent_regions(), [])
+        self.assertEqual(stats.divergent_regions(min_columns=2), [
+            {'start': 1, 'end': 3, 'residues': {'BLUTEN': [1, 3], 'BLUTEN-2': [1, 3], 'BLUTEN-3': [0, 0]}},
+            {'start': 8, 'end': 10, 'residues': {'BLUTEN': [8, 10], 'BLUTEN-2': [8, 8], 'BLUTEN-3': [0, 0]}},
+        ])
+        found = self.client.get('/alignments/BLUTEN-3,BLUTEN,BLUTEN-2/stats').json()
+        self.assertEqual(found['length'], 15)
+        self.assertEqual(found['identity'][12:14], [1.0, 1.0])
+        isoforms = {row['acc_num']: row for row in found['isoforms']}
+        self.assertEqual(isoforms['BLUTEN']['covered'], 11)
+        self.assertEqual(isoforms['BLUTEN']['covered_runs'], [[0, 3], [6, 14]])
+        self.assertEqual(isoforms['BLUTEN-2']['covered_runs'], [[5, 9]])
+        self.assertEqual(isoforms['BLUTEN-3']['coverage'], 0)
+        self.assertAlmostEqual(isoforms['BLUTEN-3']['identity'], (0.67 * 3 + 2) / 5)
+        html = self.client.get('/alignments/BLUTEN-3,BLUTEN,BLUTEN-2/').content.decode()
+        self.assertIn('<td>11 (73%)</td>', html)
+
+    def test_identity_matrix(self):
+        align = Alignment.objects.get(prots = 'BLUTEN-3,BLUTEN,BLUTEN-2')
+        acc_nums, identity = similarity.clustal_identity(align.alignment)
+        identity = {(a, b): identity[ii, jj] for ii, a in enumerate(acc_nums) for jj, b in enumerate(acc_nums)}
+        self.assertAlmostEqual(identity['BLUTEN', 'BLUTEN-2'], 100 * 9 / 11, places=4)
+        self.assertAlmostEqual(identity['BLUTEN-3', 'BLUTEN'], 80, places=4)
+        self.assertAlmostEqual(identity['BLUTEN-2', 'BLUTEN-3'], 100 * 2 / 3, places=4)
+        self.assertEqual(identity['BLUTEN', 'BLUTEN'], 100)
+        rng = random.Random(11)
+        seq_map = {f'ZORP-{ii}': ''.join(rng.choice('AC--') for _ in range(40)) for ii in range(2, 7)}
+        found = similarity.identity_matrix(seq_map)
+        for ii, a in enumerate(seq_map.values()):
+            for jj, b in enumerate(seq_map.values()):
+                both = [(x, y) for x, y in zip(a, b) if x != '-' and y != '-']
+                expected = 100 * sum(x == y for x, y in both) / len(both) if both else 0
+                self.assertAlmostEqual(found[ii, jj], expected, places=4)
+
+    def test_minhash(self):
+        rng = random.Random(12)
+        base = ''.join(rng.choice('ACDEFGHIKLMNPQRSTVWY') for _ in range(400))
+        seqs = [base, base[:300] + base[350:], base[::-1], base[:50]]
+        with mock.patch.object(similarity, 'PARALLEL_THRESHOLD', 2):
+            sigs = similarity.signatures(seqs, processes=2, chunk_size=1)
+        np.testing.assert_array_equal(sigs, similarity.signatures(seqs, processes=1))
+        kmer_sets = [set(similarity.kmer_codes(seq).tolist()) for seq in seqs]
+        sims = similarity.similarity(sigs[0], sigs)
+        for kmers, sim in zip(kmer_sets, sims):
+            self.assertAlmostEqual(sim, len(kmers & kmer_sets[0]) / len(kmers | kmer_sets[0]), delta=0.2)
+        self.assertEqual([(ii, jj) for ii, jj, _ in similarity.all_pairs(sigs, 0.6)], [(0, 1)])
+
+    def test_similar_json(self):
+        Protein.objects.create(acc_num = 'ZORP', sequence = 'MAWGKPRLFVCGTIK')
+        found = self.client.get('/proteins/BLUTEN/similar').json()
+        self.assertEqual(found['similar'][0], {'acc_num': 'ZORP', 'similarity': 1.0})
+        [alignment] = found['alignments']
+        self.assertEqual(alignment['prots'], 'BLUTEN-3,BLUTEN,BLUTEN-2')
+        self.assertEqual(len(alignment['identity']), 3)
+        # changing the sequence drops the old signature
+        zorp = Protein.objects.get(acc_num = 'ZORP')
+        zorp.sequence = 'WWWWWWWWWWWWWWW'
+        zorp.save()
+        found = self.client.get('/proteins/BLUTEN/similar').json()
+        self.assertNotIn('ZORP', [row['acc_num'] for row in found['similar']])
+        # the view only reads signatures; proteins without one are left out
+        MinHash.objects.filter(prot__acc_num = 'BLUTEN-2').delete()
+        with CaptureQueriesContext(connection) as queries:
+            found = self.client.get('/proteins/BLUTEN/similar').json()
+        self.assertFalse([q for q in queries if not q['sql'].lstrip().upper().startswith('SELECT')])
+        self.assertNotIn('BLUTEN-2', [row['acc_num'] for row in found['similar']])
+        self.assertFalse(MinHash.objects.filter(prot__acc_num = 'BLUTEN-2').exists())
+
     def test_get_isoforms_in_acc_num_order(self):
         acc_nums = list(range(1, 15))
         random.shuffle(acc_nums)
@@ -300,6 +483,59 @@ CLUSTAL O(1.2.4) multiple sequence alignment
         self.assertEqual([x.isoform_num for x in hundar_isos],
             list(range(2, 15)))
 
+    def test_read_acc_nums(self):
+        acc_nums, invalid = read_acc_nums([
+            'P56856, P56856-2 Q9Y6Q5 # a comment P99999',
+            'notanaccnum',
+            'Q9Y6Q5-3',
+        ])
+        self.assertEqual(acc_nums, ['P56856', 'Q9Y6Q5'])
+        self.assertEqual(invalid, ['notanaccnum'])
+
+    def test_save_families(self):
+        Peptide.objects.create(prot = 'ZORP-2', peptide = 'KLM')
+        alignment = 'CLUSTAL O(1.2.4) multiple sequence alignment\n\n\nZORP      MKLMA\nZORP-2    -KLM-\n           ***'
+        families = [
+            ('ZORP', {'ZORP': 'MKLMA', 'ZORP-2': 'KLM'}, alignment),
+            ('ZAPP', {'ZAPP': 'MMMM', 'ZAPP-2': 'MMM', 'ZAPP-3': 'MM'}, None),
+            ('ZIPP', {'ZIPP': 'MMMM'}, None), # only one isoform
+            ('BLUTEN', {'BLUTEN': 'QQQ', 'BLUTEN-4': 'QQ'}, None), # already in database
+        ]
+        # 10, plus a savepoint and an insert for the new proteins' k-mers,
+        # and the same for their MinHash signatures
+        with self.assertNumQueries(16):
+            counts = save_families(families)
+        self.assertEqual(counts, {'proteins': 5, 'isoforms': 3, 'alignments': 1, 'peptides': 1})
+        zapp_3 = Protein.objects.get(acc_num = 'ZAPP-3')
+        self.assertEqual(zapp_3.isoform_num, 3)
+        self.assertEqual([x.acc_num for x in zapp_3.get_isoforms()], ['ZAPP', 'ZAPP-2'])
+        self.assertEqual(Peptide.objects.get(prot = 'ZORP-2').location, 0)
+        self.assertEqual(Alignment.objects.get(prots = 'ZORP,ZORP-2').etag, content_etag(alignment))
+        self.assertFalse(Protein.objects.filter(acc_num__in = ['ZIPP', 'BLUTEN-4']).exists())
+
+    def test_import_fasta(self):
+        Peptide.objects.create(prot = 'Q00001-2', peptide = 'WWW')
+        with tempfile.TemporaryDirectory() as dirname:
+            canonical = os.path.join(dirname, 'sprot.fasta.gz')
+            varsplic = os.path.join(dirname, 'varsplic.fasta')
+            with gzip.open(canonical, 'wt') as f:
+                f.write('>sp|Q00001|FOO_HUMAN Foo\nMAAAK\nWWWK\n'
+                    '>sp|Q00002|BAR_HUMAN Bar\nMCCC\n'
+                    '>sp|P56854|CLD17_HUMAN Already in database\nMQQQ\n')
+            with open(varsplic, 'w') as f:
+                f.write('>sp|Q00001-2|FOO_HUMAN Isoform 2 of Foo\nMWWWK\n'
+                    '>sp|Q00001-3|FOO_HUMAN Isoform 3 of Foo\nMAK\n'
+                    '>sp|P56854-4|CLD17_HUMAN Isoform 4\nMQ\n')
+            counts = import_fasta([varsplic, canonical], batch_size=2)
+        self.assertEqual(counts, {'proteins': 5, 'isoforms': 3, 'peptides': 1})
+        foo = Protein.objects.get(acc_num = 'Q00001')
+        self.assertEqual(foo.sequence, 'MAAAKWWWK')
+        self.assertEqual([x.acc_num for x in foo.get_isoforms()], ['Q00001-2', 'Q00001-3'])
+        p56854 = Protein.objects.get(acc_num = 'P56854')
+        self.assertEqual(p56854.sequence, 'MMM')
+        self.assertEqual([x.acc_num for x in p56854.get_isoforms()], ['P56854-4'])
+        self.assertEqual(Peptide.objects.get(prot = 'Q00001-2').location, 1)
+
     ### UI Tests ###
 
     def test_protein_page(self):
@@ -331,6 +567,60 @@ CLUSTAL O(1.2.4) multiple sequence alignment
             with self.subTest(span = span, html = html):
                 self.assertIn(f'-->{span}<!--', html)
 
+    def test_protein_page_cached_until_data_changes(self):
+        self.client.get('/proteins/BLUTEN-3/')
+        with self.assertNumQueries(0):
+            html = self.client.get('/proteins/BLUTEN-3/').content.decode()
+        self.assertIn('-->CGTIR<!--', html)
+        Peptide.objects.create(prot = 'BLUTEN-3', peptide = 'GTI')
+        html = self.client.get('/proteins/BLUTEN-3/').content.decode()
+        self.assertInHTML('<span class="peptide 1" id="1_0">GTI</span>', html)
+
+    def test_page_invalidated_by_another_process(self):
+        # e.g. ingest_proteins, whose writes must reach the pages cached by every worker
+        self.assertTrue(caching.shared())
+        self.client.get('/proteins/BLUTEN-3/')
+        Peptide.objects.bulk_create([Peptide(prot = 'BLUTEN-3', peptide = 'GTI')]) # no signals
+        self.assertNotIn('GTI</span>', self.client.get('/proteins/BLUTEN-3/').content.decode())
+        subprocess.run(
+            [sys.executable, 'manage.py', 'shell', '-c', 'from peptides.caching import invalidate; invalidate()'],
+            cwd=CODE_DIR.parent, env=os.environ, capture_output=True, check=True,
+        )
+        self.assertIn('GTI</span>', self.client.get('/proteins/BLUTEN-3/').content.decode())
+
+    def test_pages_not_cached_in_local_memory(self):
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with override_settings(CACHES=locmem):
+            self.assertFalse(caching.shared())
+            self.client.get('/proteins/BLUTEN-3/')
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/proteins/BLUTEN-3/')
+            self.assertGreater(len(queries), 0)
+            self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_protein_page_revalidated_by_browsers(self):
+        for _ in range(2): # a miss, then a hit
+            response = self.client.get('/proteins/BLUTEN-3/')
+            self.assertIn('no-cache', response['Cache-Control'])
+            self.assertIn('max-age=0', response['Cache-Control'])
+
+    def test_page_with_csrf_form_not_cached(self):
+        # P56854 has no alignment, so its page has the form to request one
+        for _ in range(2):
+            client = Client(enforce_csrf_checks=True)
+            html = client.get('/proteins/P56854/').content.decode()
+            token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', html).group(1)
+            response = client.post('/request_alignment/', {'acc_num': 'not an acc num', 'csrfmiddlewaretoken': token})
+            self.assertEqual(response.status_code, 200)
+
+    def test_index_cached_per_query(self):
+        self.client.get('/?orderby=len')
+        with self.assertNumQueries(0):
+            self.client.get('/?orderby=len')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/?orderby=iso')
+        self.assertGreater(len(queries), 0)
+
     def test_protein_page_no_peps(self):
         response = self.client.get('/proteins/BLUTEN-3/')
         html = response.content.decode()
@@ -358,24 +648,26 @@ CLUSTAL O(1.2.4) multiple sequence alignment
         self.assertEqual(blujson, correct_blujson)
 
     def test_get_protein(self):
+        # P54619 (with recorded responses in stub_data) instead of Q9Y6Q5,
+        # so that this test doesn't need the network
         Peptide.objects.create(
-            prot = 'Q9Y6Q5',
-            peptide = 'VLFELTGR'
+            prot = 'P54619',
+            peptide = 'SFVGMLTITDFINILHR'
         )
         response = self.client.post('/get_protein/',
-            {'acc_num': 'Q9Y6Q5'},
+            {'acc_num': 'P54619'},
             follow=True # follow HTTP redirects; this is necessary
         )
         html = response.content.decode()
         # primary header
         self.assertInHTML(
-            '<a href="/alignments/Q9Y6Q5,Q9Y6Q5-2">Alignment Q9Y6Q5,Q9Y6Q5-2</a>', 
+            '<a href="/alignments/P54619,P54619-2,P54619-3">Alignment P54619,P54619-2,P54619-3</a>', 
             html
         )
         # sequence length header
-        self.assertInHTML('<p>Sequence (length 423):</p>', html)
+        self.assertInHTML('<p>Sequence (length 331):</p>', html)
         # peptide link
-        self.assertInHTML('<span class="sequence">VLFELTGR</span>', html)
+        self.assertInHTML('<span class="sequence">SFVGMLTITDFINILHR</span>', html)
 
     def test_json_schema(self):
         with open(CODE_DIR / 'static/peptides/protein_json_schema.json') as f:
@@ -416,6 +708,41 @@ CLUSTAL O(1.2.4) multiple sequence alignment
         )
         self.assertEqual(response.content.decode(), bluten_align)
 
+    def test_download_alignment_conditional_get(self):
+        url = '/download_alignment/BLUTEN-3,BLUTEN,BLUTEN-2/'
+        response = self.client.get(url)
+        etag = response.headers['ETag']
+        alignment = Alignment.objects.get(prots = 'BLUTEN-3,BLUTEN,BLUTEN-2')
+        self.assertEqual(etag, alignment.etag)
+        self.assertIn('Last-Modified', response.headers)
+        self.assertIn('max-age', response.headers['Cache-Control'])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_alignment_etag_changes_with_alignment(self):
+        alignment = Alignment.objects.get(prots = 'BLUTEN-3,BLUTEN,BLUTEN-2')
+        old_etag = alignment.etag
+        alignment.alignment += '\n'
+        alignment.save()
+        self.assertNotEqual(alignment.etag, old_etag)
+        response = self.client.get('/download_alignment/BLUTEN-3,BLUTEN,BLUTEN-2/',
+            HTTP_IF_NONE_MATCH=old_etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_json_schema_conditional_get(self):
+        response = self.client.get('/proteins/json_schema')
+        etag = response.headers['ETag']
+        response = self.client.get('/proteins/json_schema', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_protein_json_conditional_get(self):
+        response = self.client.get('/proteins/BLUTEN-2/json')
+        etag = response.headers['ETag']
+        self.assertIn('no-cache', response.headers['Cache-Control'])
+        response = self.client.get('/proteins/BLUTEN-2/json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
     def test_peptide_csv_acc_num_like(self):
         response = self.client.get('/peptides/?acc_num_like=BLUTEN',
             headers = {
@@ -647,18 +974,126 @@ CLUSTAL O(1.2.4) multiple sequence alignment
         os.rename('test_peptides.tsv', 'test_peptides.csv')
 
     def test_request_alignment_valid_acc_num(self):
-        acc_num = 'O00305-3'
-        prot = Protein(acc_num=acc_num, sequence='LLLLL')
-        prot.save()
+        # a family with a recorded alignment in stub_data,
+        # whose proteins and isoforms are in the database but not its alignment
+        acc_num = 'P54619-3'
+        _, aligned, _ = parse_clustal_num(
+            (CODE_DIR/'stub_data'/'ebi'/'ampk_gamma.clustal_num').read_text())
+        prots = {acc: Protein.objects.create(acc_num=acc, sequence=seq.replace('-', ''))
+            for acc, seq in aligned.items()}
+        for acc in ['P54619', 'P54619-2']:
+            Isoform.objects.create(prot_1 = prots[acc_num], prot_2 = prots[acc])
         response = self.client.post('/request_alignment/', data={'acc_num': acc_num}, follow=True)
         html = response.content.decode()
-        self.assertIn('SRDHYPLVEEDYPDSYQDTYKPHRNRGSPGGYSHDSRHRL', html)
+        self.assertIn('LVEAEVHRLVVVDENDVVKGIVSLSDILQALVLTGGEKKP', html)
         # all isoforms have this sequence at the end 
-        for acc in ['O00305', 'O00305-2', acc_num, 'O00305-4']:
+        for acc in aligned:
             self.assertInHTML(f'<span class="left-buffer">{acc}</span>', html)
-        alignment = prot.get_alignments()[0]
-        alignment.delete()
-        prot.delete()
+        self.assertEqual(len(prots[acc_num].get_alignments()), 1)
+
+    def test_request_alignment_reuses_alignment_in_other_order(self):
+        text = (CODE_DIR/'stub_data'/'ebi'/'ampk_gamma.clustal_num').read_text()
+        _, aligned, _ = parse_clustal_num(text)
+        prots = {acc: Protein.objects.create(acc_num=acc, sequence=seq.replace('-', ''))
+            for acc, seq in aligned.items()}
+        for acc in ['P54619-2', 'P54619-3']:
+            Isoform.objects.create(prot_1 = prots['P54619'], prot_2 = prots[acc])
+        Alignment.objects.create(prots = 'P54619-3,P54619-2,P54619', alignment = text)
+        ebi_before = self.stub.counts['ebi'] if self.stub else 0
+        response = self.client.post('/request_alignment/', data={'acc_num': 'P54619-2'})
+        self.assertRedirects(response, '/alignments/P54619-3,P54619-2,P54619', fetch_redirect_response=False)
+        if self.stub:
+            self.assertEqual(self.stub.counts['ebi'], ebi_before)
+
+    def test_alignment_reused_for_same_sequences(self):
+        seqs = {'X': 'MAWGKPRLFVCGTIK', 'Y': 'CGTIR', 'Z': 'MVTGKPRLTIK'}
+        stored = Alignment.objects.get(prots = 'BLUTEN-3,BLUTEN,BLUTEN-2')
+        self.assertEqual(stored.seq_set, seq_set_key(seqs.values()))
+        ebi_before = self.stub.counts['ebi'] if self.stub else 0
+        reused_before = metrics.ALIGNMENTS_REUSED.get()
+        # no clustalo executable needed either
+        for align in [align_isoforms.request_multi_alignment, align_isoforms.align_locally]:
+            _, aligned, _ = parse_clustal_num(align(seqs))
+            self.assertEqual(aligned, {'X': 'MAWGKPRLFVCGTIK', 'Y': '----------CGTIR', 'Z': 'MVTGKPRL----TIK'})
+        self.assertEqual(metrics.ALIGNMENTS_REUSED.get() - reused_before, 2)
+        if self.stub:
+            self.assertEqual(self.stub.counts['ebi'], ebi_before)
+        self.assertIsNone(relabel_alignment(stored.alignment, {'X': 'MAWGKPRLFVCGTIK', 'Y': 'CGTIR'}))
+        self.assertIsNone(relabel_alignment(stored.alignment, dict(seqs, Z='MVTGKPRLTIR')))
+
+    def test_profile_align(self):
+        rng = random.Random(13)
+        base = ''.join(rng.choice('ACDEFGHIKLMNPQRSTVY') for _ in range(120))
+        seq_map = {'A': base, 'B': base[:40] + '-' * 20 + base[60:]}
+        clustal = format_clustal_num(seq_map, 'CLUSTAL O(1.2.4) multiple sequence alignment')
+        new = {'C': base[:80] + 'WWWWW' + base[80:], 'D': base[30:90]}
+        _, aligned, _ = parse_clustal_num(profile_align.add_sequences(clustal, new))
+        self.assertEqual(list(aligned), ['A', 'B', 'C', 'D'])
+        self.assertEqual(len({len(seq) for seq in aligned.values()}), 1)
+        for name, seq in dict(seq_map, **new).items():
+            self.assertEqual(aligned[name].replace('-', ''), seq.replace('-', ''))
+        # the old sequences are still aligned to each other the same way
+        old = [''.join(col) for col in zip(aligned['A'], aligned['B']) if col != ('-', '-')]
+        self.assertEqual(old, [''.join(col) for col in zip(*seq_map.values())])
+        # 5 new columns for the Ws, and the rest in the columns of the residues they match
+        self.assertEqual(len(aligned['A']), 125)
+        self.assertEqual(aligned['C'].replace('W', ''), aligned['A'].replace('-', ''))
+        # in the same columns as A's residues, skipping the Ws' columns
+        self.assertEqual(''.join(a for a, d in zip(aligned['A'], aligned['D']) if d != '-'), base[30:90])
+        self.assertEqual(aligned['D'][aligned['C'].index('W'):].count('-'), 5 + 30)
+        with mock.patch.object(profile_align, 'MAX_CELLS', 100):
+            with self.assertRaises(ValueError):
+                profile_align.add_sequences(clustal, new)
+
+    def test_profile_align_memory(self):
+        rng = random.Random(5)
+        base = ''.join(rng.choice('ACDEFGHIKLMNPQRSTVY') for _ in range(2000))
+        prof = profile_align.profile([base, base[:1000] + '-' * 1000])
+        tracemalloc.start()
+        try:
+            profile_align.align_to_profile(base[500:1500], prof)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        # the byte per (residue, column) pointers take 2 MB, float64 scores would take 16 MB more
+        self.assertLess(peak, 4_000_000)
+
+    def test_extend_alignment_with_clustalo(self):
+        clustal = format_clustal_num({'A': 'MAWGK', 'B': 'M--GK'})
+        done = subprocess.CompletedProcess([], 0, stdout='CLUSTAL O(1.2.4) multiple sequence alignment\n')
+        with mock.patch.object(profile_align.subprocess, 'run', return_value=done) as run:
+            self.assertEqual(profile_align.extend_alignment(clustal, {'C': 'MAWG'}), done.stdout)
+        args, kwargs = run.call_args
+        self.assertEqual(args[0][0], 'clustalo')
+        self.assertTrue(args[0][1].startswith('--profile1='))
+        self.assertEqual(kwargs['input'], '>C\nMAWG\n')
+        # without clustalo, add_sequences doesn't claim its output is Clustal Omega's
+        with mock.patch.object(profile_align, 'CLUSTALO', '/nonexistent/clustalo'):
+            extended = profile_align.extend_alignment(clustal, {'C': 'MAWG'})
+        self.assertTrue(extended.startswith(profile_align.HEADER))
+        self.assertNotIn('Clustal Omega', extended.replace('(not Clustal Omega)', ''))
+        self.assertEqual(parse_clustal_num(extended)[1], {'A': 'MAWGK', 'B': 'M--GK', 'C': 'MAWG-'})
+
+    def test_alignment_extended_with_new_isoform(self):
+        seqs = {'BLUTEN-3': 'CGTIR', 'BLUTEN': 'MAWGKPRLFVCGTIK', 'BLUTEN-2': 'MVTGKPRLTIK',
+            'BLUTEN-4': 'MAWGKPRLFVCGTIKEE'}
+        ebi_before = self.stub.counts['ebi'] if self.stub else 0
+        extended_before = metrics.ALIGNMENTS_EXTENDED.get()
+        with mock.patch.object(profile_align, 'CLUSTALO', '/nonexistent/clustalo'):
+            _, aligned, _ = parse_clustal_num(align_isoforms.request_multi_alignment(seqs))
+        self.assertEqual(metrics.ALIGNMENTS_EXTENDED.get() - extended_before, 1)
+        if self.stub:
+            self.assertEqual(self.stub.counts['ebi'], ebi_before)
+        self.assertEqual(aligned, {
+            'BLUTEN-3': '----------CGTIR--', 'BLUTEN': 'MAWGKPRLFVCGTIK--',
+            'BLUTEN-2': 'MVTGKPRL----TIK--', 'BLUTEN-4': 'MAWGKPRLFVCGTIKEE',
+        })
+        # too many new sequences to add
+        more = dict(seqs, **{'BLUTEN-5': 'MAWGK', 'BLUTEN-6': 'MAWGKPR'})
+        with mock.patch.object(align_isoforms, '_request_multi_alignment', return_value='aligned') as request:
+            self.assertEqual(align_isoforms.request_multi_alignment(more), 'aligned')
+        request.assert_called_once()
+        self.assertEqual(metrics.ALIGNMENTS_EXTENDED.get() - extended_before, 1)
 
     def test_request_alignment_no_acc_num(self):
         response = self.client.post('/request_alignment/', follow=True)
@@ -669,6 +1104,11 @@ CLUSTAL O(1.2.4) multiple sequence alignment
         response = self.client.post('/request_alignment/', data={'acc_num': 'jdfkdnfl'}, follow=True)
         self.assertIn("because it's not a valid accession number", response.content.decode())
 
+    def test_request_alignment_unknown_protein(self):
+        response = self.client.post('/request_alignment/', data={'acc_num': 'Q00001'})
+        self.assertEqual(response.status_code, 404)
+        self.assertIn("because it's not in the database", response.content.decode())
+
     def test_protein_with_no_alignment_has_request_alignment_button(self):
         acc_num = 'O00305-3'
         prot = Protein(acc_num=acc_num, sequence='LLLLL')
@@ -679,6 +1119,518 @@ CLUSTAL O(1.2.4) multiple sequence alignment
         self.assertInHTML(f'<input hidden="" type="text" value="{acc_num}" name="acc_num" id="acc_num">', html)
         prot.delete()
 
+    #####################
+    # peptide search
+    #####################
+
+    def brute_force_search(self, peptide: str) -> list:
+        return sorted([{'acc_num': prot.acc_num, 'locations': kmer_index.positions(prot.sequence, peptide)}
+            for prot in Protein.objects.all() if peptide in prot.sequence], key=lambda x: x['acc_num'])
+
+    def test_peptide_search(self):
+        response = self.client.get('/peptide_search?peptide=GKPRL&peptide=tik,TSVFQYEGLWR&peptide=WWWWWW')
+        found = response.json()['peptides']
+        self.assertEqual(found['GKPRL'], [
+            {'acc_num': 'BLUTEN', 'locations': [3]},
+            {'acc_num': 'BLUTEN-2', 'locations': [3]},
+        ])
+        # shorter than KMER_LENGTH
+        self.assertEqual(found['TIK'], [
+            {'acc_num': 'BLUTEN', 'locations': [12]},
+            {'acc_num': 'BLUTEN-2', 'locations': [8]},
+        ])
+        self.assertEqual(found['TSVFQYEGLWR'], self.brute_force_search('TSVFQYEGLWR'))
+        self.assertEqual(found['WWWWWW'], [])
+
+    def test_peptide_search_many(self):
+        rng = random.Random(41)
+        seqs = list(Protein.objects.values_list('sequence', flat=True))
+        peptides = ['WWWWWWWW']
+        for _ in range(200):
+            seq = rng.choice(seqs)
+            length = rng.randint(5, 20)
+            loc = rng.randrange(max(1, len(seq) - length))
+            peptides.append(seq[loc:loc + length])
+        peptides = [pep for pep in peptides if len(pep) >= 5]
+        # one query for the k-mers and one for the candidates' sequences
+        with self.assertNumQueries(2):
+            kmer_index.find_peptides(peptides)
+        response = self.client.post('/peptide_search', {'peptides': '\n'.join(peptides)})
+        found = response.json()['peptides']
+        for pep in peptides:
+            self.assertEqual(found[pep], self.brute_force_search(pep))
+
+    def test_peptide_search_index_follows_protein_save(self):
+        prot = Protein.objects.get(acc_num = 'BLUTEN-3')
+        prot.sequence = 'CGTIRHHHHH'
+        prot.save()
+        self.assertEqual(kmer_index.find_peptides(['RHHHHH'])['RHHHHH'], [('BLUTEN-3', [4])])
+        prot.sequence = 'CGTIR'
+        prot.save()
+        self.assertEqual(kmer_index.find_peptides(['RHHHHH'])['RHHHHH'], [])
+        prot.delete()
+        self.assertEqual(kmer_index.find_peptides(['VCGTI'])['VCGTI'], [('BLUTEN', [9])])
+        self.assertEqual(kmer_index.find_peptides(['CGTIR'])['CGTIR'], [])
+
+    def test_peptide_search_bad_input(self):
+        self.assertEqual(self.client.get('/peptide_search').status_code, 400)
+        response = self.client.get('/peptide_search?peptide=PEP1DE')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('PEP1DE', response.json()['error'])
+
+    def test_kmer_index_rebuild(self):
+        expected = sorted(Kmer.objects.values_list('kmer', 'prot_id'))
+        Kmer.objects.all().delete()
+        counts = kmer_index.rebuild(batch_size=2)
+        self.assertEqual(counts['proteins'], Protein.objects.count())
+        self.assertEqual(sorted(Kmer.objects.values_list('kmer', 'prot_id')), expected)
+
+    #####################
+    # precursor mass search
+    #####################
+
+    def test_peptide_masses(self):
+        self.assertAlmostEqual(masses.peptide_mass('PEPTIDE'), 799.359964, places=5)
+        self.assertIsNone(masses.peptide_mass('PEPXIDE'))
+        peps = ['PEPTIDE', 'MAW', 'PEPXIDE', 'K', 'GTI']
+        found = masses.peptide_masses(peps)
+        self.assertTrue(np.isnan(found[2]))
+        for pep, mass in zip(peps, found):
+            if pep != 'PEPXIDE':
+                self.assertAlmostEqual(mass, masses.peptide_mass(pep), places=6)
+        self.assertAlmostEqual(Peptide.objects.get(peptide = 'MAW').mass, 406.167477, places=5)
+
+    def test_mass_index_same_as_brute_force(self):
+        rng = np.random.default_rng(3)
+        all_masses = rng.uniform(500, 3000, 2000)
+        index = masses.MassIndex(all_masses, ['P'] * 2000, np.arange(2000), ['PEP'] * 2000, ['ms'] * 2000)
+        queries = np.concatenate([rng.choice(all_masses, 50), rng.uniform(500, 3000, 50)])
+        for query, candidates in zip(queries, index.search(queries, ppm=20)):
+            expected = sorted(ii for ii, mass in enumerate(all_masses) if abs(mass - query) <= query * 20e-6)
+            self.assertEqual(sorted(c['location'] for c in candidates), expected)
+            self.assertTrue(all(abs(c['ppm']) <= 20 for c in candidates))
+
+    def test_mass_search(self):
+        response = self.client.get('/mass_search?mass=406.1675&ppm=5')
+        self.assertEqual(response.status_code, 200)
+        [result] = response.json()['results']
+        self.assertEqual([(c['acc_num'], c['location'], c['peptide'], c['source']) for c in result['candidates']],
+            [('BLUTEN', 0, 'MAW', 'ms')])
+        # MAWGKPR from a tryptic digest of BLUTEN, seen with 2 protons
+        mz = (masses.peptide_mass('MAWGKPR') + 2 * masses.PROTON) / 2
+        response = self.client.post('/mass_search', {'mz': f'{mz:.5f}, 406.1675', 'charge': 2})
+        results = response.json()['results']
+        self.assertIn(('BLUTEN', 0, 'trypsin'),
+            [(c['acc_num'], c['location'], c['source']) for c in results[0]['candidates']])
+        # the index follows new peptides
+        Peptide.objects.create(prot = 'BLUTEN-2', peptide = 'MVT')
+        response = self.client.get(f"/mass_search?mass={masses.peptide_mass('MVT')}")
+        self.assertEqual([c['peptide'] for c in response.json()['results'][0]['candidates']], ['MVT'])
+
+    def test_mass_search_bad_input(self):
+        for query in ['', '?mass=abc', '?mass=-5', '?mass=1000&ppm=5000', '?mz=500&charge=0']:
+            self.assertEqual(self.client.get('/mass_search' + query).status_code, 400, query)
+
+    #####################
+    # isoform-discriminating peptides
+    #####################
+
+    def test_digest(self):
+        seq = 'MAKPRGGGGGGGKAAAAAAARPEEEEEEEK'
+        # no cut before P
+        self.assertEqual(digest.digest(seq, missed_cleavages=0, min_length=1), [
+            (0, 'MAKPR'), (5, 'GGGGGGGK'), (13, 'AAAAAAARPEEEEEEEK')])
+        self.assertEqual(digest.digest(seq, missed_cleavages=1, min_length=6, max_length=20), [
+            (0, 'MAKPRGGGGGGGK'), (5, 'GGGGGGGK'), (13, 'AAAAAAARPEEEEEEEK')])
+        self.assertNotIn((0, seq), digest.digest(seq, missed_cleavages=1, max_length=50))
+        self.assertIn((0, seq), digest.digest(seq, missed_cleavages=2, max_length=50))
+        self.assertEqual(digest.digest(seq, missed_cleavages=0, min_length=1, enzyme='lys-c'), [
+            (0, 'MAK'), (3, 'PRGGGGGGGK'), (13, 'AAAAAAARPEEEEEEEK')])
+        self.assertEqual(digest.digest(seq, missed_cleavages=0, min_length=1, enzyme='glu-c'), [
+            (0, 'MAKPRGGGGGGGKAAAAAAARPE'), (23, 'E'), (24, 'E'), (25, 'E'), (26, 'E'),
+            (27, 'E'), (28, 'E'), (29, 'K')])
+
+    def test_digest_all_same_as_one_at_a_time(self):
+        rng = random.Random(7)
+        seqs = [''.join(rng.choice('ACDEKPRW') for _ in range(rng.randint(0, 60))) for _ in range(50)]
+        for enzyme in digest.ENZYMES:
+            seq_idx, starts, ends = digest.digest_all(seqs, enzyme, 2, 3, 25)
+            together = [(int(ii), seqs[ii][start:end]) for ii, start, end in zip(seq_idx, starts, ends)]
+            one_at_a_time = [(ii, pep) for ii, seq in enumerate(seqs)
+                for _, pep in digest.digest(seq, 2, 3, 25, enzyme)]
+            self.assertEqual(together, one_at_a_time)
+
+    def test_coverage_table(self):
+        seqs = {'BLUTEN': 'MAWGKPRLFVCGTIK', 'BLUTEN-3': 'CGTIR', 'EMPTY': ''}
+        peps = [('BLUTEN', 0, 3), ('BLUTEN', 6, 6), ('BLUTEN', 11, 3), ('BLUTEN', -1, 4),
+            ('BLUTEN-3', 0, 5), ('NOT-HERE', 0, 2)]
+        table = digest.coverage_table(seqs, peps, missed_cleavages=0, min_length=1).set_index('acc_num')
+        self.assertEqual(table.loc['BLUTEN', 'digest_peptides'], 2) # MAWGKPR, LFVCGTIK
+        self.assertEqual(table.loc['BLUTEN', 'digest_coverage'], 1)
+        self.assertEqual(table.loc['BLUTEN', 'observed_peptides'], 3)
+        self.assertAlmostEqual(table.loc['BLUTEN', 'observed_coverage'], 11 / 15)
+        self.assertEqual(table.loc['BLUTEN', 'observed_in_digest'], 0)
+        self.assertEqual(table.loc['BLUTEN-3', 'observed_in_digest'], 1)
+        self.assertEqual(table.loc['BLUTEN-3', 'observed_coverage'], 1)
+        self.assertEqual(table.loc['EMPTY', 'digest_peptides'], 0)
+        html = self.client.get('/proteins/BLUTEN-2/coverage?enzyme=lys-c&min_length=1').content.decode()
+        for acc_num in ['BLUTEN', 'BLUTEN-2', 'BLUTEN-3']:
+            self.assertIn(f'<a href="/proteins/{acc_num}">', html)
+        self.assertIn('<option value="lys-c" selected>', html)
+        response = self.client.get('/proteins/BLUTEN-2/coverage?enzyme=nope&min_length=x')
+        self.assertEqual(response.status_code, 200)
+
+    def test_family_index_same_as_brute_force(self):
+        rng = random.Random(42)
+        seqs = benchmarks.synthetic_family(300, 4, rng)
+        seqs = {acc_num: seq.replace('-', '') for acc_num, seq in seqs.items()}
+        index = FamilyIndex(seqs)
+        for _ in range(300):
+            seq = rng.choice(list(seqs.values()))
+            length = rng.randint(2, 15)
+            loc = rng.randrange(len(seq) - length)
+            pep = seq[loc:loc + length]
+            self.assertEqual(index.isoforms_containing(pep),
+                {acc_num for acc_num, other in seqs.items() if pep in other})
+
+    def test_family_unique_peptides(self):
+        seqs = {'ZORP': 'MAWGKPRLFVCGTIK', 'ZORP-2': 'MVTGKPRLTIK', 'ZORP-3': 'CGTIR'}
+        peps = [('ZORP', 'MAW'), ('ZORP', 'MAW'), ('ZORP', 'GKPRL'), ('ZORP-2', 'PRLT'), ('ZORP', 'GTI')]
+        found = family_unique_peptides(seqs, peps, missed_cleavages=0, min_length=3)
+        self.assertEqual([(x.prot, x.peptide, x.location, x.source) for x in found], [
+            ('ZORP', 'MAW', 0, 'ms'),
+            ('ZORP-2', 'PRLT', 5, 'ms'),
+            ('ZORP', 'MAWGKPR', 0, 'trypsin'),
+            ('ZORP', 'LFVCGTIK', 7, 'trypsin'),
+            ('ZORP-2', 'MVTGKPR', 0, 'trypsin'),
+            ('ZORP-2', 'LTIK', 7, 'trypsin'),
+            ('ZORP-3', 'CGTIR', 0, 'trypsin'),
+        ])
+
+    def test_find_unique_peptides(self):
+        fams = discriminating_peptides.families(['BLUTEN-2'])
+        self.assertEqual(len(fams), 1)
+        self.assertEqual(sorted(fams[0]), ['BLUTEN', 'BLUTEN-2', 'BLUTEN-3'])
+        with self.assertNumQueries(2 + 4): # read, then delete and insert in a savepoint
+            counts = discriminating_peptides.precompute(fams, min_length=3)
+        self.assertEqual(counts['ms'], 3)
+        found = set(UniquePeptide.objects.filter(source = 'ms').values_list('prot', 'peptide'))
+        # GTI is in BLUTEN and BLUTEN-3
+        self.assertEqual(found, {('BLUTEN', 'MAW'), ('BLUTEN', 'RLFVCG'), ('BLUTEN-2', 'PRLT')})
+        html = self.client.get('/proteins/BLUTEN-2/').content.decode()
+        self.assertIn('Peptides found in no other isoform of this protein', html)
+        self.assertIn('@5 (mass spec)', html)
+        html = self.client.get('/alignments/BLUTEN-3,BLUTEN,BLUTEN-2/').content.decode()
+        self.assertIn('BLUTEN@6 (mass spec)', html)
+        # running it again replaces the old results
+        discriminating_peptides.precompute(fams, min_length=3)
+        self.assertEqual(UniquePeptide.objects.filter(source = 'ms').count(), 3)
+
+    #####################
+    # request timing
+    #####################
+
+    def test_server_timing_header(self):
+        response = self.client.get('/alignments/BLUTEN-3,BLUTEN,BLUTEN-2/')
+        metrics = [x.split(';')[0] for x in response['Server-Timing'].split(', ')]
+        for name in ['db', 'chunking', 'render', 'total']:
+            self.assertIn(name, metrics)
+
+    def test_server_timing_external_calls(self):
+        response = self.client.post('/get_protein/', {'acc_num': 'P54619'})
+        self.assertEqual(response.status_code, 302)
+        header = response['Server-Timing']
+        # P54619 with its alternative products, then P54619-2 and P54619-3
+        self.assertIn('uniprot;desc="3x"', header)
+        self.assertIn('ebi_run;desc="1x"', header)
+        self.assertIn('ebi_status;', header)
+
+    async def test_get_protein_async(self):
+        # through the ASGI handler, with every middleware running async
+        response = await self.async_client.post('/get_protein/', {'acc_num': 'P54619'})
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('uniprot;desc="3x"', response['Server-Timing'])
+        self.assertTrue(await Alignment.objects.filter(prots__contains = 'P54619-2').aexists())
+        seqs, alignment = await align_isoforms.aalign_isoforms('P54619')
+        self.assertEqual((seqs, alignment), await sync_to_async(align_isoforms.align_isoforms)('P54619'))
+        # now stored
+        await Alignment.objects.filter(prots__contains = 'P54619-2').adelete()
+        response = await self.async_client.post('/request_alignment/', {'acc_num': 'P54619'})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(await Alignment.objects.filter(prots__contains = 'P54619-2').aexists())
+
+    def test_middleware_is_async(self):
+        # a sync-only middleware would make async views run in a thread
+        with self.assertNoLogs('django.request', 'DEBUG'):
+            BaseHandler().load_middleware(is_async=True)
+
+    @override_settings(SLOW_REQUEST_SECONDS=0)
+    def test_slow_requests_logged(self):
+        with self.assertLogs('peptides.timing', 'WARNING') as logs:
+            self.client.get('/proteins/BLUTEN/')
+        self.assertIn('Slow request: GET /proteins/BLUTEN/', logs.output[0])
+        self.assertIn('db=', logs.output[0])
+
+    def test_timing_phases(self):
+        with timing.phase('outside'):
+            pass # no request, so nothing to record
+        self.assertIsNone(timing.current())
+        timings = timing.start()
+        try:
+            with timing.phase('a'):
+                with timing.phase('a'):
+                    pass
+            timing.timed('b')(lambda: None)()
+            timing.timed('b')(lambda: None)()
+        finally:
+            timing.stop(timings)
+        self.assertEqual({k: v[1] for k, v in timings.phases.items()}, {'a': 1, 'b': 2})
+        self.assertTrue(timings.header().startswith('a;desc="1x";dur='))
+
+    def test_metrics_endpoint(self):
+        polls = metrics.ALIGNMENT_JOB_POLLS.count()
+        hits = metrics.PAGE_CACHE.get(view='protein', result='hit')
+        self.client.post('/get_protein/', {'acc_num': 'P54619'})
+        self.client.get('/proteins/BLUTEN/')
+        self.client.get('/proteins/BLUTEN/')
+        self.assertEqual(metrics.ALIGNMENT_JOB_POLLS.count(), polls + 1)
+        self.assertEqual(metrics.PAGE_CACHE.get(view='protein', result='hit'), hits + 1)
+        response = self.client.get('/metrics')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        text = response.content.decode()
+        self.assertIn('# TYPE peptides_phase_seconds histogram', text)
+        self.assertIn('peptides_phase_seconds_bucket{phase="uniprot",le="+Inf"}', text)
+        self.assertIn('peptides_phase_seconds_count{phase="ebi_status"}', text)
+        self.assertIn('peptides_request_seconds_count{view="peptides:proteins"}', text)
+        self.assertIn('peptides_page_cache_requests_total{view="protein",result="hit"}', text)
+        self.assertIn('peptides_requests_in_progress 1', text)
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.1'])
+    def test_metrics_endpoint_forbidden(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    def test_histogram_buckets(self):
+        hist = metrics.Histogram('test_histogram', 'for testing', ['kind'], buckets=(1, 5))
+        metrics.REGISTRY.remove(hist)
+        for value in [0.5, 2, 7]:
+            hist.observe(value, kind='a"b')
+        self.assertEqual(hist.render().split('\n')[2:], [
+            'test_histogram_bucket{kind="a\\"b",le="1"} 1',
+            'test_histogram_bucket{kind="a\\"b",le="5"} 2',
+            'test_histogram_bucket{kind="a\\"b",le="+Inf"} 3',
+            'test_histogram_sum{kind="a\\"b"} 9.5',
+            'test_histogram_count{kind="a\\"b"} 3',
+        ])
+
+    #####################
+    # HTTP client
+    #####################
+
+    def test_http_client_retries_throttled_requests(self):
+        backoff, http_client.BACKOFF = http_client.BACKOFF, 0.001
+        try:
+            with StubServer(throttle_rate=1, retry_after=0) as stub:
+                retries = http_client.RETRIES.get(service='test', reason='429')
+                resp = http_client.get(stub.uniprot_url + '/uniprotkb/search?query=accession%3DP56856',
+                    service='test', retries=2)
+                self.assertEqual(resp.status_code, 429)
+                self.assertEqual(stub.counts['429'], 3)
+                self.assertEqual(http_client.RETRIES.get(service='test', reason='429'), retries + 2)
+            with StubServer(failure_rate=0.5, seed=3) as stub:
+                resp = http_client.get(stub.uniprot_url + '/uniprotkb/search?query=accession%3DP56856',
+                    service='test', retries=10)
+                self.assertEqual(resp.status_code, 200)
+                self.assertEqual(resp.json()['results'][0]['primaryAccession'], 'P56856')
+        finally:
+            http_client.BACKOFF = backoff
+
+    def test_http_client_does_not_retry_posts_after_5xx(self):
+        backoff, http_client.BACKOFF = http_client.BACKOFF, 0.001
+        try:
+            with StubServer(failure_rate=1) as stub:
+                url = stub.ebi_url + '/run'
+                resp = http_client.post(url, service='test', data={'sequence': '>A\nMAW\n'}, retries=2)
+                self.assertEqual(resp.status_code, 503)
+                self.assertEqual(stub.counts['503'], 1)
+                resp = async_to_sync(http_client.apost)(url, service='test', data={'sequence': '>A\nMAW\n'}, retries=2)
+                self.assertEqual(resp.status_code, 503)
+                self.assertEqual(stub.counts['503'], 2)
+                # GETs are still retried
+                http_client.get(stub.uniprot_url + '/uniprotkb/search?query=accession%3DP56856',
+                    service='test', retries=2)
+                self.assertEqual(stub.counts['503'], 5)
+            # a POST that never reached the server is retried
+            with socket.socket() as sock:
+                sock.bind(('127.0.0.1', 0))
+                url = f'http://127.0.0.1:{sock.getsockname()[1]}/run'
+            retries = http_client.RETRIES.get(service='test', reason='connection')
+            with self.assertRaises(requests.ConnectionError):
+                http_client.post(url, service='test', retries=2)
+            self.assertEqual(http_client.RETRIES.get(service='test', reason='connection'), retries + 2)
+            self.assertFalse(http_client.retryable('POST', ex=requests.ReadTimeout()))
+            self.assertTrue(http_client.retryable('GET', ex=requests.ReadTimeout()))
+        finally:
+            http_client.BACKOFF = backoff
+
+    def test_retry_after_header(self):
+        resp = requests.Response()
+        self.assertIsNone(http_client.retry_after(resp))
+        resp.headers['Retry-After'] = '7'
+        self.assertEqual(http_client.retry_after(resp), 7)
+        resp.headers['Retry-After'] = 'Wed, 21 Oct 2015 07:28:00 GMT'
+        self.assertEqual(http_client.retry_after(resp), 0)
+
+    def test_token_bucket_shared_between_processes(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            # two buckets with the same name act like the buckets of two processes
+            bucket_1 = http_client.TokenBucket('test', rate=20, burst=2, directory=dirname)
+            bucket_2 = http_client.TokenBucket('test', rate=20, burst=2, directory=dirname)
+            t0 = time.perf_counter()
+            bucket_1.wait()
+            bucket_1.wait()
+            self.assertLess(time.perf_counter() - t0, 0.04)
+            bucket_2.wait()
+            self.assertGreaterEqual(time.perf_counter() - t0, 0.04)
+
+    #####################
+    # benchmarks
+    #####################
+
+    def test_synthetic_family_aligns(self):
+        rng = random.Random(1)
+        aligned = benchmarks.synthetic_family(300, 4, rng)
+        self.assertEqual(len({len(seq) for seq in aligned.values()}), 1)
+        peps = benchmarks.synthetic_peptides(aligned, 0.5, rng)
+        self.assertTrue(peps)
+        for pep in peps:
+            seq = aligned[pep.prot].replace('-', '')
+            self.assertEqual(seq[pep.location:pep.location + len(pep.peptide)], pep.peptide)
+        clustal = format_clustal_num(aligned)
+        self.assertEqual(parse_clustal_num(clustal)[1], aligned)
+        chunks = process_clustal_num(clustal, peps, 60)
+        self.assertEqual(len(chunks['chunks']), 5)
+
+    def test_benchmark_regressions(self):
+        results = benchmarks.run(['small'], repeat=1)
+        self.assertEqual(len(results), 4)
+        self.assertEqual(benchmarks.regressions(results, results), [])
+        baseline = {name: {'seconds': r['seconds'], 'peak_kb': r['peak_kb'] / 2} for name, r in results.items()}
+        slower = benchmarks.regressions(results, baseline)
+        self.assertEqual({row[1] for row in slower}, {'peak_kb'})
+
+    #####################
+    # stub UniProt/EBI server
+    #####################
+
+    def test_format_clustal_num_round_trip(self):
+        clustal = (CODE_DIR/'stub_data'/'ebi'/'claudin18.clustal_num').read_text()
+        header, seq_map, stars = parse_clustal_num(clustal)
+        self.assertEqual(format_clustal_num(seq_map, header).strip(), clustal.strip())
+        self.assertEqual(len(stars), len(seq_map['P56856']))
+
+    def test_stub_server_replays_recordings(self):
+        with StubServer() as stub:
+            resp = requests.get(stub.uniprot_url + '/uniprotkb/search?query=accession%3DP56856')
+            self.assertEqual(resp.json()['results'][0]['sequence']['length'], 261)
+            resp = requests.get(stub.uniprot_url + '/uniprotkb/search?query=accession%3DQ00001')
+            self.assertEqual(resp.json(), {'results': []})
+            seqs = {'X-2': 'MAW', 'X': 'MAWGK'}
+            job = requests.post(stub.ebi_url + '/run',
+                data={'sequence': align_isoforms.to_fasta(seqs)}).text
+            self.assertEqual(requests.get(stub.ebi_url + '/status/' + job).text, 'FINISHED')
+            _, aligned, _ = parse_clustal_num(
+                requests.get(stub.ebi_url + f'/result/{job}/aln-clustal_num').text)
+            self.assertEqual(aligned, {'X': 'MAWGK', 'X-2': 'MAW--'})
+            self.assertEqual(stub.counts['uniprot'], 2)
+
+    def test_uniprot_fields_projection(self):
+        full = align_isoforms.get_protein('P56856', fields=None)
+        minimal = align_isoforms.get_protein('P56856')
+        self.assertEqual(minimal['sequence'], full['sequence'])
+        self.assertEqual(align_isoforms.get_isoform_ids(minimal), align_isoforms.get_isoform_ids(full))
+        self.assertLess(len(json.dumps(minimal)), len(json.dumps(full)) / 10)
+        iso = align_isoforms.get_protein('P56856-2', fields=align_isoforms.SEQUENCE_FIELDS)
+        self.assertEqual(set(iso), {'entryType', 'primaryAccession', 'sequence'})
+        seqs = align_isoforms.get_all_seqs(align_isoforms.get_all_prots('P54619'))
+        self.assertEqual(sorted(seqs), ['P54619', 'P54619-2', 'P54619-3'])
+
+    def test_stub_server_injects_faults(self):
+        with StubServer(throttle_rate=1, retry_after=7) as stub:
+            resp = requests.get(stub.uniprot_url + '/uniprotkb/search?query=accession%3DP56856')
+            self.assertEqual(resp.status_code, 429)
+            self.assertEqual(resp.headers['Retry-After'], '7')
+        with StubServer(failure_rate=1) as stub:
+            resp = requests.get(stub.uniprot_url + '/uniprotkb/search?query=accession%3DP56856')
+            self.assertEqual(resp.status_code, 503)
+
+    def test_stub_server_synthetic_families(self):
+        with StubServer(synthetic=True) as stub:
+            align_isoforms.set_api_urls(stub.uniprot_url)
+            try:
+                seqs = align_isoforms.get_all_seqs(align_isoforms.get_all_prots('Q99999'))
+            finally:
+                align_isoforms.set_api_urls(self.stub.uniprot_url if self.stub else 'https://rest.uniprot.org')
+        self.assertGreaterEqual(len(seqs), 2)
+        self.assertIn('Q99999', seqs)
+
+    def create_stale_P54619(self) -> dict:
+        '''the P54619 family and its alignment, but with an outdated
+        sequence of P54619; returns the current sequences'''
+        seqs = align_isoforms.get_all_seqs(align_isoforms.get_all_prots('P54619'))
+        prots = {acc_num: Protein.objects.create(acc_num = acc_num,
+                sequence = 'WWW' + seq[5:] if acc_num == 'P54619' else seq)
+            for acc_num, seq in seqs.items()}
+        for acc_num in ['P54619-2', 'P54619-3']:
+            Isoform.objects.create(prot_1 = prots['P54619'], prot_2 = prots[acc_num])
+        Alignment.objects.create(prots = 'P54619,P54619-2,P54619-3', alignment = 'old alignment')
+        return seqs
+
+    def test_sync_proteins_updates_only_changed(self):
+        seqs = self.create_stale_P54619()
+        found = Peptide.objects.create(prot = 'P54619', peptide = 'SFVGMLTITDFINILHR')
+        lost = Peptide.objects.create(prot = 'P54619', peptide = 'WWWSSD')
+        kept = Peptide.objects.create(prot = 'P54619-2', peptide = 'MKSHRCYD')
+        UniquePeptide.objects.create(prot = 'P54619', peptide = 'WWWSSD', location = 0, source = 'ms')
+        self.assertEqual(lost.location, 0)
+        self.assertEqual(found.location, seqs['P54619'].index('SFVGMLTITDFINILHR') - 2)
+        requests_before = self.stub.counts['uniprot'] if self.stub else 0
+        acc_nums = ['P54619', 'P54619-2', 'P54619-3', 'BLUTEN']
+        counts = sync.sync_proteins(acc_nums)
+        if self.stub:
+            self.assertEqual(self.stub.counts['uniprot'] - requests_before, 1)
+        self.assertEqual(counts['changed_acc_nums'], ['P54619'])
+        self.assertEqual(counts['missing_acc_nums'], ['BLUTEN'])
+        self.assertEqual(counts['alignments'], 1)
+        self.assertEqual(Protein.objects.get(acc_num = 'P54619').sequence, seqs['P54619'])
+        self.assertFalse(Alignment.objects.filter(prots = 'P54619,P54619-2,P54619-3').exists())
+        self.assertTrue(Alignment.objects.filter(prots = 'BLUTEN-3,BLUTEN,BLUTEN-2').exists())
+        found.refresh_from_db()
+        lost.refresh_from_db()
+        kept.refresh_from_db()
+        self.assertEqual(found.location, seqs['P54619'].index('SFVGMLTITDFINILHR'))
+        self.assertEqual(lost.location, -1)
+        self.assertEqual(kept.location, 0)
+        # the family's unique peptides are found again in the new sequence
+        self.assertEqual(counts['families'], 1)
+        unique = UniquePeptide.objects.filter(prot__startswith = 'P54619')
+        self.assertFalse(unique.filter(peptide = 'WWWSSD').exists())
+        self.assertTrue(unique.filter(prot = 'P54619-3').exists())
+        for row in unique:
+            self.assertEqual(seqs[row.prot].find(row.peptide), row.location)
+        # nothing left to do
+        self.assertEqual(sync.sync_proteins(acc_nums)['changed_acc_nums'], [])
+
+    def test_sync_proteins_realign_and_dry_run(self):
+        seqs = self.create_stale_P54619()
+        counts = sync.sync_proteins(['P54619'], dry_run=True)
+        self.assertEqual(counts['changed_acc_nums'], ['P54619'])
+        self.assertEqual(Protein.objects.get(acc_num = 'P54619').sequence, 'WWW' + seqs['P54619'][5:])
+        counts = sync.sync_proteins(['P54619'], realign='ebi')
+        self.assertEqual(counts['realigned'], 1)
+        alignment = Alignment.objects.get(prots = 'P54619,P54619-2,P54619-3').alignment
+        _, aligned, _ = parse_clustal_num(alignment)
+        self.assertEqual({k: v.replace('-', '') for k, v in aligned.items()}, seqs)
+
     #####################
     # interaction plots
     #####################
@@ -693,6 +1645,12 @@ CLUSTAL O(1.2.4) multiple sequence alignment
         lines = response.content.decode().split()
         self.assertEqual(lines[0], 'patient,P07585_N,P07585_C,P07585.2_N,P07585.2_C,P07585.3_N,P07585.3_C,P07585.5_N,P07585.5_C')
 
+    def test_interaction_plot_data_download_conditional_get(self):
+        response = self.client.get('/download_interaction_plot_data/P07585')
+        response = self.client.get('/download_interaction_plot_data/P07585',
+            HTTP_IF_NONE_MATCH=response.headers['ETag'])
+        self.assertEqual(response.status_code, 304)
+
     def test_interaction_plot_data_download_bad_acc_num(self):
         response = self.client.get('/interaction_plot/ZZZZZZZZ')
         html = response.content.decode()
@@ -710,11 +1668,56 @@ CLUSTAL O(1.2.4) multiple sequence alignment
         plot_title = '<title>P07585 isoforms interaction plot whisker</title>'
         self.assertInHTML(plot_title, html)
 
+    def test_interaction_plot_client_side(self):
+        response = self.client.get('/interaction_plot/P07585?render=client&type=whisker')
+        html = response.content.decode()
+        self.assertIn('fetch("/interaction_plot/P07585/json?type=whisker")', html)
+        self.assertIn('Bokeh.embed.embed_item', html)
+        # the figure data is not embedded in the page
+        self.assertNotIn('P07585 isoforms interaction plot', html)
+
+    def test_interaction_plot_json(self):
+        response = self.client.get('/interaction_plot/P07585/json')
+        item = json.loads(response.content.decode())
+        self.assertIn('doc', item)
+        self.assertIn('root_id', item)
+        self.assertIn('max-age', response.headers['Cache-Control'])
+        last_modified = response.headers['Last-Modified']
+        response = self.client.get('/interaction_plot/P07585/json',
+            HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_interaction_plot_json_bad_acc_num(self):
+        response = self.client.get('/interaction_plot/ZZZZZZZZ/json')
+        self.assertEqual(response.status_code, 404)
+
     def test_interaction_plot_bad_acc_num(self):
         response = self.client.get('/interaction_plot/ZZZZZZZZ')
         html = response.content.decode()
         self.assertIn('No MS intensity vs. isoform vs. cancer status data could be found for protein ZZZZZZZZ.', html)
 
+    def test_differential_abundance_stats(self):
+        from .differential_abundance import isoform_stats
+        long_df = pd.DataFrame({
+            'isoform': ['FOO'] * 4 + ['FOO.2'] * 4 + ['FOO.3'] * 4,
+            'cancer': [3., 5., 4., 6.] + [1., 2., 1., 2.] + [0.] * 4,
+            'non_cancer': [1., 2., 1., 2.] + [1., 2., 1.5, 1.5] + [0.] * 4,
+        })
+        stats = isoform_stats(long_df)
+        self.assertEqual(list(stats.acc_num), ['FOO', 'FOO-2', 'FOO-3'])
+        foo = stats.iloc[0]
+        self.assertEqual(foo.n_patients, 4)
+        self.assertAlmostEqual(foo.mean_diff, 3.)
+        # differences 2, 3, 3, 4 have standard deviation sqrt(2/3)
+        self.assertAlmostEqual(foo.t_stat, 3 / (2 / 3) ** 0.5 * 2)
+        self.assertAlmostEqual(foo.p_value, 0.005208, places=5)
+        self.assertTrue(np.isnan(stats.iloc[2].t_stat))
+
+    def test_differential_abundance_page(self):
+        response = self.client.get('/differential_abundance?max_q=0.01')
+        html = response.content.decode()
+        self.assertInHTML('<a href="/interaction_plot/P09132">P09132</a>', html)
+
     def test_index_not_crash_bad_orderby_value(self):
         self.client.get('/?orderby=-roenroenreon')
         self.assertTrue(True)
@@ -741,6 +1744,90 @@ CLUSTAL O(1.2.4) multiple sequence alignment
 # import requests
 ########## Need to use BeautifulSoup and requests to test the HTML
 
+class ScaleTests(TestCase):
+    '''Query counts and response times of the main pages on a synthetic
+    database. The number of queries must not grow with the size of the database.
+    Set PEPTIDES_SCALE_PROTEINS and PEPTIDES_SCALE_PEPTIDES to run these
+    against a bigger one, e.g. 10000 and 1000000.
+    '''
+    n_proteins = int(os.environ.get('PEPTIDES_SCALE_PROTEINS', 300))
+    n_peptides = int(os.environ.get('PEPTIDES_SCALE_PEPTIDES', 20_000))
+    # seconds, after one request to warm up
+    budgets = {'index': 1.0, 'protein': 0.25, 'alignment': 0.5}
+
+    @classmethod
+    def setUpTestData(cls):
+        synthetic_db.generate(cls.n_proteins, cls.n_peptides, seed=1)
+        cls.alignment = Alignment.objects.order_by('-prots').first()
+        cls.acc_nums = cls.alignment.prots.split(',')
+
+    def setUp(self):
+        cache.clear()
+
+    def assertQueriesAndBudget(self, url, n_queries, budget):
+        self.client.get(url)
+        cache.clear()
+        with self.assertNumQueries(n_queries):
+            t0 = time.perf_counter()
+            response = self.client.get(url)
+            elapsed = time.perf_counter() - t0
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(elapsed, budget, f'{url} took {elapsed:.3f} seconds')
+
+    def test_index_queries(self):
+        self.assertQueriesAndBudget('/', 4, self.budgets['index'])
+
+    def test_protein_queries(self):
+        self.assertQueriesAndBudget(f'/proteins/{self.acc_nums[0]}/', 6, self.budgets['protein'])
+        # secondary isoforms need two more queries to find the primary
+        self.assertQueriesAndBudget(f'/proteins/{self.acc_nums[1]}/', 8, self.budgets['protein'])
+
+    def test_alignment_queries(self):
+        self.assertQueriesAndBudget(f'/alignments/{self.alignment.prots}/', 4, self.budgets['alignment'])
+
+    def test_index_data_same_as_per_protein_queries(self):
+        rows = {row['acc_num']: row for row in index_data()}
+        self.assertEqual(len(rows), Protein.objects.filter(isoform_num = 1).count())
+        for prot in Protein.objects.filter(isoform_num = 1).order_by('?')[:20]:
+            self.assertEqual(rows[prot.acc_num], {
+                'acc_num': prot.acc_num,
+                'npeps': len(prot.get_peptides()),
+                'lenseq': len(prot.sequence),
+                'n_isoforms': len(prot.get_isoforms()) + 1,
+                'has_alignment': 'Yes' if len(prot.get_alignments()) > 0 else 'No',
+            })
+
+    def test_synthetic_peptides_are_in_their_proteins(self):
+        seqs = dict(Protein.objects.filter(acc_num__in = self.acc_nums).values_list('acc_num', 'sequence'))
+        peps = Peptide.objects.filter(prot__in = self.acc_nums)
+        self.assertTrue(peps)
+        for pep in peps:
+            self.assertEqual(seqs[pep.prot].find(pep.peptide, pep.location), pep.location)
+
+
+class StartupTests(SimpleTestCase):
+    '''What a worker imports before it handles its first request
+    (measured with python -X importtime in a new interpreter)'''
+    # loaded by the views that use them, not at startup
+    lazy_modules = ['Bio', 'bokeh', 'numpy', 'pandas', 'requests']
+    # seconds for the peptides modules, including everything they import
+    budget = 0.25
+
+    def test_import_time(self):
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import django; django.setup(); import peptides.urls'],
+            cwd=CODE_DIR.parent, env=os.environ, capture_output=True, text=True, check=True,
+        )
+        # "import time: self [us] | cumulative | imported package", nested imports indented
+        rows = [line.split('|')[1:] for line in proc.stderr.splitlines() if line.startswith('import time:')][1:]
+        imported = {name.strip() for _, name in rows}
+        for module in self.lazy_modules:
+            self.assertNotIn(module, imported)
+        # the cumulative times of the top-level imports include everything they import
+        elapsed = sum(int(cumulative) for cumulative, name in rows if name.startswith(' peptides.')) / 1e6
+        self.assertLess(elapsed, self.budget, f'importing the peptides app took {elapsed:.3f} seconds')
+
+
 # class JavaScriptTester(TestCase):
 #     def test_index_default(self):
 #         response = self.client.get('/')
@@ -0,0 +1,107 @@
+'''Where does a request spend its time?
+
+ServerTimingMiddleware (middleware.py) starts a RequestTimings for each
+request. While it is running, code anywhere in the request can record
+how long a phase took:
+
+    with phase('uniprot'):
+        resp = requests.get(...)
+
+or decorate a function with @timed('chunking'). Outside a request (e.g., in
+a management command or a notebook) phases only go to metrics.PHASE_SECONDS.
+Nothing here depends on Django, so neither do align_isoforms and sequence_chunkers.
+'''
+import contextlib
+import contextvars
+import functools
+import time
+
+from . import metrics
+
+_current = contextvars.ContextVar('peptides_request_timings', default=None)
+# the phases running right now in this thread or task, inside or outside a request
+_active = contextvars.ContextVar('peptides_active_phases', default=frozenset())
+
+
+class RequestTimings:
+    '''the total duration, number of times entered and number of database
+    queries of each phase of one request'''
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.phases = {}
+        self.queries = 0
+
+    def add(self, name: str, seconds: float, queries: int = 0):
+        dur, count, n_queries = self.phases.get(name, (0., 0, 0))
+        self.phases[name] = (dur + seconds, count + 1, n_queries + queries)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start_time
+
+    def header(self) -> str:
+        '''the value of a Server-Timing header
+        (https://www.w3.org/TR/server-timing/), durations in milliseconds'''
+        metrics = []
+        for name, (dur, count, queries) in self.phases.items():
+            desc = '%i queries' % count if name == 'db' else '%ix' % count
+            if queries and name != 'db':
+                desc += ', %i queries' % queries
+            metrics.append('%s;desc="%s";dur=%.1f' % (name, desc, dur * 1000))
+        metrics.append('total;dur=%.1f' % (self.elapsed() * 1000))
+        return ', '.join(metrics)
+
+    def breakdown(self) -> str:
+        '''one line summary of the phases, slowest first, for the log'''
+        phases = sorted(self.phases.items(), key=lambda x: -x[1][0])
+        return ' '.join('%s=%.0fms/%i' % (name, dur * 1000, count)
+            for name, (dur, count, _) in phases)
+
+
+def start() -> RequestTimings:
+    timings = RequestTimings()
+    timings.token = _current.set(timings)
+    return timings
+
+
+def stop(timings: RequestTimings):
+    _current.reset(timings.token)
+
+
+def current() -> RequestTimings:
+    '''the RequestTimings of the request being handled, or None'''
+    return _current.get()
+
+
+@contextlib.contextmanager
+def phase(name: str):
+    '''Record how long the body takes as part of phase `name`,
+    in the current request's timings (if any) and in metrics.PHASE_SECONDS.
+    If the phase is already running (e.g., process_clustal_num calling
+    sequence_chunks), the inner call is part of the outer one.'''
+    active = _active.get()
+    if name in active:
+        yield
+        return
+    token = _active.set(active | {name})
+    timings = _current.get()
+    queries = timings.queries if timings else 0
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - t0
+        _active.reset(token)
+        metrics.PHASE_SECONDS.observe(seconds, phase=name)
+        if timings is not None:
+            timings.add(name, seconds, timings.queries - queries)
+
+
+def timed(name: str):
+    '''decorator: every call of the function is part of phase `name`'''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
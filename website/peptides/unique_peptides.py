@@ -4,8 +4,6 @@ found for each variant
 import json
 import pandas as pd
 
-df = pd.read_csv('unique_peptides.csv')
-
 def uniques_per_acc_num(df: pd.DataFrame) -> dict:
     out = {}
     for _, row in df.iterrows():
@@ -24,6 +22,7 @@ def uniques_per_acc_num(df: pd.DataFrame) -> dict:
     return {k: list(v) for k, v in out.items()}
 
 if __name__ == '__main__':
+    df = pd.read_csv('unique_peptides.csv')
     uniques = uniques_per_acc_num(df)
     with open('unique_peptides_per_acc_num.json', 'w') as f:
         json.dump(uniques, f, indent=4)
\ No newline at end of file
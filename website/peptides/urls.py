@@ -7,14 +7,23 @@ urlpatterns = [
     path('', views.index_view, name='index'),
     path('about', views.about_view, name='about'),
     path('alignments/<str:acc_nums>/', views.alignments_view, name='alignments'),
+    path('alignments/<str:acc_nums>/projection', views.alignment_projection, name='alignment_projection'),
+    path('alignments/<str:acc_nums>/stats', views.alignment_stats_json, name='alignment_stats'),
+    path('differential_abundance', views.differential_abundance_view, name='differential_abundance'),
     path('download_alignment/<str:prots>/', views.download_alignment, name='download_alignment'),
     path('get_protein/', views.get_protein, name='get_protein'),
     path('interaction_plot/<str:acc_num>', views.interaction_plot_show, name='interaction_plot'),
+    path('interaction_plot/<str:acc_num>/json', views.interaction_plot_json, name='interaction_plot_json'),
     path('download_interaction_plot_data/<str:acc_num>', views.download_interaction_plot_data, name='download_interaction_plot_data'),
     path('peptides/', views.peptides_csv, name='peptides'),
+    path('peptide_search', views.peptide_search, name='peptide_search'),
+    path('mass_search', views.mass_search, name='mass_search'),
     path('proteins/<str:acc_num>/', views.protein_view, name='proteins'),
     path('proteins/<str:acc_num>/json', views.protein_json, name='proteins_json'),
+    path('proteins/<str:acc_num>/coverage', views.coverage_view, name='coverage'),
+    path('proteins/<str:acc_num>/similar', views.similar_json, name='similar'),
     path('proteins/json_schema', views.protein_json_schema, name = 'protein_json_schema'),
     path('request_alignment/', views.request_alignment, name='request_alignment'),
     path('site_map', views.site_map, name='site_map'),
+    path('metrics', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -1,39 +1,100 @@
 # lib libraries
+from datetime import datetime, timezone
+import functools
+import hashlib
 import json
 import logging
 from pathlib import Path
 import re
 import traceback
 # 3rd party libraries
+from asgiref.sync import sync_to_async
+from django.db.models import Count
+from django.db.models.functions import Length
 from django.http import HttpResponseRedirect, HttpResponse, JsonResponse
-from django.shortcuts import get_object_or_404, render
+from django import shortcuts
+from django.shortcuts import get_object_or_404
 from django.urls import reverse
-# from django.views.decorators.cache import never_cache
-from requests import Timeout
+from django.conf import settings
+from django.views.decorators.cache import cache_control
+from django.views.decorators.cache import never_cache
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, last_modified
 
-from .align_isoforms import get_isoforms, get_all_seqs, request_multi_alignment, get_protein as uniprot_json, align_isoforms
-from .models import Protein, Peptide, Isoform, Alignment, is_acc_num
-from .sequence_chunkers import sequence_chunks, process_clustal_num
-from . import interaction_plot
+from .align_isoforms import get_isoforms, get_all_seqs, get_protein as uniprot_json, align_isoforms
+from .align_isoforms import aalign_isoforms, arequest_multi_alignment
+from .models import Protein, Peptide, Isoform, Alignment, UniquePeptide, is_acc_num
+from .sequence_chunkers import sequence_chunks, process_clustal_num, seq_set_key
+from . import metrics
+from .caching import cached_view
+from .kmer_index import find_peptides
+# NumPy, pandas and Bokeh take most of a worker's startup time, so the modules
+# that need them (alignment_stats, differential_abundance, digest, ingest,
+# interaction_plot, masses, similarity) are imported by the views that use them
+from .timing import phase
 
 CODE_DIR = Path(__file__).parent
 
+
+def render(*args, **kwargs):
+    '''django.shortcuts.render, timed as the "render" phase of the request
+    (including any queries that are only run by the template)'''
+    with phase('render'):
+        return shortcuts.render(*args, **kwargs)
+
+def index_data() -> list:
+    '''One row (accession number, number of peptides, sequence length,
+    number of isoforms, whether it has an alignment) for each primary isoform,
+    the same as calling get_peptides, get_isoforms and get_alignments on each
+    protein, but with four queries no matter how many proteins there are.
+    '''
+    proteins = (Protein.objects
+        .filter(isoform_num = 1)
+        .annotate(lenseq = Length('sequence'))
+        .values_list('prot_id', 'acc_num', 'lenseq')
+    )
+    npeps = dict(Peptide.objects
+        .values('prot')
+        .annotate(n = Count('pkey'))
+        .values_list('prot', 'n')
+    )
+    # the isoform graph: a primary isoform is prot_1 of all its isoforms
+    isoforms_of = {}
+    primary_of = {}
+    for prot_1, prot_2 in Isoform.objects.values_list('prot_1', 'prot_2'):
+        isoforms_of.setdefault(prot_1, set()).add(prot_2)
+        primary_of.setdefault(prot_2, prot_1)
+    aligned = set()
+    for prots in Alignment.objects.values_list('prots', flat=True):
+        for acc_num in prots.split(','):
+            aligned.add(acc_num)
+            aligned.add(acc_num.split('-')[0])
+    data = []
+    for prot_id, acc_num, lenseq in proteins:
+        if prot_id in isoforms_of:
+            isos = isoforms_of[prot_id]
+        elif prot_id in primary_of:
+            primary = primary_of[prot_id]
+            isos = isoforms_of[primary] | {primary}
+        else:
+            isos = set()
+        data.append({
+            'acc_num': acc_num,
+            'npeps': npeps.get(acc_num, 0),
+            'lenseq': lenseq,
+            'n_isoforms': len(isos - {prot_id}) + 1,
+            'has_alignment': 'Yes' if acc_num in aligned else 'No',
+        })
+    return data
+
+
+@cached_view('index')
 def index_view(request):
     '''Show only the primary isoforms of proteins in the database.
     Optionally allow to order by length, by number of isoforms,
     or alphabetically.
     '''
-    proteins = Protein.objects.filter(isoform_num = 1)
-    data = [
-        {
-            'acc_num': prot.acc_num,
-            'npeps': len(prot.get_peptides()),
-            'lenseq': len(prot.sequence),
-            'n_isoforms': len(prot.get_isoforms()) + 1,
-            'has_alignment': 'Yes' if len(prot.get_alignments()) > 0 else 'No',
-        }
-        for prot in proteins
-    ]
+    data = index_data()
     orderby = request.GET.get('orderby', 'alpha')
     sort_reverse = orderby[0] == '-'
     if sort_reverse:
@@ -61,6 +122,7 @@ def about_view(request):
     return render(request, 'peptides/about.html')
 
 
+@cached_view('protein')
 def protein_view(request, acc_num: str):
     try:
         width = int(request.GET.get('width', 120))
@@ -75,6 +137,7 @@ def protein_view(request, acc_num: str):
     alignments = prot.get_alignments()
     isoforms = prot.get_isoforms()
     peptides = prot.get_peptides()
+    unique_peptides = UniquePeptide.objects.filter(prot = prot.acc_num).order_by('source', 'location')
     chunks = sequence_chunks(prot.sequence, peptides, width)
     annotated_chunks = []
     chunk_end = 0
@@ -91,6 +154,7 @@ def protein_view(request, acc_num: str):
             'alignments': alignments,
             'isoforms': isoforms,
             'peptides': peptides,
+            'unique_peptides': unique_peptides,
             'sequence_chunks': annotated_chunks,
             'seq_len': len(prot.sequence),
             'num_offset': num_offset,
@@ -98,6 +162,45 @@ def protein_view(request, acc_num: str):
     )
 
 
+@cached_view('coverage')
+def coverage_view(request, acc_num: str):
+    '''How much of each isoform of a protein a digest would cover
+    (theoretically), vs. how much the mass spec peptides do cover.
+    The protease, missed cleavages and peptide lengths can be set in the query.'''
+    from . import digest
+    prot = get_object_or_404(Protein, acc_num = acc_num)
+    enzyme = request.GET.get('enzyme', 'trypsin')
+    if enzyme not in digest.ENZYMES:
+        enzyme = 'trypsin'
+    try:
+        missed_cleavages = min(5, max(0, int(request.GET.get('missed_cleavages', 1))))
+        min_length = max(1, int(request.GET.get('min_length', digest.MIN_LENGTH)))
+        max_length = max(min_length, int(request.GET.get('max_length', digest.MAX_LENGTH)))
+    except ValueError:
+        missed_cleavages, min_length, max_length = 1, digest.MIN_LENGTH, digest.MAX_LENGTH
+    seqs = {prot.acc_num: prot.sequence}
+    seqs.update((iso.acc_num, iso.sequence) for iso in prot.get_isoforms())
+    peptides = (Peptide.objects
+        .filter(prot__in = list(seqs))
+        .annotate(length = Length('peptide'))
+        .values_list('prot', 'location', 'length')
+    )
+    table = digest.coverage_table(seqs, peptides, enzyme, missed_cleavages, min_length, max_length)
+    return render(
+        request,
+        'peptides/coverage.html',
+        context = {
+            'protein': prot,
+            'rows': table.to_dict('records'),
+            'enzymes': list(digest.ENZYMES),
+            'enzyme': enzyme,
+            'missed_cleavages': missed_cleavages,
+            'min_length': min_length,
+            'max_length': max_length,
+        }
+    )
+
+
 def get_all_data_related_to_prot(acc_num: str) -> tuple:
     '''Get all isoforms of protein with UniProt accession number acc_num,
     get a multiple sequence alignment of those isoforms,
@@ -107,40 +210,32 @@ def get_all_data_related_to_prot(acc_num: str) -> tuple:
     (got data for at least one isoform,
     got data for multiple isoforms)
     '''
+    from .ingest import save_families
     prot_seqs, alignment = align_isoforms(acc_num)
     if not prot_seqs:
         return False, False
     if len(prot_seqs) < 2:
         return True, False
-    seq = prot_seqs[acc_num]
-    og_prot = Protein(
-        acc_num = acc_num, 
-        sequence = seq
-    )
-    og_prot.save(force_insert=True)
-    prot_list = ','.join(prot_seqs.keys())
-    # add each isoform to the database
-    for acc_num_2, seq in prot_seqs.items():
-        if acc_num_2 == acc_num:
-            continue
-        if acc_num_2.endswith('-1'):
-            acc_num_2 = acc_num_2[:-2]
-        prot = Protein(
-            acc_num = acc_num_2, 
-            sequence = seq
-        )
-        prot.save(force_insert=True)
-        # also add a relationschip between og_prot and new prot
-        Isoform.objects.create(
-            prot_1 = Protein.objects.get(acc_num = acc_num),
-            prot_2 = Protein.objects.get(acc_num = acc_num_2)
-        )
-    if isinstance(alignment, str):
-        Alignment.objects.create(prots = prot_list, alignment = alignment)
+    save_families([(acc_num, prot_seqs, alignment)])
+    return True, True
+
+
+async def aget_all_data_related_to_prot(acc_num: str) -> tuple:
+    '''get_all_data_related_to_prot, without tying up a thread
+    while waiting on UniProt and the EBI'''
+    from .ingest import save_families
+    prot_seqs, alignment = await aalign_isoforms(acc_num)
+    if not prot_seqs:
+        return False, False
+    if len(prot_seqs) < 2:
+        return True, False
+    await sync_to_async(save_families)([(acc_num, prot_seqs, alignment)])
     return True, True
 
 
-def get_protein(request):
+async def get_protein(request):
+    '''Add a protein and its isoforms from UniProt, and their alignment.
+    Async, so that under ASGI one worker can wait on many of these at once.'''
     try:
         acc_num = request.POST['acc_num']
     except:
@@ -148,14 +243,12 @@ def get_protein(request):
     else:
         if acc_num.endswith('-1'):
             acc_num = acc_num[:-2]
-        try:
-            existing_prot = Protein.objects.get(acc_num = acc_num)
+        existing_prot = await Protein.objects.filter(acc_num = acc_num).afirst()
+        if existing_prot is not None:
             return HttpResponseRedirect(
                 reverse('peptides:proteins', args=(existing_prot.acc_num,))
             )
-        except: # no existing prot, so get the data
-            pass
-        one_prot, multi_prots = get_all_data_related_to_prot(acc_num)
+        one_prot, multi_prots = await aget_all_data_related_to_prot(acc_num)
         if not one_prot:
             response = HttpResponse(
                 "Could not find UniProt data for the accession number " + acc_num
@@ -173,7 +266,9 @@ def get_protein(request):
         )
 
 
+@cached_view('alignments')
 def alignments_view(request, acc_nums: str):
+    from .alignment_stats import AlignmentStats
     try:
         width = int(request.GET.get('width', 60))
     except:
@@ -189,20 +284,106 @@ def alignments_view(request, acc_nums: str):
         .filter(prot__in = acc_num_list)
         .order_by('prot', 'location')
     )
-    alignment_pieces = process_clustal_num(alignment.alignment, peptides, width)
+    unique_peptides = (UniquePeptide.objects
+        .filter(prot__in = acc_num_list)
+        .order_by('prot', 'source', 'location')
+    )
+    alignment_pieces = process_clustal_num(alignment.alignment, peptides, width, alignment.column_map)
+    stats = AlignmentStats.of(alignment)
     return render(
         request,
         'peptides/alignment.html',
         context = {
             'prots': alignment.prots,
             'alignment_pieces': alignment_pieces,
+            'isoform_stats': stats.summary(peptides),
+            'divergent_regions': stats.divergent_regions(),
             'proteins': prot_objs,
             'peptides': peptides,
+            'unique_peptides': unique_peptides,
             'num_offset': num_offset,
         }
     )
 
 
+@cached_view('alignment_projection')
+def alignment_projection(request, acc_nums: str):
+    '''Which residues of the other sequences in an alignment are aligned
+    with a peptide or range of residues of one of them?
+    GET /alignments/<acc_nums>/projection?acc_num=<accession number>&peptide=<peptide>
+    or ...&start=<residue>&end=<residue> (0-based, end exclusive).
+    Returns {"acc_num", "start", "end", "peptide",
+    "projections": {accession number: {"start", "end", "peptide", "identical"} or null}}.'''
+    alignment = get_object_or_404(Alignment, pk=acc_nums)
+    columns = alignment.get_column_map()
+    acc_num = request.GET.get('acc_num', '')
+    if acc_num not in columns.seqs:
+        return JsonResponse({'error': f"{acc_num!r} is not in this alignment."}, status=400)
+    seq = columns.seqs[acc_num]
+    peptide = request.GET.get('peptide', '').upper()
+    if peptide:
+        start = seq.find(peptide)
+        if start < 0:
+            return JsonResponse({'error': f'{peptide} is not in {acc_num}.'}, status=400)
+        end = start + len(peptide)
+    else:
+        try:
+            start, end = int(request.GET['start']), int(request.GET['end'])
+        except (KeyError, ValueError):
+            return JsonResponse({'error': 'Must supply a peptide, or integer start and end.'}, status=400)
+        if not 0 <= start < end <= len(seq):
+            return JsonResponse({'error': f'Need 0 <= start < end <= {len(seq)}.'}, status=400)
+        peptide = seq[start:end]
+    return JsonResponse({
+        'acc_num': acc_num,
+        'start': start,
+        'end': end,
+        'peptide': peptide,
+        'projections': columns.project_peptide(acc_num, start, peptide),
+    })
+
+
+@cached_view('alignment_stats')
+def alignment_stats_json(request, acc_nums: str):
+    '''Per-column statistics of an alignment, and peptide coverage of each sequence.
+    Returns {"length", "identity": [fraction of sequences sharing the most common
+    residue, for each column], "gapped": [sequences with a gap, for each column],
+    "conservation": Clustal conservation line, "isoforms": [AlignmentStats.summary
+    for each sequence], "divergent_regions": [...]} (see alignment_stats.py).'''
+    from .alignment_stats import AlignmentStats
+    alignment = get_object_or_404(Alignment, pk=acc_nums)
+    stats = AlignmentStats.of(alignment)
+    peptides = Peptide.objects.filter(prot__in = list(stats.columns.columns)).only('prot', 'peptide', 'location')
+    return JsonResponse({
+        'length': stats.columns.length,
+        'identity': stats.identity.tolist(),
+        'gapped': stats.gapped.tolist(),
+        'conservation': stats.conservation,
+        'isoforms': stats.summary(peptides),
+        'divergent_regions': stats.divergent_regions(),
+    })
+
+
+def alignment_validators(request, prots: str) -> tuple:
+    '''(ETag, last modified time) of the alignment with primary key prots,
+    or (None, None) if there is no such alignment.
+    Looked up once per request, without loading the alignment itself.
+    '''
+    if not hasattr(request, '_alignment_validators'):
+        validators = (Alignment.objects
+            .filter(pk = prots)
+            .values_list('etag', 'modified')
+            .first()
+        )
+        request._alignment_validators = validators or (None, None)
+    return request._alignment_validators
+
+
+@cache_control(public=True, max_age=3600)
+@condition(
+    etag_func=lambda request, prots: alignment_validators(request, prots)[0] or None,
+    last_modified_func=lambda request, prots: alignment_validators(request, prots)[1],
+)
 def download_alignment(request, prots: str):
     alignment = Alignment.objects.get(pk = prots)
     primary_acc_num = alignment.prots.split(',')[0]
@@ -221,6 +402,9 @@ def download_alignment(request, prots: str):
     )
 
 
+# clients must revalidate this every time, but ConditionalGetMiddleware
+# gives it an ETag so that they only download it again if it changed.
+@cache_control(no_cache=True)
 def protein_json(request, acc_num: str):
     prot = Protein.objects.get(acc_num = acc_num)
     isoform_ids = [iso.acc_num for iso in prot.get_isoforms()]
@@ -238,11 +422,55 @@ def protein_json(request, acc_num: str):
     )
 
 
-def protein_json_schema(request):
+@cached_view('similar')
+def similar_json(request, acc_num: str):
+    '''How similar is a protein to its isoforms, and to every other protein?
+    Returns {"acc_num", "alignments": [{"prots", "acc_nums", "identity":
+    percent identity matrix, in the order of acc_nums}] for each of its alignments,
+    "similar": [{"acc_num", "similarity": estimated Jaccard similarity of their
+    k-mers}] for the most similar proteins in the database} (see similarity.py).'''
+    from . import similarity
+    prot = get_object_or_404(Protein, acc_num = acc_num)
+    alignments = []
+    for alignment in prot.get_alignments():
+        acc_nums, identity = similarity.clustal_identity(alignment.alignment)
+        alignments.append({
+            'prots': alignment.prots,
+            'acc_nums': acc_nums,
+            'identity': identity.round(1).tolist(),
+        })
+    try:
+        n = min(100, max(1, int(request.GET.get('n', 20))))
+    except ValueError:
+        n = 20
+    with phase('similarity'):
+        similar = similarity.similar_proteins(prot.acc_num, n)
+    return JsonResponse({
+        'acc_num': prot.acc_num,
+        'alignments': alignments,
+        'similar': [{'acc_num': other, 'similarity': round(sim, 3)} for other, sim in similar],
+    })
+
+
+@functools.lru_cache(maxsize=None)
+def protein_json_schema_file() -> tuple:
+    '''(contents, ETag, last modified time) of the protein JSON schema,
+    which only changes when the site is redeployed,
+    so it is read once per process'''
     schema_fname = CODE_DIR/'static'/'peptides'/'protein_json_schema.json'
-    with schema_fname.open() as f:
-        schema = json.load(f)
-    return JsonResponse(schema)
+    schema = schema_fname.read_bytes()
+    mtime = datetime.fromtimestamp(schema_fname.stat().st_mtime, tz=timezone.utc)
+    return schema, '"%s"' % hashlib.sha256(schema).hexdigest()[:32], mtime
+
+
+@cache_control(public=True, max_age=24 * 3600)
+@condition(
+    etag_func=lambda request: protein_json_schema_file()[1],
+    last_modified_func=lambda request: protein_json_schema_file()[2],
+)
+def protein_json_schema(request):
+    schema, _, _ = protein_json_schema_file()
+    return HttpResponse(schema, content_type='application/json')
 
 
 def peptides_csv(request):
@@ -309,73 +537,256 @@ def site_map(request):
     return render(request, 'peptides/site_map.html')
 
 
-def request_alignment(request):
+@never_cache
+def metrics_view(request):
+    '''This process's metrics (see metrics.py) in the Prometheus text format.
+    Only served to the addresses in settings.METRICS_ALLOWED_IPS.'''
+    allowed = getattr(settings, 'METRICS_ALLOWED_IPS', ['127.0.0.1', '::1'])
+    if '*' not in allowed and request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponse('Forbidden', status=403)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# more than this many peptides per request should be split into several requests
+MAX_SEARCH_PEPTIDES = 10_000
+
+# a read-only query, POSTed only because the list of peptides may be long
+@csrf_exempt
+@never_cache
+def peptide_search(request):
+    '''Which proteins in the database contain each peptide, and where?
+    GET /peptide_search?peptide=<peptide>&peptide=<peptide>... or
+    POST peptides=<peptides separated by whitespace or commas>.
+    Returns {"peptides": {peptide: [{"acc_num": ..., "locations": [...]}, ...]}}
+    (see kmer_index.py).'''
+    if request.method == 'POST':
+        peptides = request.POST.get('peptides', '').replace(',', ' ').split()
+    else:
+        peptides = [pep for arg in request.GET.getlist('peptide') for pep in arg.replace(',', ' ').split()]
+    peptides = [pep.upper() for pep in peptides]
+    if not peptides:
+        return JsonResponse({'error': 'Must supply at least one peptide.'}, status=400)
+    if len(peptides) > MAX_SEARCH_PEPTIDES:
+        return JsonResponse({'error': f'At most {MAX_SEARCH_PEPTIDES} peptides per request.'}, status=400)
+    invalid = [pep for pep in peptides if not pep.isalpha() or not pep.isascii()]
+    if invalid:
+        return JsonResponse({'error': f"Not peptide sequences: {', '.join(invalid[:10])}"}, status=400)
+    with phase('peptide_search'):
+        hits = find_peptides(peptides)
+    return JsonResponse({'peptides': {
+        pep: [{'acc_num': acc_num, 'locations': locs} for acc_num, locs in prots]
+        for pep, prots in hits.items()
+    }})
+
+
+MAX_PPM = 100
+
+# a read-only query, POSTed only because the list of masses may be long
+@csrf_exempt
+@never_cache
+def mass_search(request):
+    '''Which peptides have a monoisotopic mass within a tolerance of each query?
+    GET /mass_search?mass=<Da>&mass=<Da>...&ppm=<tolerance> or
+    GET /mass_search?mz=<m/z>&charge=<charge>&ppm=<tolerance>, or POST the same
+    fields with masses (or m/z ratios) separated by whitespace or commas.
+    Candidates are mass spec peptides and tryptic digest peptides (see masses.py).
+    Returns {"ppm": ..., "results": [{"mass": query, "candidates": [...]}, ...]}.'''
+    from . import masses
+    params = request.POST if request.method == 'POST' else request.GET
+    field = 'mz' if params.get('mz') else 'mass'
+    values = [x for arg in params.getlist(field) for x in arg.replace(',', ' ').split()]
+    if not values:
+        return JsonResponse({'error': 'Must supply at least one mass or m/z.'}, status=400)
+    if len(values) > MAX_SEARCH_PEPTIDES:
+        return JsonResponse({'error': f'At most {MAX_SEARCH_PEPTIDES} masses per request.'}, status=400)
+    try:
+        values = [float(x) for x in values]
+        ppm = float(params.get('ppm', masses.DEFAULT_PPM))
+        charge = int(params.get('charge', 1))
+    except ValueError:
+        return JsonResponse({'error': 'Masses, m/z, ppm and charge must be numbers.'}, status=400)
+    if not 0 < ppm <= MAX_PPM or charge < 1 or not all(0 < x < float('inf') for x in values):
+        return JsonResponse({'error': f'Masses and charge must be positive, and ppm between 0 and {MAX_PPM}.'},
+            status=400)
+    if field == 'mz':
+        values = [masses.neutral_mass(mz, charge) for mz in values]
+    with phase('mass_search'):
+        found = masses.get_index().search(values, ppm)
+    return JsonResponse({'ppm': ppm, 'results': [
+        {'mass': mass, 'candidates': candidates} for mass, candidates in zip(values, found)
+    ]})
+
+
+async def request_alignment(request):
     '''Sometimes the EBI computer won't return an alignment when the user gets the
     data for a protein and its isoforms.
     This allows the user to resubmit a request for data from the EBI.
     When the request succeeds, or if the protein's alignment was already in 
     the database, redirect to the alignment page.
+    Async, like get_protein.
     '''
     acc_num = request.POST.get('acc_num')
     if not acc_num:
         return HttpResponse("Must supply an accession number when requesting an alignment.")
     if not is_acc_num(acc_num):
         return HttpResponse(f"Can't request an alignment for '{acc_num}' because it's not a valid accession number.")
-    prot = Protein.objects.get(acc_num = acc_num)
-    existing_alignment = prot.get_alignments()
-    isoforms = prot.get_isoforms()
+    try:
+        prot = await Protein.objects.aget(acc_num = acc_num)
+    except Protein.DoesNotExist:
+        response = HttpResponse(f"Can't request an alignment for '{acc_num}' because it's not in the database.")
+        response.status_code = 404
+        return response
+    isoforms = await sync_to_async(lambda: list(prot.get_isoforms()))()
     prot_list = ','.join([acc_num] + [x.acc_num for x in isoforms])
-    if existing_alignment:
-        return HttpResponseRedirect('/alignments/' + prot_list)
+    seq_dict = {prot.acc_num: prot.sequence}
+    seq_dict.update({iso.acc_num: iso.sequence for iso in isoforms})
+    # the same proteins may have been aligned already, listed in another order
+    existing_alignment = (Alignment.objects
+        .filter(seq_set = seq_set_key(seq_dict.values()))
+        .values_list('prots', flat=True)
+    )
+    async for prots in existing_alignment:
+        if set(prots.split(',')) == set(seq_dict):
+            return HttpResponseRedirect('/alignments/' + prots)
     try:
-        seq_dict = {prot.acc_num: prot.sequence}
-        seq_dict.update({iso.acc_num: iso.sequence for iso in isoforms})
-        alignment = request_multi_alignment(seq_dict)
+        # reuses any stored alignment of the same sequences under other names
+        alignment = await arequest_multi_alignment(seq_dict)
     except Exception as ex:
         return HttpResponse("While requesting alignment, got the following error: " + str(ex))
     if not alignment:
         return HttpResponse("The EBI did not return an alignment for protein '" + acc_num + "'. Try again later.")
-    Alignment.objects.create(prots=prot_list, alignment=alignment)
+    await Alignment.objects.acreate(prots=prot_list, alignment=alignment)
     return HttpResponseRedirect("/alignments/" + prot_list)
 
 
-def interaction_plot_show(request, acc_num: str):
+INTERACTION_DATA_DIR = CODE_DIR/'static'/'peptides'/'isoform abundance cancer vs not'
+
+def interaction_data_fname(acc_num: str) -> tuple:
+    '''Return (accession number without isoform suffix,
+    path to the wide CSV of MS intensities for that protein)'''
     try:
         dash_index = acc_num.index('-')
         base_acc_num = acc_num[:dash_index]
     except:
         base_acc_num = acc_num
-    is_histograms = request.GET.get('type', 'hist')[:4] == 'hist'
-    data_dir = CODE_DIR/'static'/'peptides'/'isoform abundance cancer vs not'
-    data_fname = data_dir/f'{base_acc_num}wide.csv'
+    return base_acc_num, INTERACTION_DATA_DIR/f'{base_acc_num}wide.csv'
+
+
+def interaction_data_last_modified(request, acc_num: str):
+    _, data_fname = interaction_data_fname(acc_num)
     try:
-        with data_fname.open() as f:
-            df = interaction_plot.process_csv(f)
-    except:
-        return HttpResponse(
-            'No MS intensity vs. isoform vs. cancer status data could be found for protein %s.' % acc_num
-        )
-    html = interaction_plot.histograms(df) if is_histograms \
-            else interaction_plot.points_with_error_bars(df)
+        mtime = data_fname.stat().st_mtime
+    except OSError:
+        return None
+    return datetime.fromtimestamp(mtime, tz=timezone.utc)
+
+
+def interaction_data_etag(request, acc_num: str):
+    '''the CSV files are only ever replaced wholesale,
+    so their modification time and size identify their contents'''
+    _, data_fname = interaction_data_fname(acc_num)
+    try:
+        stat = data_fname.stat()
+    except OSError:
+        return None
+    return '"%x-%x"' % (stat.st_mtime_ns, stat.st_size)
+
+
+@cached_view('interaction_plot')
+def interaction_plot_show(request, acc_num: str):
+    '''Show an interaction plot for the protein with accession number acc_num.
+    By default the plot is rendered server-side as standalone Bokeh HTML.
+    With the query "render=client", the page only loads BokehJS and
+    fetches the figures from interaction_plot_json.
+    '''
+    from . import interaction_plot
+    base_acc_num, data_fname = interaction_data_fname(acc_num)
+    plot_type = 'hist' if request.GET.get('type', 'hist')[:4] == 'hist' else 'whisker'
+    is_histograms = plot_type == 'hist'
+    client_side = request.GET.get('render') == 'client'
+    if client_side:
+        if not data_fname.exists():
+            return HttpResponse(
+                'No MS intensity vs. isoform vs. cancer status data could be found for protein %s.' % acc_num
+            )
+        plot_html = interaction_plot.bokeh_script_tags()
+        data_url = reverse('peptides:interaction_plot_json', args=(base_acc_num,)) + '?type=' + plot_type
+    else:
+        try:
+            with data_fname.open() as f:
+                df = interaction_plot.process_csv(f)
+        except:
+            return HttpResponse(
+                'No MS intensity vs. isoform vs. cancer status data could be found for protein %s.' % acc_num
+            )
+        with phase('bokeh'):
+            plot_html = interaction_plot.histograms(df) if is_histograms \
+                    else interaction_plot.points_with_error_bars(df)
+        data_url = ''
     return render(
         request,
         'peptides/interaction_plot.html',
         context={
-            'plot_html': html,
+            'plot_html': plot_html,
             'is_histograms': is_histograms,
             'acc_num': base_acc_num,
+            'client_side': client_side,
+            'data_url': data_url,
         }
     )
 
 
-def download_interaction_plot_data(request, acc_num: str):
+@cache_control(public=True, max_age=24 * 3600)
+@last_modified(interaction_data_last_modified)
+def interaction_plot_json(request, acc_num: str):
+    '''Bokeh JSON item for the interaction plot of protein acc_num,
+    for use with Bokeh.embed.embed_item in the browser.
+    The underlying CSV files change very rarely,
+    so browsers and proxies are allowed to cache this.
+    '''
+    from . import interaction_plot
+    _, data_fname = interaction_data_fname(acc_num)
+    is_histograms = request.GET.get('type', 'hist')[:4] == 'hist'
     try:
-        dash_index = acc_num.index('-')
-        base_acc_num = acc_num[:dash_index]
+        with data_fname.open() as f:
+            df = interaction_plot.process_csv(f)
     except:
-        base_acc_num = acc_num
-    data_dir = CODE_DIR/'static'/'peptides'/'isoform abundance cancer vs not'
-    data_fname = data_dir/f'{base_acc_num}wide.csv'
+        return JsonResponse(
+            {'error': 'No MS intensity vs. isoform vs. cancer status data could be found for protein %s.' % acc_num},
+            status=404
+        )
+    with phase('bokeh'):
+        item = interaction_plot.histograms(df, as_json=True) if is_histograms \
+                else interaction_plot.points_with_error_bars(df, as_json=True)
+    return JsonResponse(item)
+
+
+def differential_abundance_view(request):
+    '''Show the isoforms ranked by the difference in their MS intensities
+    between cancer and non-cancer tissue, as computed by
+    `python manage.py differential_abundance`
+    '''
+    from . import differential_abundance
+    rows = differential_abundance.read_results()
+    try:
+        max_q = float(request.GET.get('max_q', 1))
+    except:
+        max_q = 1
+    if max_q < 1:
+        rows = [row for row in rows if row['q_value'] is not None and row['q_value'] <= max_q]
+    for row in rows:
+        row['base_acc_num'] = row['acc_num'].split('-')[0]
+    return render(
+        request,
+        'peptides/differential_abundance.html',
+        context={'rows': rows, 'max_q': max_q}
+    )
+
+
+@cache_control(public=True, max_age=24 * 3600)
+@condition(etag_func=interaction_data_etag, last_modified_func=interaction_data_last_modified)
+def download_interaction_plot_data(request, acc_num: str):
+    base_acc_num, data_fname = interaction_data_fname(acc_num)
     try:
         with data_fname.open() as f:
             csv = f.read()
@@ -44,10 +44,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so that it times everything below it
+    'peptides.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    # WhiteNoise, made to work with async views
+    "peptides.middleware.StaticFilesMiddleware",
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    # adds ETags to responses that don't set their own, and answers
+    # conditional GETs with 304 Not Modified
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -143,12 +149,62 @@ STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-CACHES = {
-    'default': { 
-        # use this during development when you don't want any caching
-        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+# Set DJANGO_CACHE_URL to choose the cache, like DATABASE_URL chooses the database:
+#   redis://host:port/db (or rediss://) for a Redis server shared by all workers
+#   file:///absolute/path for a file-based cache shared by all workers on one machine
+#   dummy:// when you don't want any caching (e.g., during development)
+#   locmem:// for a local-memory cache in each process, which never hears about
+#     writes made by other processes, so pages aren't cached (see peptides/caching.py)
+# By default the cache is kept in files under website/.cache: writes made by any
+# worker or management command (e.g., ingest_proteins) invalidate the pages that
+# every worker on the machine has cached. Use Redis to share it between machines.
+CACHE_URL = os.environ.get('DJANGO_CACHE_URL', f'file://{BASE_DIR / ".cache"}')
+
+if CACHE_URL.startswith(('redis://', 'rediss://')):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
     }
-}
+elif CACHE_URL.startswith('file://'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': CACHE_URL[len('file://'):],
+            'OPTIONS': {'MAX_ENTRIES': 2000},
+        }
+    }
+elif CACHE_URL.startswith('dummy://'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'peptides',
+            'OPTIONS': {'MAX_ENTRIES': 2000},
+        }
+    }
+
+# Where to find the UniProt REST API and the EBI's Clustal Omega service.
+# Leave these unset to use the real services, or point them at the local stub
+# server (python manage.py uniprot_stub) for testing and load testing, e.g.
+#   PEPTIDES_UNIPROT_API_URL=http://127.0.0.1:8765/uniprot
+#   PEPTIDES_EBI_CLUSTALO_URL=http://127.0.0.1:8765/ebi/clustalo
+UNIPROT_API_URL = os.environ.get('PEPTIDES_UNIPROT_API_URL')
+EBI_CLUSTALO_URL = os.environ.get('PEPTIDES_EBI_CLUSTALO_URL')
+
+# requests that take at least this many seconds are logged (with a breakdown
+# of where the time went) by peptides.middleware.ServerTimingMiddleware
+SLOW_REQUEST_SECONDS = float(os.environ.get('PEPTIDES_SLOW_REQUEST_SECONDS', 1.0))
+
+# who may read /metrics (Prometheus text format); a comma-separated list of
+# IP addresses, or * for anyone
+METRICS_ALLOWED_IPS = os.environ.get('PEPTIDES_METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
 
 IGNORABLE_404_URLS = [
     re.compile('/proteins/\w+$'), # acc_nums of proteins not in db
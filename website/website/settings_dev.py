@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/3.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -42,9 +43,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # the same as in settings.py
+    'peptides.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    "peptides.middleware.StaticFilesMiddleware",
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -137,9 +142,19 @@ STATIC_URL = '/static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-CACHES = {
-    'default': { 
-        # use this during development when you don't want any caching
-        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+# the same cache as in production, so that page caching and its invalidation
+# are tried out too; set DJANGO_CACHE_URL=dummy:// when you don't want any caching
+if os.environ.get('DJANGO_CACHE_URL', 'file://').startswith('dummy://'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        }
     }
-}
\ No newline at end of file
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': BASE_DIR / '.cache',
+            'OPTIONS': {'MAX_ENTRIES': 2000},
+        }
+    }
\ No newline at end of file